@@ -0,0 +1,125 @@
+'''
+alpaca_bench.py - Misura del throughput del server Alpaca (dome_alpaca.py)
+
+Uso:
+    python alpaca_bench.py [-h] [-1] [-c nclients] [-n nreqs] [-p port] [ip_addr]
+
+Dove:
+    ip_addr: indirizzo IP del server (default: localhost)
+
+    -1:      apre una nuova connessione per ogni richiesta (come i clienti
+             HTTP/1.0), invece di usare connessioni persistenti
+    -c:      numero di clienti concorrenti (default: {})
+    -n:      numero di richieste per cliente (default: {})
+    -p:      port IP del server (default: {})
+
+Ogni cliente esegue in un thread separato ed invia ciclicamente richieste GET
+delle proprietà interrogate periodicamente dai clienti ASCOM (Azimuth, Slewing,
+ShutterStatus, ...). Al termine vengono mostrati il numero di richieste al
+secondo e la distribuzione dei tempi di risposta.
+
+Il server deve essere già attivo, ad es. con: python dome_alpaca.py -k
+'''
+
+import sys
+import time
+import json
+import getopt
+import http.client
+from threading import Thread
+
+PORT = 7777
+N_CLIENTS = 4
+N_REQUESTS = 500
+
+PROPERTIES = ('azimuth', 'slewing', 'shutterstatus', 'atpark', 'slaved', 'connected')
+
+class Client(Thread):
+    'Cliente di test'
+    def __init__(self, host, port, idn, nreqs, persistent=True):     #pylint: disable=R0913
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.idn = idn
+        self.nreqs = nreqs
+        self.persistent = persistent
+        self.times = []
+        self.errors = 0
+
+    def run(self):
+        conn = None
+        for nreq in range(self.nreqs):
+            prop = PROPERTIES[nreq%len(PROPERTIES)]
+            url = f'/api/v1/dome/0/{prop}?ClientID={self.idn}&ClientTransactionID={nreq+1}'
+            tm0 = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+                conn.request('GET', url)
+                resp = conn.getresponse()
+                data = json.loads(resp.read())
+                if resp.status != 200 or data['ErrorNumber'] != 0:
+                    self.errors += 1
+            except (OSError, http.client.HTTPException, ValueError):
+                self.errors += 1
+                conn.close()
+                conn = None
+                continue
+            self.times.append(time.perf_counter()-tm0)
+            if not self.persistent:
+                conn.close()
+                conn = None
+        if conn:
+            conn.close()
+
+def percentile(values, pct):
+    'percentile of sorted list'
+    if not values:
+        return 0.0
+    return values[min(int(len(values)*pct/100.), len(values)-1)]
+
+def main():
+    'Programma principale'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '1c:hn:p:')
+    except getopt.error:
+        print('Errore argomenti. Usa -h per aiuto')
+        sys.exit()
+    persistent = True
+    nclients = N_CLIENTS
+    nreqs = N_REQUESTS
+    port = PORT
+    for opt, val in opts:
+        if opt == '-h':
+            print(__doc__.format(N_CLIENTS, N_REQUESTS, PORT))
+            sys.exit()
+        if opt == '-1':
+            persistent = False
+        elif opt == '-c':
+            nclients = int(val)
+        elif opt == '-n':
+            nreqs = int(val)
+        elif opt == '-p':
+            port = int(val)
+    host = args[0] if args else '127.0.0.1'
+
+    clients = [Client(host, port, idn+1, nreqs, persistent) for idn in range(nclients)]
+    tm0 = time.perf_counter()
+    for clnt in clients:
+        clnt.start()
+    for clnt in clients:
+        clnt.join()
+    elapsed = time.perf_counter()-tm0
+    times = sorted(x for clnt in clients for x in clnt.times)
+    errors = sum(clnt.errors for clnt in clients)
+    mode = 'connessioni persistenti' if persistent else 'una connessione per richiesta'
+    print(f'Server: {host}:{port} - {nclients} clienti, {nreqs} richieste ciascuno ({mode})')
+    print(f'Richieste completate: {len(times)}, errori: {errors}, tempo: {elapsed:.2f} s')
+    if times:
+        print(f'Throughput: {len(times)/elapsed:.1f} richieste/s')
+        print(f'Tempo di risposta (ms): medio {sum(times)/len(times)*1000.:.3f}, '
+              f'p50 {percentile(times, 50)*1000.:.3f}, p99 {percentile(times, 99)*1000.:.3f}, '
+              f'max {times[-1]*1000.:.3f}')
+
+if __name__ == '__main__':
+    main()
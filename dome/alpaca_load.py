@@ -0,0 +1,430 @@
+'''
+alpaca_load.py - Prova di carico del server Alpaca (dome_alpaca.py) con simulatori
+
+Uso:
+    python alpaca_load.py [-h] [-c nclients] [-e] [-i nidle] [-p port] [-t secs] [-x]
+
+Dove:
+    -c:  numero di clienti di sola lettura (default: {})
+    -e:  usa un server già attivo (non lancia dome_alpaca.py)
+    -i:  numero di connessioni inattive per la prova iniziale (default: {},
+         pari al numero di worker del server)
+    -p:  port IP del server (default: {})
+    -t:  durata della prova in secondi (default: {})
+    -x:  non lancia il simulatore del telescopio (già attivo)
+
+Se non si usa l'opzione -e la procedura lancia il simulatore del telescopio
+(opc/telsimulator.py, nello stesso processo) ed il server con:
+
+    python dome_alpaca.py -k -s -n -p port
+
+e lo termina alla fine della prova con l'azione stop_server.
+
+Prima della prova di carico si aprono nidle connessioni persistenti, si
+esegue una richiesta per ciascuna e le si lascia inattive: un ulteriore
+cliente deve essere servito entro {} s (le connessioni inattive non
+devono trattenere i worker del server fino al timeout).
+
+Traffico generato (ogni cliente in un thread con connessione persistente,
+riaperta se chiusa dal server mentre inattiva):
+
+    - clienti di lettura: GET delle proprietà di cupola, rele e telescopio
+      interrogate periodicamente dai clienti ASCOM
+    - cliente "cupola": movimenti (slewtoazimuth) verso posizioni casuali,
+      abortslew e, se la cupola lo consente, modo slave
+    - cliente "rele": commutazione dei rele
+    - cliente "telescopio": puntamenti (slewtocoordinatesasync) e tracking
+
+Invarianti verificate:
+
+    - ogni risposta ha codice HTTP 200, è JSON valido, riporta il
+      ClientTransactionID della richiesta ed un ServerTransactionID mai
+      usato in precedenza
+    - nessun errore Alpaca per comandi validi
+    - un cliente è servito anche se tutti i worker hanno connessioni inattive
+    - Azimuth sempre in [0, 360)
+    - al termine di un movimento la cupola è entro la tolleranza dal target
+    - lo stato di un rele letto dopo un comando è quello impostato
+    - le coordinate target del telescopio sono quelle impostate
+    - Slaved vale True dopo il comando slaved=True e False dopo abortslew
+
+Al termine vengono mostrati il numero di richieste al secondo, i tempi di
+risposta (p50, p99, max) per tipo di richiesta e le violazioni rilevate.
+La procedura termina con codice 1 se ci sono state violazioni.
+'''
+
+import sys
+import os
+import time
+import json
+import random
+import getopt
+import select
+import subprocess
+import http.client
+from threading import Thread, Lock, Event
+from urllib.parse import urlencode
+
+from alpaca_bench import percentile
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(THIS_DIR, "..")))
+
+PORT = 7777
+N_CLIENTS = 8
+DURATION = 30
+N_IDLE = 8               # Connessioni inattive (default worker di dome_alpaca.py)
+
+START_TIMEOUT = 20       # Attesa massima avvio server (sec)
+SLEW_TIMEOUT = 120       # Attesa massima fine movimento cupola (sec)
+IDLE_WAIT = 2.           # Attesa massima con connessioni inattive (sec)
+MAX_SLEW = 15.           # Ampiezza massima movimenti cupola (gradi)
+RA_PREC = 2./3600.       # Precisione coordinate target telescopio (ore)
+DE_PREC = 2./3600.       # Precisione coordinate target telescopio (gradi)
+
+READS = (('dome', 'azimuth'), ('dome', 'slewing'), ('dome', 'shutterstatus'),
+         ('dome', 'atpark'), ('dome', 'slaved'), ('dome', 'connected'),
+         ('switch', 'getswitch?Id=1'), ('switch', 'getswitchvalue?Id=2'),
+         ('telescope', 'rightascension'), ('telescope', 'declination'),
+         ('telescope', 'slewing'), ('telescope', 'tracking'))
+
+class Results:
+    'Risultati raccolti dai clienti'
+    def __init__(self):
+        self.lock = Lock()
+        self.times = {}           # tipo richiesta: lista tempi
+        self.violations = []
+        self.transids = set()
+        self.slews = 0
+        self.toggles = 0
+
+    def record(self, kind, elapsed, transid):
+        'Registra una richiesta'
+        with self.lock:
+            self.times.setdefault(kind, []).append(elapsed)
+            if transid in self.transids:
+                self.violations.append(f'ServerTransactionID ripetuto: {transid}')
+            self.transids.add(transid)
+
+    def violation(self, msg):
+        'Registra una violazione'
+        with self.lock:
+            self.violations.append(msg)
+
+def dropped(conn):
+    'Verifica se una connessione inattiva è stata chiusa dal server'
+    if conn.sock is None:
+        return False
+    return bool(select.select([conn.sock], [], [], 0)[0])  # leggibile: fine file
+
+class Client(Thread):
+    'Cliente Alpaca di base: esegue step() fino allo stop'
+    def __init__(self, port, idn, results, stop):    #pylint: disable=R0913
+        super().__init__(daemon=True)
+        self.port = port
+        self.idn = idn
+        self.results = results
+        self.stop = stop
+        self.ntrans = 0
+        self.conn = None
+
+    def call(self, method, dev, command, kind, **params):  #pylint: disable=R0913
+        'Esegue richiesta, verifica invarianti e riporta il valore'
+        self.ntrans += 1
+        ids = {'ClientID': self.idn, 'ClientTransactionID': self.ntrans}
+        if method == 'GET':
+            sep = '&' if '?' in command else '?'
+            url = f'/api/v1/{dev}/0/{command}{sep}{urlencode(ids)}'
+            body = None
+            headers = {}
+        else:
+            url = f'/api/v1/{dev}/0/{command}'
+            body = urlencode(dict(params, **ids))
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        tm0 = time.perf_counter()
+        try:
+            if self.conn is not None and dropped(self.conn):   # come i clienti HTTP
+                self.conn.close()                              # (es.: urllib3)
+                self.conn = None
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+            self.conn.request(method, url, body, headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException) as exc:
+            self.conn.close()
+            self.conn = None
+            self.results.violation(f'{method} {dev}/{command}: errore di comunicazione ({exc})')
+            return None
+        elapsed = time.perf_counter()-tm0
+        where = f'{method} {dev}/{command}'
+        if resp.status != 200:
+            self.results.violation(f'{where}: HTTP {resp.status} ({data[:80]})')
+            return None
+        try:
+            reply = json.loads(data)
+        except ValueError:
+            self.results.violation(f'{where}: risposta non JSON ({data[:80]})')
+            return None
+        self.results.record(kind, elapsed, reply.get('ServerTransactionID'))
+        if reply.get('ClientTransactionID') != self.ntrans:
+            self.results.violation(f'{where}: ClientTransactionID errato')
+        if reply.get('ErrorNumber'):
+            self.results.violation(f'{where}: errore {reply["ErrorNumber"]} '
+                                   f'({reply.get("ErrorMessage")})')
+            return None
+        return reply.get('Value')
+
+    def get(self, dev, command):
+        'Richiesta GET'
+        return self.call('GET', dev, command, 'GET')
+
+    def put(self, dev, command, **params):
+        'Richiesta PUT'
+        return self.call('PUT', dev, command, 'PUT', **params)
+
+    def step(self):
+        'Un ciclo di traffico (da implementare nelle sottoclassi)'
+        raise NotImplementedError
+
+    def run(self):
+        while not self.stop.is_set():
+            self.step()
+        if self.conn:
+            self.conn.close()
+
+class Reader(Client):
+    'Cliente di sola lettura'
+    reads = READS
+
+    def step(self):
+        dev, command = random.choice(self.reads)
+        value = self.get(dev, command)
+        if command == 'azimuth' and value is not None and not 0. <= value < 360.:
+            self.results.violation(f'Azimuth fuori intervallo: {value}')
+
+class DomeMover(Client):
+    'Cliente che muove la cupola'
+    def __init__(self, port, idn, results, stop, params):  #pylint: disable=R0913
+        super().__init__(port, idn, results, stop)
+        self.tolerance = 2*params['maxerr']*360./params['n360']
+        self.canslave = params['canslave']
+
+    def wait_stop(self):
+        'Attende fine movimento. Riporta azimuth finale'
+        tend = time.monotonic()+SLEW_TIMEOUT
+        while time.monotonic() < tend:
+            if self.stop.is_set():
+                return None
+            if not self.get('dome', 'slewing'):
+                return self.get('dome', 'azimuth')
+            self.stop.wait(0.2)
+        self.results.violation('Timeout attesa fine movimento cupola')
+        return None
+
+    def step(self):
+        azh = self.get('dome', 'azimuth')
+        if azh is None:
+            self.stop.wait(1)
+            return
+        target = (azh+random.uniform(-MAX_SLEW, MAX_SLEW))%360.
+        self.put('dome', 'slewtoazimuth', Azimuth=f'{target:.2f}')
+        self.results.slews += 1
+        if random.random() < 0.2:
+            self.stop.wait(random.uniform(0.5, 2))
+            self.put('dome', 'abortslew')
+            self.wait_stop()
+        else:
+            final = self.wait_stop()
+            if final is not None:
+                dist = abs((final-target+180.)%360.-180.)
+                if dist > self.tolerance:
+                    self.results.violation(f'Cupola fuori tolleranza: target {target:.2f}, '
+                                           f'posizione {final:.2f}')
+        if self.canslave and not self.stop.is_set():
+            self.put('dome', 'slaved', Slaved='True')
+            if self.get('dome', 'slaved') is not True:
+                self.results.violation('Slaved non attivo dopo il comando')
+            self.stop.wait(2)
+            self.put('dome', 'abortslew')
+            if self.get('dome', 'slaved') is not False:
+                self.results.violation('Slaved attivo dopo abortslew')
+            self.wait_stop()
+
+class SwitchToggler(Client):
+    'Cliente che commuta i rele'
+    def step(self):
+        idn = random.randint(1, 4)
+        state = random.random() < 0.5
+        self.put('switch', 'setswitch', Id=idn, State=str(state))
+        self.results.toggles += 1
+        value = self.get('switch', f'getswitch?Id={idn}')
+        if value is not None and bool(value) != state:
+            self.results.violation(f'Rele {idn}: letto {value}, impostato {state}')
+        self.stop.wait(0.1)
+
+class TelescopeMover(Client):
+    'Cliente che punta il telescopio'
+    def step(self):
+        rah = random.uniform(0, 24)
+        ded = random.uniform(-20, 80)
+        self.put('telescope', 'slewtocoordinatesasync',
+                 RightAscension=f'{rah:.5f}', Declination=f'{ded:.5f}')
+        tra = self.get('telescope', 'targetrightascension')
+        tde = self.get('telescope', 'targetdeclination')
+        if tra is not None and abs((tra-rah+12.)%24.-12.) > RA_PREC:
+            self.results.violation(f'Target A.R. letto {tra:.5f}, impostato {rah:.5f}')
+        if tde is not None and abs(tde-ded) > DE_PREC:
+            self.results.violation(f'Target Dec. letto {tde:.5f}, impostato {ded:.5f}')
+        self.put('telescope', 'tracking', Tracking=str(random.random() < 0.5))
+        self.stop.wait(1)
+
+def device_types(port):
+    'Tipi di dispositivi configurati nel server'
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', '/management/v1/configureddevices')
+    value = json.loads(conn.getresponse().read())['Value']
+    conn.close()
+    return [x['DeviceType'] for x in value]
+
+def start_telsim():
+    'Lancia simulatore telescopio nello stesso processo'
+    from opc import telsimulator            #pylint: disable=C0415
+    telescope = telsimulator.LX200(0.0)
+    telescope.start()
+    return telescope
+
+def start_server(port):
+    'Lancia dome_alpaca.py con simulatori e attende che risponda'
+    proc = subprocess.Popen([sys.executable, os.path.join(THIS_DIR, 'dome_alpaca.py'),  #pylint: disable=R1732
+                             '-k', '-s', '-n', '-p', str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    tend = time.monotonic()+START_TIMEOUT
+    while time.monotonic() < tend:
+        if proc.poll() is not None:
+            break
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    print('Errore: il server non risponde')
+    sys.exit(1)
+
+def check_idle(port, nidle, results):
+    'Verifica che connessioni persistenti inattive non blocchino altri clienti'
+    idle = [Reader(port, 100+idn, results, None) for idn in range(nidle)]
+    for clnt in idle:
+        clnt.get('dome', 'azimuth')      # la connessione resta aperta
+    late = Reader(port, 100+nidle, results, None)
+    tm0 = time.perf_counter()
+    late.get('dome', 'azimuth')
+    elapsed = time.perf_counter()-tm0
+    print(f'Cliente con {nidle} connessioni inattive servito in {elapsed*1000.:.1f} ms')
+    if elapsed > IDLE_WAIT:
+        results.violation(f'cliente con {nidle} connessioni inattive servito '
+                          f'dopo {elapsed:.2f} s')
+    for clnt in idle+[late]:
+        if clnt.conn:
+            clnt.conn.close()
+
+def report(results, elapsed, metrics):
+    'Mostra risultati'
+    total = sum(len(x) for x in results.times.values())
+    print(f'Richieste: {total} in {elapsed:.1f} s - {total/elapsed:.1f} richieste/s')
+    print(f'Movimenti cupola: {results.slews}, comandi rele: {results.toggles}')
+    for kind, times in sorted(results.times.items()):
+        times.sort()
+        print(f'  {kind}: {len(times)} richieste, tempo di risposta (ms): '
+              f'p50 {percentile(times, 50)*1000.:.2f}, p99 {percentile(times, 99)*1000.:.2f}, '
+              f'max {times[-1]*1000.:.2f}')
+    if metrics:
+        print(f'Richieste lente registrate dal server: {metrics["slow"]} '
+              f'(soglia: {metrics["slow_ms"]:.0f} ms)')
+    print(f'Violazioni: {len(results.violations)}')
+    for msg in results.violations[:20]:
+        print('  -', msg)
+    if len(results.violations) > 20:
+        print('  ...')
+
+def main():                          #pylint: disable=R0912,R0914,R0915
+    'Programma principale'
+    try:
+        opts = getopt.getopt(sys.argv[1:], 'c:hei:p:t:x')[0]
+    except getopt.error:
+        print('Errore argomenti. Usa -h per aiuto')
+        sys.exit()
+    nclients = N_CLIENTS
+    nidle = N_IDLE
+    port = PORT
+    duration = DURATION
+    launch = True
+    telsim = True
+    for opt, val in opts:
+        if opt == '-h':
+            print(__doc__.format(N_CLIENTS, N_IDLE, PORT, DURATION, IDLE_WAIT))
+            sys.exit()
+        if opt == '-c':
+            nclients = int(val)
+        elif opt == '-e':
+            launch = False
+        elif opt == '-i':
+            nidle = int(val)
+        elif opt == '-p':
+            port = int(val)
+        elif opt == '-t':
+            duration = float(val)
+        elif opt == '-x':
+            telsim = False
+
+    proc = None
+    if launch:
+        if telsim:
+            start_telsim()
+        proc = start_server(port)
+    results = Results()
+    stop = Event()
+    setup = Reader(port, 0, results, stop)
+    setup.put('dome', 'connected', Connected='True')
+    params = setup.put('dome', 'action', Action='get_params')
+    if params is None:
+        print('Errore: parametri cupola non disponibili')
+        sys.exit(1)
+    telescope = 'Telescope' in device_types(port) and setup.get('telescope', 'connected')
+    if not telescope:
+        Reader.reads = tuple(x for x in READS if x[0] != 'telescope')
+        print('Telescopio non disponibile: traffico solo per cupola e rele')
+    clients = [Reader(port, idn+1, results, stop) for idn in range(nclients)]
+    clients.append(DomeMover(port, nclients+1, results, stop, params))
+    clients.append(SwitchToggler(port, nclients+2, results, stop))
+    if telescope:
+        clients.append(TelescopeMover(port, nclients+3, results, stop))
+    setup.conn.close()                 # would be closed by the server while idle
+    setup.conn = None
+    if nidle > 0:
+        check_idle(port, nidle, results)
+    tm0 = time.perf_counter()
+    for clnt in clients:
+        clnt.start()
+    stop.wait(duration)
+    stop.set()
+    for clnt in clients:
+        clnt.join(SLEW_TIMEOUT)
+    elapsed = time.perf_counter()-tm0
+    setup.put('dome', 'abortslew')
+    metrics = setup.put('dome', 'action', Action='get_metrics')
+    if proc:
+        setup.put('dome', 'action', Action='stop_server')
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    report(results, elapsed, metrics)
+    sys.exit(1 if results.violations else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+'''
+calib_fit.py - Analisi dei dati di calibrazione cupola (non interattiva)
+
+Calcola i parametri di calibrazione (accelerazione, decelerazione, vmax, nstop,
+tsafe, ptable) da tracciati registrati, senza richiedere la cupola reale.
+I tracciati possono essere letti da un file dome_dyn.json o generati con il
+simulatore k8055_simulator.
+
+Uso:
+
+    python calib_fit.py [-h] [-k] [-o file] [dyn_file]
+
+dove:
+
+    -h:       mostra questa pagina di descrizione
+    -k:       genera il tracciato con il simulatore k8055 (con orologio
+              virtuale e modello dinamico ricavato da dyn_file) invece di
+              leggerlo da file
+    -o file:  scrive i risultati (formato JSON) nel file dato
+
+    dyn_file: file con dati dinamici (default: dome_dyn.json)
+
+I risultati sono scritti su stdout in formato JSON e possono essere usati
+per test di regressione delle procedure di calcolo.
+'''
+
+import sys
+import os
+import time
+import json
+import getopt
+
+import numpy as np
+
+#pylint: disable=W0401,W0614
+from dome_tools import *
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+DYN_HTIME = 12     # Semidurata della misura dei parametri dinamici
+TSAFE = 1.5        # Intervallo per verifica cupola ferma
+STEP_INCR = 0.5    # Incremento durata impulsi per tabella piccoli movimenti
+RESID_TOL = 1.e-9  # Tolleranza relativa per confronto dei residui dei fit
+
+def _suffix_fit(times, counts):
+    '''
+    Fit lineare di tutti i tratti finali times[k:], counts[k:]
+
+    Riporta l'array dei residui quadratici medi per ogni k
+    '''
+    tms = times-times.mean()                   # riduce errori di arrotondamento
+    cns = counts-counts.mean()
+    def rcum(arr):
+        return np.cumsum(arr[::-1])[::-1]
+    num = rcum(np.ones_like(tms))
+    s_t = rcum(tms)
+    s_c = rcum(cns)
+    s_tt = rcum(tms*tms)-s_t*s_t/num
+    s_tc = rcum(tms*cns)-s_t*s_c/num
+    s_cc = rcum(cns*cns)-s_c*s_c/num
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sse = np.where(s_tt > 0, s_cc-s_tc*s_tc/s_tt, s_cc)
+    return sse/num
+
+def _polyfit_resid(times, counts, kidx):
+    'Residuo quadratico medio del fit di times[k:], counts[k:] calcolato con np.polyfit'
+    res = np.polyfit(times[kidx:], counts[kidx:], 1, full=True)[1]
+    return res[0]/len(times[kidx:])
+
+def _first_min(times, counts, guard):
+    '''
+    Primo indice k >= 1 per cui il residuo del fit lineare di times[k:],
+    counts[k:] non è minore di quello per k-1 (ricerca del minimo come
+    in dome_calib). Riporta None se k supera guard
+
+    I residui sono calcolati per tutti i k con somme cumulative. Quando
+    la differenza fra due residui consecutivi è confrontabile con gli
+    errori di arrotondamento (es.: tratto finale con conteggio costante)
+    il confronto è fatto con i residui calcolati con np.polyfit, per
+    ottenere esattamente lo stesso risultato della ricerca sequenziale
+    '''
+    resid = _suffix_fit(times, counts)
+    tol = RESID_TOL*max(1.0, float(resid.max()))
+    diff = resid[1:]-resid[:-1]
+    exact = {}
+    def polyfit_resid(kidx):
+        if kidx not in exact:
+            exact[kidx] = _polyfit_resid(times, counts, kidx)
+        return exact[kidx]
+    for kidx in np.flatnonzero(diff > -tol)+1:       # crescenti o incerti
+        kidx = int(kidx)
+        if kidx > guard:
+            return None
+        if diff[kidx-1] > tol or polyfit_resid(kidx) >= polyfit_resid(kidx-1):
+            return kidx
+    return None
+
+def accel_params(times, counts, nstop):
+    'Calcola parametri della fase di accelerazione. Riporta: end_accel, vmax'
+    times = np.asarray(times, dtype=float)[:nstop]
+    counts = np.asarray(counts, dtype=float)[:nstop]
+    end_accel = _first_min(times, counts, nstop/2)
+    if end_accel is None:
+        return None, None
+    vmax = np.polyfit(times[end_accel:], counts[end_accel:], 1)[0]
+    return end_accel, float(vmax)
+
+def decel_params(times, counts, nstop):
+    'Calcola parametri della fase di decelerazione. Riporta: end_decel'
+    times = np.asarray(times, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    guard = (len(times)-nstop)/2
+    end_decel = _first_min(times[nstop:], counts[nstop:], guard)
+    if end_decel is None:
+        return None
+    return end_decel+nstop
+
+def tsafe_param(times, counts):
+    'Calcola intervallo di attesa per verifica stop'
+    times = np.asarray(times, dtype=float)
+    counts = np.asarray(counts)
+    stptm = times[:-1][np.diff(counts) != 0]   # istanti di transizione
+    if len(stptm) < 2:
+        return TSAFE
+    return float((stptm[-1]-stptm[-2])*1.2)
+
+def make_ptable(step_times, step_counts):
+    'Tabella durata impulsi in funzione dello spostamento (conteggi)'
+    step_counts = np.maximum.accumulate(np.asarray(step_counts, dtype=float))
+    return np.interp(np.arange(int(step_counts[-1])), step_counts, step_times).tolist()
+
+def fit_dyn(dyn_data):
+    '''
+    Calcola parametri di calibrazione da dati dinamici
+
+    dyn_data: dizionario con i dati dinamici (come in dome_dyn.json)
+
+    Riporta dizionario con i parametri (come in dome_data.json) ed i valori
+    ausiliari: end_accel, end_decel (indici nei tracciati)
+    '''
+    times = np.asarray(dyn_data['times'], dtype=float)
+    counts = np.asarray(dyn_data['counts'], dtype=float)
+    nstop = dyn_data['nstop']
+    end_accel, vmax = accel_params(times, counts, nstop)
+    end_decel = decel_params(times, counts, nstop)
+    if end_accel is None or end_decel is None:
+        raise ValueError('Il calcolo dei parametri dinamici non converge')
+    ret = {'tstart': float(times[end_accel]),
+           'nstart': int(counts[end_accel]),
+           'tstop': float(times[end_decel]-times[nstop]),
+           'nstop': int(counts[end_decel]-counts[nstop]),
+           'vmax': vmax,
+           'tsafe': tsafe_param(times, counts),
+           'end_accel': end_accel,
+           'end_decel': end_decel}
+    if 'n360' in dyn_data and 't360' in dyn_data:
+        ret['n360'] = int(dyn_data['n360'])
+        ret['t360'] = float(dyn_data['t360'])
+        ret['tpoll'] = float(dyn_data['t360']/dyn_data['n360']/5)
+    if 'hoffset' in dyn_data:
+        ret['hoffset'] = int(dyn_data['hoffset'])
+    if 'ptable' in dyn_data:
+        ret['ptable'] = dyn_data['ptable']
+    return ret
+
+################################################ Registrazione tracciati
+
+def safe_stop(handle, direct, tsafe=TSAFE, clock=time):
+    '''
+    Stop cupola e attesa inerzia. Riporta: conteggio allo stop, conteggio finale, tempo
+
+    clock: orologio usato per le attese (default: modulo time, oppure
+           k8055_simulator.VirtualClock)
+    '''
+    handle.ClearDigitalChannel(direct)
+    cnt0 = cntstop = handle.ReadCounter(ENCODER)
+    tm0 = tm1 = clock.time()
+    while True:
+        clock.sleep(0.01)
+        cnt1 = handle.ReadCounter(ENCODER)
+        if cnt1 == cnt0:
+            tm1 = clock.time()
+            if tm1-tm0 >= tsafe:
+                break
+            continue
+        cnt0 = cnt1
+        tm0 = clock.time()
+    return cntstop, cnt1, tm1-tm0
+
+def record_trace(handle, tpoll, htime=DYN_HTIME, clock=time):
+    '''
+    Registra tracciato di accelerazione/decelerazione
+
+    Il motore viene acceso per htime secondi, poi spento, ed il contatore
+    viene campionato con periodo tpoll per 2*htime secondi.
+
+    Riporta dizionario con: times, counts, nstop, tpoll
+    '''
+    cnts = []
+    tmes = []
+    safe_clear_counter(handle)
+    handle.SetDigitalChannel(RIGHT_MOVE)
+    stoptime0 = clock.time()+htime
+    stoptime1 = stoptime0+htime
+    idx = 0
+    stopidx = 0
+    while True:
+        tme = clock.time()
+        if stopidx == 0 and tme >= stoptime0:
+            stopidx = idx
+            handle.ClearDigitalChannel(RIGHT_MOVE)
+        if tme >= stoptime1:
+            break
+        idx += 1
+        tmes.append(tme)
+        cnts.append(handle.ReadCounter(ENCODER))
+        clock.sleep(tpoll)
+    tmes = np.asarray(tmes)
+    cnts = np.asarray(cnts)
+    return {'times': (tmes-tmes[0]).tolist(), 'counts': (cnts-cnts[0]).tolist(),
+            'nstop': stopidx, 'tpoll': tpoll}
+
+def record_steps(handle, max_t, tsafe=TSAFE, verbose=False, clock=time):  #pylint: disable=R0913
+    'Misura spostamenti per impulsi di durata crescente. Riporta: durate, conteggi'
+    times = [0.0]
+    counts = [0]
+    tstep = STEP_INCR
+    while tstep <= max_t:
+        handle.ClearAllDigital()
+        safe_clear_counter(handle)
+        handle.SetDigitalChannel(RIGHT_MOVE)
+        clock.sleep(tstep)
+        cnt = safe_stop(handle, RIGHT_MOVE, tsafe, clock)[1]
+        if verbose:
+            print('Tstep:', tstep, ' counts:', cnt)
+        times.append(tstep)
+        counts.append(cnt)
+        tstep += STEP_INCR
+    return times, counts
+
+def simulate(dyn_file=None, htime=DYN_HTIME, tpoll=0.05, tsafe=TSAFE,  #pylint: disable=R0913
+             noise=0.0, seed=None):
+    '''
+    Genera dati dinamici con il simulatore k8055 (con orologio virtuale)
+
+    dyn_file: file con dati dinamici per il modello del simulatore. Se None
+              si usa il modello di default del simulatore
+    '''
+    from k8055_simulator import K8055Simulator, VirtualClock      #pylint: disable=C0415
+    clock = VirtualClock()
+    handle = K8055Simulator(clock=clock, dyn_file=dyn_file, noise=noise, seed=seed)
+    handle.OpenDevice(K8055_PORT)
+    dyn = record_trace(handle, tpoll, htime, clock)
+    end_accel = accel_params(dyn['times'], dyn['counts'], dyn['nstop'])[0]
+    max_t = (dyn['times'][end_accel] if end_accel else htime/2)+0.6
+    step_times, step_counts = record_steps(handle, max_t, tsafe, clock=clock)
+    dyn['ptable'] = make_ptable(step_times, step_counts)
+    return dyn
+
+def main():
+    'Programma principale'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hko:')
+    except getopt.error:
+        print('Errore argomenti. Usa -h per aiuto')
+        sys.exit()
+    simul = False
+    outfile = None
+    for opt, val in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit()
+        elif opt == '-k':
+            simul = True
+        elif opt == '-o':
+            outfile = val
+    dyn_file = args[0] if args else os.path.join(THIS_DIR, DOME_DYN_FILE)
+    if simul:
+        dyn_data = simulate(dyn_file)
+    else:
+        with open(dyn_file, encoding='utf8') as f_in:
+            dyn_data = json.load(f_in)
+    try:
+        result = fit_dyn(dyn_data)
+    except ValueError as exc:
+        print('Errore:', exc)
+        sys.exit(1)
+    result['ptable'] = [round(x, 4) for x in result.get('ptable', [])]
+    text = json.dumps(result, indent=2)
+    print(text)
+    if outfile:
+        with open(outfile, 'w', encoding='utf8') as f_out:
+            f_out.write(text)
+
+if __name__ == '__main__':
+    main()
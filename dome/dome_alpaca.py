@@ -3,7 +3,8 @@ dome_alpaca.py - Alpaca server for Gambato dome controller
 
 Usage:
 
-    python dome_alpaca.py [-d] [-h] [-k] [-i] [-l logfile] [-p al_port] [-s]
+    python dome_alpaca.py [-d] [-h] [-k] [-i] [-l logfile] [-m msec] [-n] [-p al_port] [-s]
+                          [-t] [-w nworkers]
 
 where:
 
@@ -12,8 +13,37 @@ where:
     -k   use K8055 simulator
     -i   Set italian language for error messages
     -l   Specify path of a log file
+    -m   Log requests slower than msec milliseconds (default: {})
+    -n   Disable the Alpaca discovery responder
     -p   Specify IP port for alpaca (default: {})
     -s   use telescope simulator
+    -t   Disable the Alpaca telescope device
+    -w   Number of worker threads of Alpaca server (default: {})
+
+The Alpaca server uses HTTP/1.1 persistent connections: each connection is
+served by a thread of a bounded pool, so a slow request does not block
+other clients. When all workers are busy new connections wait in the
+listen queue, connections idle between requests for more than {} seconds
+are closed and busy connections are closed after the current request;
+otherwise idle connections are closed after {} seconds.
+
+The Alpaca discovery protocol is supported by a responder listening on UDP
+port {}, in a separate thread, and by the management API (apiversions,
+description, configureddevices).
+
+The Alpaca telescope device gives access to the OnStep controller through
+a single communicator shared by all clients: values read are cached for a
+short time and concurrent reads are coalesced (see tel_cache.py).
+
+Request metrics (counts, latency histograms and errors per endpoint, call
+counts and rates per client) are returned by the custom action get_metrics
+of the dome device. Requests slower than the threshold given with -m are
+logged with endpoint and client, to find clients overloading the server.
+
+Non standard status stream: a GET request to {} opens a Server-Sent
+Events stream which sends a JSON status record each time the dome status
+changes (e.g.: curl -N http://localhost:7777{}). A single thread waits for
+status changes and sends each record to all the connected watchers.
 '''
 
 
@@ -22,6 +52,12 @@ import os
 import getopt
 import json
 import logging
+import socket
+import time
+import math
+import uuid
+from threading import Lock, BoundedSemaphore, Thread
+from concurrent.futures import ThreadPoolExecutor
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
@@ -35,6 +71,16 @@ sys.path.insert(0, os.path.abspath(os.path.join(THIS_DIR, "..")))
 
 # pylint: disable=C0412,C0413
 from opc import dome_ctrl as dc
+from opc import astro
+from opc.utils import get_config
+try:
+    from opc.telecomm import TeleCommunicator, get_version as tel_version
+except ImportError:
+    TELESCOPE = False
+else:
+    TELESCOPE = True
+import tel_cache as tc
+from loop_stats import Histogram
 try:                               # Try importing local telsamp
     import telsamp as ts
 except ImportError:
@@ -58,9 +104,30 @@ ALP_SWITCH_DESCR = 'Relais bank Alpaca server [numbers: 0..3]'
 ALP_SWITCH_NAME = 'OPC rele'
 ALP_NSWITCHES = 4
 
+ALP_TEL_DESCR = 'OnStep telescope controller (shared, cached access)'
+ALP_TEL_NAME = 'OPC telescope'
+ALP_TEL_IF_VERS = '3'
+
 ALP_IF_VERS = '1'
+ALP_API_VERSIONS = [1]
+
+ALP_SERVER_NAME = 'OPC dome Alpaca server'
+ALP_MANUFACTURER = 'Osservatorio Polifunzionale del Chianti'
+ALP_LOCATION = 'OPC'
 
 ALP_PORT = 7777
+ALP_DISCOVERY_PORT = 32227
+ALP_DISCOVERY_MSG = b'alpacadiscovery1'
+ALP_STREAM_PATH = '/opc/v1/dome/statusstream'
+ALP_STREAM_KEEPALIVE = 15   # Period of keepalive messages on status stream (sec)
+ALP_STREAM_TIMEOUT = 2      # Watchers not accepting data within this time are dropped (sec)
+ALP_WORKERS = 8          # Number of worker threads of Alpaca server
+ALP_IDLE_TIMEOUT = 30    # Idle connections are closed after this time (sec)
+ALP_IDLE_GRACE = 0.25    # Connections idle for this time are closed when all
+                         # workers are busy (sec)
+ALP_SLOW_MS = 500        # Requests slower than this are logged (msec)
+ALP_RATE_TAU = 60.       # Time constant for client rate estimates (sec)
+ALP_MAX_KEYS = 200       # Max number of endpoints or clients in metrics
 
 UNSIGNED_32 = 2**32
 
@@ -76,6 +143,7 @@ ALP_UNSUPPORTED_DEVICE = (20, 'Unsupported device: ')
 ALP_UNIMPL_ACTION = (1036, 'Action not implemented: ')
 ALP_TBI = (2000, 'Action to be implemented: ')
 ALP_DOME_SPECIFIC = (2010, 'Dome internal error: ')
+ALP_TEL_SPECIFIC = (2011, 'Telescope communication error: ')
 
 ALP_CLIENT_ID = 'ClientID'
 ALP_CLIENT_TRANS_ID = 'ClientTransactionID'
@@ -91,7 +159,7 @@ ALP_SLAVED = 'Slaved'
 ALP_ACTION = 'Action'
 ALP_PARAMS = 'Parameters'
 
-DOME_CUSTOM_ACTIONS = ['stop_server', 'get_params',
+DOME_CUSTOM_ACTIONS = ['stop_server', 'get_params', 'get_metrics',
                        'get_tel',
                        'start_left', 'start_right',
                        'step_left', 'step_right',
@@ -102,11 +170,16 @@ class GB:                  # pylint: disable=R0903
                          #### Housekeeping
     al_server = None     # HTTPserver for Alpaca
     al_transid = 1       # Alpaca server transaction id
+    discovery = None     # Discovery responder
+    metrics = None       # Request metrics
+    stream = None        # Status stream producer
+    trans_lock = Lock()  # Protect transaction id
     debug = False        # Debug mode for dome controller
     dctrl = None         # Handle for dome controller
     dome_params = {}     # static parameters from dome
     ipport = 0           # IP port for Alpaca server
     tls = None           # Handle for tel_sampler
+    tel = None           # Telescope cache (None: telescope device disabled)
 
 ##################################  Alpaca server section  ############################
 
@@ -116,10 +189,77 @@ class GB:                  # pylint: disable=R0903
 
 # http://ip.addr:7843/api/v1/dome/0/connected
 # http://ip.addr:7843/api/v1/switch/0/connected
+# http://ip.addr:7843/api/v1/telescope/0/connected
+
+# Replies are made of a head with the transaction ids, which is formatted
+# for each request, and a pre-serialized tail with error code and value
+# (see alp_reply_200). For properties which do not change while the server
+# is running the tail is computed only once (see alp_static, alp_cached).
+# Dynamic properties are taken from the status records published by the
+# dome controller, which are read without acquiring controller locks
+
+def _next_transid():
+    'Get next server transaction id'
+    with GB.trans_lock:
+        transid = GB.al_transid
+        GB.al_transid = (transid+1)%UNSIGNED_32
+    return transid
+
+def _send(handle, code, ctype, body):
+    'Send reply with given body (HTTP/1.1 requires Content-Length)'
+    handle.alp_error = code != 200
+    handle.send_response(code)
+    if handle.server.waiting or handle.close_connection:  # free the worker for
+        handle.send_header('Connection', 'close')         # a waiting connection
+    handle.send_header('Content-Type', ctype)
+    handle.send_header('Content-Length', str(len(body)))
+    handle.end_headers()
+    handle.wfile.write(body)
+
+_REPLY_HEAD = '{"%s": %%d, "%s": %%d, "%s": %%d, ' % (ALP_CLIENT_ID, ALP_CLIENT_TRANS_ID,
+                                                     ALP_SERVER_TRANS_ID)
+
+def _reply_tail(value=None, err=ALP_SUCCESS):
+    'Serialized final part of reply: error code, message and value'
+    tail = json.dumps({ALP_ERROR_NUMBER: err[0], ALP_ERROR_MESSAGE: err[1], ALP_VALUE: value})
+    return tail[1:].encode('utf8')
+
+_SUCCESS_TAIL = _reply_tail().split(b',')[0]+b','    # Start of tails with no error
+
+def _uint_param(params, name):
+    'Get unsigned 32 bit integer parameter (0 if missing or invalid)'
+    try:
+        value = int(params.get(name, '0')[0])
+    except (ValueError, IndexError):
+        return 0
+    return value if 0 <= value < UNSIGNED_32 else 0
+
+def _reply(handle, params, tail):
+    'Send normal reply with pre-serialized tail'
+    client_id = _uint_param(params, ALP_CLIENT_ID)
+    head = _REPLY_HEAD % (client_id, _uint_param(params, ALP_CLIENT_TRANS_ID),
+                          _next_transid())
+    _send(handle, 200, 'application/json', head.encode('utf8')+tail)
+    handle.alp_error = not tail.startswith(_SUCCESS_TAIL)
+    handle.client_id = client_id
+
+def alp_static(value=None, err=ALP_SUCCESS):
+    'Make a GET handler for a constant property (or error)'
+    tail = _reply_tail(value, err)
+    return lambda handle, params: _reply(handle, params, tail)
+
+def alp_cached(getter):
+    'Make a GET handler for a property which is constant after server start'
+    cache = []
+    def reply(handle, params):
+        if not cache:
+            cache.append(_reply_tail(getter()))
+        _reply(handle, params, cache[0])
+    return reply
 
 def alp_atpark(handle, params):
     'get IsAtPark property'
-    ext_stat = GB.dctrl.get_ext_status()
+    ext_stat = GB.dctrl.get_ext_status(timing=False)
     alp_reply_200(handle, params, ext_stat['atpark'])
 
 def alp_getazimuth(handle, params):
@@ -127,35 +267,16 @@ def alp_getazimuth(handle, params):
     dome_stat = GB.dctrl.get_status()
     alp_reply_200(handle, params, dome_stat.domeaz)
 
-def alp_unsupported_get(handle, params, command):
-    'return unsupported get command error'
-    err = (ALP_UNIMPL_PROP[0], ALP_UNIMPL_PROP[1]+command)
-    alp_reply_200(handle, params, err=err)
-
 def alp_unsupported_put(handle, data, command):
     'return unsupported get command error'
     err = (ALP_UNIMPL_ACTION[0], ALP_UNIMPL_ACTION[1]+command)
     alp_reply_200(handle, data, err=err)
 
-def alp_retvalue(handle, params, value):
-    'returns a value'
-    alp_reply_200(handle, params, value=value)
-
 def alp_getconnected(handle, params):
     'return connection status'
     dome_stat = GB.dctrl.get_status()
     alp_reply_200(handle, params, value=dome_stat.connected)
 
-def alp_driverinfo(handle, params):
-    'Return info on driver'
-    info = GB.dctrl.get_info()
-    alp_reply_200(handle, params, value=info)
-
-def alp_driverversion(handle, params):
-    'Return info on driver'
-    info = GB.dctrl.get_version()
-    alp_reply_200(handle, params, value=info)
-
 def alp_shutterstatus(handle, params):
     'return shutter status'
     stat = GB.dctrl.get_shutter()
@@ -163,7 +284,7 @@ def alp_shutterstatus(handle, params):
 
 def alp_slavestatus(handle, params):
     'return slave status'
-    stat = GB.dctrl.get_ext_status()['isslave']
+    stat = GB.dctrl.get_status().isslave
     alp_reply_200(handle, params, value=stat)
 
 def alp_slewstatus(handle, params):
@@ -171,32 +292,27 @@ def alp_slewstatus(handle, params):
     dome_stat = GB.dctrl.get_status()
     alp_reply_200(handle, params, value=dome_stat.direct != 0)
 
-def alp_get_dome_actions(handle, params):
-    'returns list of supported actions'
-    value = DOME_CUSTOM_ACTIONS
-    alp_reply_200(handle, params, value)
-
 #   COMMON GET ACTIONS   command      function
 _DOME_GET_ACTS = {'connected': alp_getconnected,
-                  'description': lambda x, y: alp_retvalue(x, y, ALP_DOME_DESCR),
-                  'driverinfo': alp_driverinfo,
-                  'driverversion': alp_driverversion,
-                  'interfaceversion': lambda x, y: alp_retvalue(x, y, ALP_IF_VERS),
-                  'name': lambda x, y: alp_retvalue(x, y, ALP_DOME_NAME),
-                  'supportedactions': alp_get_dome_actions,
+                  'description': alp_static(ALP_DOME_DESCR),
+                  'driverinfo': alp_cached(lambda: GB.dctrl.get_info()),
+                  'driverversion': alp_cached(lambda: GB.dctrl.get_version()),
+                  'interfaceversion': alp_static(ALP_IF_VERS),
+                  'name': alp_static(ALP_DOME_NAME),
+                  'supportedactions': alp_static(DOME_CUSTOM_ACTIONS),
 #   DOME SPECIFIC GET ACTIONS
-                  'altitude': lambda x, y: alp_unsupported_get(x, y, 'Altitude'),
-                  'athome': lambda x, y: alp_unsupported_get(x, y, 'AtHome'),
+                  'altitude': alp_static(err=(ALP_UNIMPL_PROP[0], ALP_UNIMPL_PROP[1]+'Altitude')),
+                  'athome': alp_static(err=(ALP_UNIMPL_PROP[0], ALP_UNIMPL_PROP[1]+'AtHome')),
                   'atpark': alp_atpark,
                   'azimuth': alp_getazimuth,
-                  'canfindhome': lambda x, y: alp_retvalue(x, y, False),
-                  'canpark': lambda x, y: alp_retvalue(x, y, True),
-                  'cansetaltitude': lambda x, y: alp_retvalue(x, y, False),
-                  'cansetazimuth': lambda x, y: alp_retvalue(x, y, True),
-                  'cansetpark': lambda x, y: alp_retvalue(x, y, True),
-                  'cansetshutter': lambda x, y: alp_retvalue(x, y, True),
-                  'canslave': lambda x, y: alp_retvalue(x, y, GB.dome_params['canslave']),
-                  'cansyncazimuth': lambda x, y: alp_retvalue(x, y, True),
+                  'canfindhome': alp_static(False),
+                  'canpark': alp_static(True),
+                  'cansetaltitude': alp_static(False),
+                  'cansetazimuth': alp_static(True),
+                  'cansetpark': alp_static(True),
+                  'cansetshutter': alp_static(True),
+                  'canslave': alp_cached(lambda: GB.dome_params['canslave']),
+                  'cansyncazimuth': alp_static(True),
                   'shutterstatus': alp_shutterstatus,
                   'slaved': alp_slavestatus,
                   'slewing': alp_slewstatus,
@@ -261,37 +377,42 @@ def alp_action(handle, data):
     match aname:
         case 'stop_server':
             errmsg = GB.dctrl.stop_server()
+            handle.close_connection = True
             if errmsg:
                 alp_reply_error(handle, 400, errmsg)
+            else:
+                alp_reply_200(handle, data)
             logging.debug('dome_alpaca exiting')
-            if GB.tls:
-                logging.debug('Stopping tel_sampler')
-                GB.tls.tel_stop()
-            alp_reply_200(handle, data)
-            sys.exit()
+            Thread(target=GB.al_server.stop).start()   # serve_forever() returns to main()
         case 'start_left':
             errmsg = GB.dctrl.start_left()
             if errmsg:
                 alp_reply_error(handle, 400, errmsg)
-            alp_reply_200(handle, data)
+            else:
+                alp_reply_200(handle, data)
         case 'start_right':
             errmsg = GB.dctrl.start_right()
             if errmsg:
                 alp_reply_error(handle, 400, errmsg)
-            alp_reply_200(handle, data)
+            else:
+                alp_reply_200(handle, data)
         case 'step_left':
             errmsg = GB.dctrl.step_left()
             if errmsg:
                 alp_reply_error(handle, 400, errmsg)
-            alp_reply_200(handle, data)
+            else:
+                alp_reply_200(handle, data)
         case 'step_right':
             errmsg = GB.dctrl.step_right()
             if errmsg:
                 alp_reply_error(handle, 400, errmsg)
-            alp_reply_200(handle, data)
+            else:
+                alp_reply_200(handle, data)
         case 'get_params':
             params = GB.dctrl.get_params()
             alp_reply_200(handle, data, value=params)
+        case 'get_metrics':
+            alp_reply_200(handle, data, value=GB.metrics.summary())
         case 'get_tel':
             if GB.tls:
                 val = GB.tls.tel_status()
@@ -364,7 +485,19 @@ def alp_retswitchpar(handle, params, vlist):
         alp_reply_200(handle, params, err=err)
         return
     val = vlist[idn]
-    alp_reply_200(handle, params, value=val)
+    if isinstance(val, bytes):          # pre-serialized
+        _reply(handle, params, val)
+    else:
+        alp_reply_200(handle, params, value=val)
+
+def alp_cached_switchpar(getter):
+    'Make a GET handler for switch info which is constant after server start'
+    cache = []
+    def reply(handle, params):
+        if not cache:
+            cache.extend(_reply_tail(x) for x in getter())
+        alp_retswitchpar(handle, params, cache)
+    return reply
 
 def alp_getswitch(handle, params):
     'Return status of given switch (True/False)'
@@ -375,44 +508,30 @@ def alp_switchcanwrite(handle, params):
     'Returns write capability of given switch'
     alp_retswitchpar(handle, params, [1, 1, 1, 1])
 
-def alp_getswitchdescr(handle, params):
-    'return description of switch'
-    sw_stat = GB.dctrl.get_switch_descr()
-    alp_retswitchpar(handle, params, sw_stat)
-
-def alp_getswitchname(handle, params):
-    'return name of switch'
-    sw_stat = GB.dctrl.get_switch_names()
-    alp_retswitchpar(handle, params, sw_stat)
-
 def alp_getswitchvalue(handle, params):
     'Return status of given switch (1/0)'
     sw_stat = GB.dctrl.get_switch_states()
     alp_retswitchpar(handle, params, sw_stat)
 
-def alp_get_switch_actions(handle, params):
-    'returns list of supported actions'
-    value = []
-    alp_reply_200(handle, params, value)
-
 #   COMMON ACTIONS     command         function
 _SWITCH_GET_ACTS = {'connected': alp_getconnected,
-                    'description': lambda x, y: alp_retvalue(x, y, ALP_SWITCH_DESCR),
-                    'driverinfo': alp_driverinfo,
-                    'driverversion': alp_driverversion,
-                    'interfaceversion': lambda x, y: alp_retvalue(x, y, ALP_IF_VERS),
-                    'name': lambda x, y: alp_retvalue(x, y, ALP_SWITCH_NAME),
-                    'supportedactions': alp_get_switch_actions,
+                    'description': alp_static(ALP_SWITCH_DESCR),
+                    'driverinfo': alp_cached(lambda: GB.dctrl.get_info()),
+                    'driverversion': alp_cached(lambda: GB.dctrl.get_version()),
+                    'interfaceversion': alp_static(ALP_IF_VERS),
+                    'name': alp_static(ALP_SWITCH_NAME),
+                    'supportedactions': alp_static([]),
 # SWITCH SPECIFIC ACTIONS
-                    'maxswitch': lambda x, y: alp_retvalue(x, y,ALP_NSWITCHES),
-                    'canwrite': lambda x, y: alp_retvalue(x, y, True),
+                    'maxswitch': alp_static(ALP_NSWITCHES),
+                    'canwrite': alp_static(True),
                     'getswitch': alp_getswitch,
-                    'getswitchdescription': alp_getswitchdescr,
-                    'getswitchname': alp_getswitchname,
+                    'getswitchdescription':
+                        alp_cached_switchpar(lambda: GB.dctrl.get_switch_descr()),
+                    'getswitchname': alp_cached_switchpar(lambda: GB.dctrl.get_switch_names()),
                     'getswitchvalue': alp_getswitchvalue,
-                    'minswitchvalue': lambda x, y: alp_retvalue(x, y, 0),
-                    'maxswitchvalue': lambda x, y: alp_retvalue(x, y, 1),
-                    'switchstep': lambda x, y: alp_retvalue(x, y, 1),
+                    'minswitchvalue': alp_static(0),
+                    'maxswitchvalue': alp_static(1),
+                    'switchstep': alp_static(1),
                    }
 
 def alp_setswitch(handle, data):
@@ -468,20 +587,235 @@ _SWITCH_PUT_ACTS = {'action': lambda x, y: alp_unsupported_put(x, y, 'Action'),
                     'setswitchvalue': alp_setswitchval,
                    }
 
+def alp_tel_error(handle, params):
+    'Reply with telescope communication error'
+    err = (ALP_TEL_SPECIFIC[0], ALP_TEL_SPECIFIC[1]+GB.tel.errmsg)
+    alp_reply_200(handle, params, err=err)
+
+def alp_tel_read(name, convert):
+    'Make a GET handler for a telescope property read through the cache'
+    def reply(handle, params):
+        value = GB.tel.read(name)
+        if value is None:
+            alp_tel_error(handle, params)
+        else:
+            alp_reply_200(handle, params, value=convert(value))
+    return reply
+
+def alp_tel_connected(handle, params):
+    'return telescope connection status (probes the controller if needed)'
+    alp_reply_200(handle, params, value=GB.tel.read('status') is not None)
+
+def alp_tel_sidtime(handle, params):
+    'return local sidereal time (computed locally)'
+    alp_reply_200(handle, params, value=astro.loc_st_now())
+
+def alp_tel_utcdate(handle, params):
+    'return UTC date (computed locally, ISO 8601)'
+    now = time.time()
+    value = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now))+f'.{int(now%1*1000):03d}Z'
+    alp_reply_200(handle, params, value=value)
+
+def alp_tel_axisrates(handle, params):
+    'return axis rates (empty: MoveAxis not supported) (arg: Axis)'
+    _unused, err = _get_int(params, 'Axis', 0, 2)
+    if err:
+        alp_reply_200(handle, params, err=err)
+    else:
+        alp_reply_200(handle, params, value=[])
+
+def alp_unimplemented(name):
+    'Make a handler for a known, not implemented, property or method'
+    return alp_static(err=(ALP_UNIMPL_PROP[0], ALP_UNIMPL_PROP[1]+name))
+
+_PIER_SIDES = {'E': 0, 'W': 1}
+
+#   COMMON GET ACTIONS   command      function
+_TEL_GET_ACTS = {'connected': alp_tel_connected,
+                 'description': alp_static(ALP_TEL_DESCR),
+                 'driverinfo': alp_cached(lambda: tel_version()),
+                 'driverversion': alp_static(__version__),
+                 'interfaceversion': alp_static(ALP_TEL_IF_VERS),
+                 'name': alp_static(ALP_TEL_NAME),
+                 'supportedactions': alp_static([]),
+#   TELESCOPE SPECIFIC GET ACTIONS
+                 'alignmentmode': alp_static(2),                # German equatorial
+                 'altitude': alp_tel_read('altaz', lambda x: x[0]),
+                 'aperturearea': alp_unimplemented('ApertureArea'),
+                 'aperturediameter': alp_unimplemented('ApertureDiameter'),
+                 'athome': alp_tel_read('status', lambda x: 'H' in x),
+                 'atpark': alp_tel_read('status', lambda x: 'P' in x),
+                 'axisrates': alp_tel_axisrates,                # arg: Axis
+                 'azimuth': alp_tel_read('altaz', lambda x: x[1]),
+                 'canfindhome': alp_static(True),
+                 'canmoveaxis': alp_static(False),
+                 'canpark': alp_static(True),
+                 'canpulseguide': alp_static(True),
+                 'cansetdeclinationrate': alp_static(False),
+                 'cansetguiderates': alp_static(False),
+                 'cansetpark': alp_static(True),
+                 'cansetpierside': alp_static(False),
+                 'cansetrightascensionrate': alp_static(False),
+                 'cansettracking': alp_static(True),
+                 'canslew': alp_static(False),
+                 'canslewaltaz': alp_static(False),
+                 'canslewaltazasync': alp_static(False),
+                 'canslewasync': alp_static(True),
+                 'cansync': alp_static(True),
+                 'cansyncaltaz': alp_static(False),
+                 'canunpark': alp_static(True),
+                 'declination': alp_tel_read('radec', lambda x: x[1]),
+                 'declinationrate': alp_static(0.0),
+                 'destinationsideofpier': alp_unimplemented('DestinationSideOfPier'),
+                 'doesrefraction': alp_static(False),
+                 'equatorialsystem': alp_static(1),             # Topocentric
+                 'focallength': alp_unimplemented('FocalLength'),
+                 'guideratedeclination': alp_unimplemented('GuideRateDeclination'),
+                 'guideraterightascension': alp_unimplemented('GuideRateRightAscension'),
+                 'ispulseguiding': alp_tel_read('status', lambda x: 'G' in x),
+                 'rightascension': alp_tel_read('radec', lambda x: x[0]),
+                 'rightascensionrate': alp_static(0.0),
+                 'sideofpier': alp_tel_read('pierside', lambda x: _PIER_SIDES.get(x, -1)),
+                 'siderealtime': alp_tel_sidtime,
+                 'siteelevation': alp_static(astro.OPC.elevation),
+                 'sitelatitude': alp_tel_read('site', lambda x: x[0]),
+                 'sitelongitude': alp_tel_read('site', lambda x: x[1]),
+                 'slewing': alp_tel_read('status', lambda x: 'N' not in x),
+                 'slewsettletime': alp_static(0),
+                 'targetdeclination': alp_tel_read('target', lambda x: x[1]),
+                 'targetrightascension': alp_tel_read('target', lambda x: x[0]),
+                 'tracking': alp_tel_read('status', lambda x: 'n' not in x),
+                 'trackingrate': alp_static(0),                 # Sidereal
+                 'trackingrates': alp_static([0]),
+                 'utcdate': alp_tel_utcdate,
+                }
+
+def _get_float(data, name, vmin, vmax):
+    'Get float parameter in range [vmin, vmax]. Returns value or error'
+    val = data.get(name)
+    if val is None:
+        return None, (ALP_VALUE_NOT_SET[0], ALP_VALUE_NOT_SET[1]+name)
+    try:
+        val = float(val[0])
+    except ValueError:
+        return None, (ALP_INVALID_VALUE[0], ALP_INVALID_VALUE[1]+f'{name}={val[0]}')
+    if not vmin <= val <= vmax:
+        return None, (ALP_INVALID_VALUE[0], ALP_INVALID_VALUE[1]+f'{name}={val}')
+    return val, None
+
+def _get_int(data, name, vmin, vmax):
+    'Get integer parameter in range [vmin, vmax]. Returns value or error'
+    val = data.get(name)
+    if val is None:
+        return None, (ALP_VALUE_NOT_SET[0], ALP_VALUE_NOT_SET[1]+name)
+    try:
+        val = int(val[0])
+    except ValueError:
+        return None, (ALP_INVALID_VALUE[0], ALP_INVALID_VALUE[1]+f'{name}={val[0]}')
+    if not vmin <= val <= vmax:
+        return None, (ALP_INVALID_VALUE[0], ALP_INVALID_VALUE[1]+f'{name}={val}')
+    return val, None
+
+def alp_tel_command(handle, data, func, *args):
+    'Execute telescope command sequence and reply'
+    ret = GB.tel.execute(func, *args)
+    if ret is None:
+        alp_tel_error(handle, data)
+    elif ret:
+        alp_reply_200(handle, data, err=(ALP_INVALID_OPERATION[0], ALP_INVALID_OPERATION[1]+ret))
+    else:
+        alp_reply_200(handle, data)
+
+def alp_tel_radec(func):
+    'Make a PUT handler for a command with arguments RightAscension, Declination'
+    def handler(handle, data):
+        rah, err = _get_float(data, 'RightAscension', 0.0, 24.0)
+        if err is None:
+            ded, err = _get_float(data, 'Declination', -90.0, 90.0)
+        if err:
+            alp_reply_200(handle, data, err=err)
+        else:
+            alp_tel_command(handle, data, func, rah%24., ded)
+    return handler
+
+def alp_tel_pulseguide(handle, data):
+    'Pulse guide command (args: Direction, Duration)'
+    direct, err = _get_int(data, 'Direction', 0, 3)
+    if err is None:
+        msec, err = _get_float(data, 'Duration', 20, 16399)
+    if err:
+        alp_reply_200(handle, data, err=err)
+    else:
+        alp_tel_command(handle, data, tc.pulse_guide, direct, int(msec))
+
+def alp_tel_settarget(handle, data):
+    'Set target right ascension (arg: TargetRightAscension)'
+    rah, err = _get_float(data, 'TargetRightAscension', 0.0, 24.0)
+    if err:
+        alp_reply_200(handle, data, err=err)
+    else:
+        alp_tel_command(handle, data, tc.set_target, rah%24., None)
+
+def alp_tel_settargetde(handle, data):
+    'Set target declination (arg: TargetDeclination)'
+    ded, err = _get_float(data, 'TargetDeclination', -90.0, 90.0)
+    if err:
+        alp_reply_200(handle, data, err=err)
+    else:
+        alp_tel_command(handle, data, tc.set_target, None, ded)
+
+def alp_tel_settracking(handle, data):
+    'Enable/disable tracking (arg: Tracking)'
+    track = data.get('Tracking')
+    if track is None:
+        alp_reply_200(handle, data, err=(ALP_VALUE_NOT_SET[0], ALP_VALUE_NOT_SET[1]+'Tracking'))
+    else:
+        alp_tel_command(handle, data, tc.set_tracking, track[0].lower() == 'true')
+
+#   COMMON ACTIONS     command         function
+_TEL_PUT_ACTS = {'action': lambda x, y: alp_unsupported_put(x, y, 'Action'),
+                 'commandblind': lambda x, y: alp_unsupported_put(x, y, 'CommandBlind'),
+                 'commandbool': lambda x, y: alp_unsupported_put(x, y, 'CommandBool'),
+                 'commandstring': lambda x, y: alp_unsupported_put(x, y, 'CommandString'),
+                 'connected': alp_setconnected,
+                                                      # Telescope specific actions
+                 'abortslew': lambda x, y: alp_tel_command(x, y, tc.abort_slew),
+                 'declinationrate': alp_unimplemented('DeclinationRate'),
+                 'doesrefraction': alp_unimplemented('DoesRefraction'),
+                 'findhome': lambda x, y: alp_tel_command(x, y, tc.find_home),
+                 'guideratedeclination': alp_unimplemented('GuideRateDeclination'),
+                 'guideraterightascension': alp_unimplemented('GuideRateRightAscension'),
+                 'moveaxis': alp_unimplemented('MoveAxis'),
+                 'park': lambda x, y: alp_tel_command(x, y, tc.park),
+                 'pulseguide': alp_tel_pulseguide,               # args: Direction, Duration
+                 'rightascensionrate': alp_unimplemented('RightAscensionRate'),
+                 'setpark': lambda x, y: alp_tel_command(x, y, tc.set_park),
+                 'sideofpier': alp_unimplemented('SideOfPier'),
+                 'siteelevation': alp_unimplemented('SiteElevation'),
+                 'sitelatitude': alp_unimplemented('SiteLatitude'),
+                 'sitelongitude': alp_unimplemented('SiteLongitude'),
+                 'slewsettletime': alp_unimplemented('SlewSettleTime'),
+                 'slewtoaltaz': alp_unimplemented('SlewToAltAz'),
+                 'slewtoaltazasync': alp_unimplemented('SlewToAltAzAsync'),
+                 'slewtocoordinates': alp_unimplemented('SlewToCoordinates'),
+                 'slewtocoordinatesasync': alp_tel_radec(tc.slew_to),
+                 'slewtotarget': alp_unimplemented('SlewToTarget'),
+                 'slewtotargetasync': lambda x, y: alp_tel_command(x, y, tc.slew_to_target),
+                 'synctoaltaz': alp_unimplemented('SyncToAltAz'),
+                 'synctocoordinates': alp_tel_radec(tc.sync_to),
+                 'synctotarget': lambda x, y: alp_tel_command(x, y, tc.sync_to),
+                 'targetdeclination': alp_tel_settargetde,      # arg: TargetDeclination
+                 'targetrightascension': alp_tel_settarget,     # arg: TargetRightAscension
+                 'tracking': alp_tel_settracking,               # arg: Tracking
+                 'trackingrate': alp_unimplemented('TrackingRate'),
+                 'unpark': lambda x, y: alp_tel_command(x, y, tc.unpark),
+                 'utcdate': alp_unimplemented('UTCDate'),
+                }
+
 def alp_reply_200(handle, params, value=None, err=ALP_SUCCESS):
     'normal reply'
     logging.debug('Reply 200: value=%s, err=%s', value, err)
-    ret = {ALP_CLIENT_ID: int(params[ALP_CLIENT_ID][0]),
-           ALP_CLIENT_TRANS_ID: int(params[ALP_CLIENT_TRANS_ID][0]),
-           ALP_SERVER_TRANS_ID: GB.al_transid,
-           ALP_ERROR_NUMBER: err[0],
-           ALP_ERROR_MESSAGE: err[1]}
-    ret[ALP_VALUE] = value
-    GB.al_transid = (GB.al_transid+1)%UNSIGNED_32
-    handle.send_response(200)
-    handle.send_header('Content-type', 'application/json')
-    handle.end_headers()
-    handle.wfile.write(json.dumps(ret).encode('utf8'))
+    _reply(handle, params, _reply_tail(value, err))
 
 def alp_reply_action(handle, params, errmsg):
     'returns status after action'
@@ -494,16 +828,56 @@ def alp_reply_action(handle, params, errmsg):
 def alp_reply_error(handle, code, msg):
     'error reply'
     logging.debug('alp_reply_error(%d, %s)', code, msg)
-    handle.send_response(code)
-    handle.send_header('Content-type', 'text/plain')
-    handle.end_headers()
-    handle.wfile.write(msg.encode('utf8'))
+    _send(handle, code, 'text/plain', msg.encode('utf8'))
+
+def _unique_id(dev_type):
+    'Unique ID of device (persistent: derived from host name and device type)'
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f'{dev_type}.0.{socket.gethostname()}.opc'))
+
+def _configured_devices():
+    'Management reply for configureddevices (includes telescope, if enabled)'
+    devices = [{'DeviceName': ALP_DOME_NAME, 'DeviceType': 'Dome',
+                'DeviceNumber': 0, 'UniqueID': _unique_id('dome')},
+               {'DeviceName': ALP_SWITCH_NAME, 'DeviceType': 'Switch',
+                'DeviceNumber': 0, 'UniqueID': _unique_id('switch')}]
+    if GB.tel:
+        devices.append({'DeviceName': ALP_TEL_NAME, 'DeviceType': 'Telescope',
+                        'DeviceNumber': 0, 'UniqueID': _unique_id('telescope')})
+    return devices
+
+#   MANAGEMENT API    URL path                          function
+_MANAGEMENT_ACTS = {'/management/apiversions': alp_static(ALP_API_VERSIONS),
+                    '/management/v1/description':
+                        alp_static({'ServerName': ALP_SERVER_NAME,
+                                    'Manufacturer': ALP_MANUFACTURER,
+                                    'ManufacturerVersion': __version__,
+                                    'Location': ALP_LOCATION}),
+                    '/management/v1/configureddevices': alp_cached(_configured_devices),
+                   }
 
 class AlpacaHandler(BaseHTTPRequestHandler):
     'Alpaca request handler'
+    protocol_version = 'HTTP/1.1'          # persistent connections
+    timeout = ALP_IDLE_TIMEOUT             # close idle connections
+    disable_nagle_algorithm = True         # headers and body are sent separately
+
     def log_message(self, *args):
         'to disable logging of requests'
 
+    def parse_request(self):
+        'Mark the connection as serving a request'
+        ret = super().parse_request()
+        if not self.server.request_started(self.request):
+            self.close_connection = True     # closed while idle by the server
+        return ret
+
+    def handle_one_request(self):
+        'Serve a request, then mark the connection as idle'
+        try:
+            super().handle_one_request()
+        finally:
+            self.server.request_done(self.request)
+
     def _parse_get(self):
         'Parse URL for GET request'
         logging.debug('GET - %s', self.path)
@@ -549,6 +923,15 @@ class AlpacaHandler(BaseHTTPRequestHandler):
         else:
             func(self, params)
 
+    def do_get_telescope(self, command, params):
+        'Reply to GET requests for Telescope'       ## table driven'
+        func = _TEL_GET_ACTS.get(command)
+        if func is None:
+            err = (ALP_INVALID_OPERATION[0], ALP_INVALID_OPERATION[1]+command)
+            alp_reply_200(self, params, err=err)
+        else:
+            func(self, params)
+
     def do_put_dome(self, command, data):
         'Reply to PUT requests for Dome'       ## table driven'
         func = _DOME_PUT_ACTS.get(command)
@@ -567,56 +950,467 @@ class AlpacaHandler(BaseHTTPRequestHandler):
         else:
             func(self, data)
 
+    def do_put_telescope(self, command, data):
+        'Reply to PUT requests for Telescope'       ## table driven'
+        func = _TEL_PUT_ACTS.get(command)
+        if func is None:
+            err = (ALP_INVALID_OPERATION[0], ALP_INVALID_OPERATION[1]+command)
+            alp_reply_200(self, data, err=err)
+        else:
+            func(self, data)
+
     def do_get(self):
         'Reply to GET requests'
         if self.path == '/':     # reply to dummy request
             logging.debug('Got dummy request')
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.flush()
+            _send(self, 200, 'text/html', b'')
             logging.debug('Sent dummy reply')
             return
+        if self.path.split('?')[0] == ALP_STREAM_PATH:
+            self.do_stream()
+            return
+        if self.path.startswith('/management/'):
+            parsed = urlparse(self.path)
+            func = _MANAGEMENT_ACTS.get(parsed.path.rstrip('/'))
+            if func is None:
+                alp_reply_error(self, 400, ALP_INVALID_OPERATION[1]+parsed.path)
+            else:
+                func(self, parse_qs(parsed.query))
+            return
         dev_type, dev_num, command, params = self._parse_get()
         if dev_num != '0':
             alp_reply_error(self, 400, ALP_INVALID_VALUE[1]+dev_num)
-        if dev_type == 'dome':
+        elif dev_type == 'dome':
             self.do_get_dome(command, params)
         elif dev_type == 'switch':
             self.do_get_switch(command, params)
+        elif dev_type == 'telescope' and GB.tel:
+            self.do_get_telescope(command, params)
         else:
-            alp_reply_error(self, 400, ALP_UNSUPPORTED_DEVICE+dev_type)
+            alp_reply_error(self, 400, ALP_UNSUPPORTED_DEVICE[1]+dev_type)
+
+    def do_stream(self):
+        'Start status stream: the connection is passed to the stream producer'
+        if GB.stream is None:
+            alp_reply_error(self, 404, 'Status stream not available')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        self.server.detach(self.request)
+        GB.stream.subscribe(self.request)
 
     def do_put(self):
         'Reply to PUT requests'
         dev_type, dev_num, command, data = self._parse_put()
         if dev_num != '0':
             alp_reply_error(self, 400, ALP_INVALID_VALUE[1]+dev_num)
-        if dev_type == 'dome':
+        elif dev_type == 'dome':
             self.do_put_dome(command, data)
         elif dev_type == 'switch':
             self.do_put_switch(command, data)
+        elif dev_type == 'telescope' and GB.tel:
+            self.do_put_telescope(command, data)
         else:
-            alp_reply_error(self, 400, ALP_UNSUPPORTED_DEVICE+dev_type)
+            alp_reply_error(self, 400, ALP_UNSUPPORTED_DEVICE[1]+dev_type)
 
-    def do_GET(self):                        #pylint: disable=C0103
-        'wrapper catching exceptions'
+    def _timed(self, method, func):
+        'Execute request, catching exceptions, and record metrics'
+        tstart = time.perf_counter()
+        self.alp_error = False
+        self.client_id = 0
         try:
-            self.do_get()
+            func()
         except Exception as exc:             #pylint: disable=W0703
+            self.close_connection = True     # reply may be incomplete
             alp_reply_error(self, 500, str(exc))
+        GB.metrics.record(method, self.path, self.client_address[0], self.client_id,
+                          time.perf_counter()-tstart, self.alp_error)
+
+    def do_GET(self):                        #pylint: disable=C0103
+        'wrapper catching exceptions'
+        self._timed('GET', self.do_get)
 
     def do_PUT(self):                        #pylint: disable=C0103
         'wrapper catching exceptions'
+        self._timed('PUT', self.do_put)
+
+class _Client:                   # pylint: disable=R0903
+    'Call statistics of a client'
+    __slots__ = ('count', 'errors', 'rate', 'tlast')
+
+    def __init__(self, now):
+        self.count = 0
+        self.errors = 0
+        self.rate = 0.0          # Calls/sec, exponentially weighted (see ALP_RATE_TAU)
+        self.tlast = now
+
+    def call(self, now, error):
+        'Record a call'
+        self.rate = self.rate*math.exp((self.tlast-now)/ALP_RATE_TAU)+1./ALP_RATE_TAU
+        self.tlast = now
+        self.count += 1
+        if error:
+            self.errors += 1
+
+class RequestMetrics:
+    '''
+    Metrics of Alpaca requests
+
+    Latencies are collected per endpoint (method, device type and command)
+    into logarithmic histograms; calls are counted per client (IP address
+    and Alpaca ClientID) with an estimate of the current call rate.
+
+    Parameters
+    ----------
+    slow_ms : float
+        Requests slower than slow_ms milliseconds are logged (0: no log)
+    '''
+    def __init__(self, slow_ms=ALP_SLOW_MS):
+        self.slow = slow_ms/1000.
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        'Clear all metrics'
+        with self.lock:
+            self.tstart = time.monotonic()
+            self.endpoints = {}           # key: [Histogram, errors]
+            self.clients = {}             # key: _Client
+            self.nslow = 0
+
+    @staticmethod
+    def endpoint(method, path):
+        'Endpoint key from request path'
+        parts = path.split('?')[0].strip('/').split('/')
+        if len(parts) == 5 and parts[0] == 'api':
+            return f'{method} {parts[2]}/{parts[4].lower()}'
+        return f'{method} /'+'/'.join(parts)
+
+    def record(self, method, path, address, client_id, elapsed, error):  # pylint: disable=R0913
+        'Record a request'
+        endpoint = self.endpoint(method, path)
+        client = f'{address}:{client_id}'
+        now = time.monotonic()
+        with self.lock:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                if len(self.endpoints) >= ALP_MAX_KEYS:
+                    endpoint = f'{method} other'
+                entry = self.endpoints.setdefault(endpoint, [Histogram(), 0])
+            entry[0].record(elapsed)
+            if error:
+                entry[1] += 1
+            stat = self.clients.get(client)
+            if stat is None:
+                if len(self.clients) >= ALP_MAX_KEYS:
+                    client = 'other'
+                stat = self.clients.setdefault(client, _Client(now))
+            stat.call(now, error)
+            slow = self.slow and elapsed > self.slow
+            if slow:
+                self.nslow += 1
+        if slow:
+            logging.warning('slow request: %s from client %s: %.1f ms (rate: %.2f calls/s)',
+                            endpoint, client, elapsed*1000., stat.rate)
+
+    def summary(self):
+        'Summary dictionary of metrics'
+        now = time.monotonic()
+        with self.lock:
+            endpoints = {}
+            for key, (hist, errors) in self.endpoints.items():
+                endpoints[key] = hist.summary()
+                endpoints[key]['errors'] = errors
+            clients = {key: {'count': stat.count, 'errors': stat.errors,
+                             'rate': stat.rate*math.exp((stat.tlast-now)/ALP_RATE_TAU),
+                             'idle': now-stat.tlast}
+                       for key, stat in self.clients.items()}
+            return {'elapsed': now-self.tstart,
+                    'requests': sum(x['count'] for x in endpoints.values()),
+                    'errors': sum(x['errors'] for x in endpoints.values()),
+                    'slow': self.nslow,
+                    'slow_ms': self.slow*1000.,
+                    'endpoints': endpoints,
+                    'clients': clients}
+
+class StatusStream(Thread):
+    '''
+    Producer of the status stream
+
+    Waits for status changes of the dome controller and sends each new
+    status record, serialized once, to all subscribed connections as a
+    Server-Sent Event. Subscribers which cannot receive data within
+    ALP_STREAM_TIMEOUT seconds, or which have closed the connection,
+    are dropped
+
+    Parameters
+    ----------
+    dctrl : DomeController
+        Dome controller
+    '''
+    def __init__(self, dctrl):
+        super().__init__(name='alpaca-stream', daemon=True)
+        self.dctrl = dctrl
+        self.lock = Lock()
+        self.subscribers = []
+        self.seq = 0
+        self.event = b''
+        self.goon = True
+
+    def _make_event(self, seq, stat):
+        'Serialize status record as SSE event'
+        record = {'connected': stat.connected, 'domeaz': stat.domeaz, 'direct': stat.direct,
+                  'isslave': stat.isslave, 'movstat': stat.movstat, 'targetaz': stat.targetaz}
+        return f'id: {seq}\ndata: {json.dumps(record)}\n\n'.encode('utf8')
+
+    def _send(self, conns, data):
+        'Send data to connections. Returns connections with errors'
+        dropped = []
+        for conn in conns:
+            try:
+                conn.sendall(data)
+            except OSError:
+                dropped.append(conn)
+        return dropped
+
+    def _drop(self, conns):
+        'Remove and close connections'
+        with self.lock:
+            for conn in conns:
+                if conn in self.subscribers:
+                    self.subscribers.remove(conn)
+        for conn in conns:
+            logging.debug('status stream: watcher dropped')
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def subscribe(self, conn):
+        'Add a connection to the subscribers (current status is sent immediately)'
+        conn.settimeout(ALP_STREAM_TIMEOUT)
+        with self.lock:               # The first event must precede those sent by run()
+            event = self.event or self._make_event(*self.dctrl.wait_status_change(-1, 0))
+            dropped = self._send([conn], event)
+            if not dropped:
+                self.subscribers.append(conn)
+        self._drop(dropped)
+
+    def run(self):
+        while self.goon:
+            seq, stat = self.dctrl.wait_status_change(self.seq, ALP_STREAM_KEEPALIVE)
+            if not self.goon:
+                break
+            with self.lock:
+                if seq != self.seq:
+                    self.seq = seq
+                    self.event = event = self._make_event(seq, stat)
+                else:
+                    event = b': keepalive\n\n'
+                conns = list(self.subscribers)
+            self._drop(self._send(conns, event))
+
+    def stop(self):
+        'Terminate producer and close all connections'
+        self.goon = False
+        with self.lock:
+            conns = list(self.subscribers)
+        self._drop(conns)
+
+class DiscoveryResponder(Thread):
+    '''
+    Alpaca discovery responder
+
+    Replies to discovery requests (UDP broadcasts) with the port of the
+    Alpaca HTTP server. It runs in its own thread, independent of the
+    workers serving HTTP requests
+
+    Parameters
+    ----------
+    alport : int
+        IP port of the Alpaca HTTP server
+
+    port : int
+        UDP port for discovery requests
+    '''
+    def __init__(self, alport, port=ALP_DISCOVERY_PORT):
+        super().__init__(name='alpaca-discovery', daemon=True)
+        self.reply = json.dumps({'AlpacaPort': alport}).encode('utf8')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # shared with
+        self.sock.bind(('', port))                                       # other servers
+        self.sock.settimeout(0.5)
+        self.goon = True
+        self.nreqs = 0
+
+    def run(self):
+        while self.goon:
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if data.startswith(ALP_DISCOVERY_MSG):
+                self.nreqs += 1
+                logging.debug('discovery request from %s', addr)
+                try:
+                    self.sock.sendto(self.reply, addr)
+                except OSError as exc:
+                    logging.debug('cannot reply to discovery request: %s', exc)
+        self.sock.close()
+
+    def stop(self):
+        'Terminate responder'
+        self.goon = False
+        self.join()
+
+class AlpacaServer(HTTPServer):
+    '''
+    HTTP server with a bounded pool of worker threads
+
+    Each accepted connection is served by a worker for all its requests
+    (HTTP/1.1 persistent connection). When all workers are busy, the server
+    stops accepting connections, which wait in the listen queue, and frees
+    workers for them: connections idle between requests for more than
+    ALP_IDLE_GRACE seconds are shut down (the worker waiting for the next
+    request gets end of file) and the others are closed after the current
+    request. The grace time spares clients sending requests back to back.
+    Connections which never completed a request are closed only by the
+    idle timeout
+
+    Parameters
+    ----------
+    address : (str, int)
+        Server address
+
+    handler : class
+        Request handler class
+
+    nworkers : int
+        Number of worker threads
+    '''
+    request_queue_size = 32
+
+    NEW, BUSY, IDLE, CLOSED = range(4)     # Connection states
+
+    def __init__(self, address, handler, nworkers=ALP_WORKERS):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='alpaca')
+        self.slots = BoundedSemaphore(nworkers)
+        self.conn_lock = Lock()
+        self.connections = {}              # connection: (state, time of last change)
+        self.detached = set()
+        self.stopping = False
+        self.waiting = False               # A connection is waiting for a worker
+
+    def process_request(self, request, client_address):
+        'Pass the connection to a worker (waits for a free worker)'
+        if not self.slots.acquire(blocking=False):
+            self.waiting = True
+            self._close_idle()
+            while not self.slots.acquire(timeout=ALP_IDLE_GRACE):
+                if self.stopping:
+                    self.waiting = False
+                    self.shutdown_request(request)
+                    return
+                self._close_idle()               # connections become idle meanwhile
+            self.waiting = False
+        with self.conn_lock:
+            self.connections[request] = (self.NEW, time.monotonic())
+        self.pool.submit(self._serve_connection, request, client_address)
+
+    def _close_idle(self):
+        'Shut down connections idle between requests, to free their workers'
+        tlimit = time.monotonic()-ALP_IDLE_GRACE
+        with self.conn_lock:
+            for conn, (state, tchange) in self.connections.items():
+                if state == self.IDLE and tchange <= tlimit:
+                    self.connections[conn] = (self.CLOSED, tchange)
+                    try:
+                        conn.shutdown(socket.SHUT_RD)
+                    except OSError:
+                        pass
+
+    def request_started(self, request):
+        'Mark connection as serving a request. Returns False if already shut down'
+        with self.conn_lock:
+            if self.connections[request][0] == self.CLOSED:
+                return False
+            self.connections[request] = (self.BUSY, time.monotonic())
+            return True
+
+    def request_done(self, request):
+        'Mark connection as idle between requests'
+        with self.conn_lock:
+            if self.connections[request][0] == self.BUSY:
+                self.connections[request] = (self.IDLE, time.monotonic())
+
+    def _serve_connection(self, request, client_address):
+        'Serve all requests of a connection (executed by a worker)'
         try:
-            self.do_put()
-        except Exception as exc:             #pylint: disable=W0703
-            alp_reply_error(self, 500, str(exc))
+            self.finish_request(request, client_address)
+        except Exception:                      #pylint: disable=W0703
+            self.handle_error(request, client_address)
+        finally:
+            with self.conn_lock:
+                self.connections.pop(request, None)
+                detached = request in self.detached
+                self.detached.discard(request)
+            if not detached:
+                self.shutdown_request(request)
+            self.slots.release()
+
+    def detach(self, request):
+        'Keep the connection open after the handler returns (ownership is passed to caller)'
+        with self.conn_lock:
+            self.detached.add(request)
+
+    def handle_error(self, request, client_address):
+        'Log errors instead of printing to stderr'
+        logging.debug('connection from %s closed on error', client_address, exc_info=True)
+
+    def stop(self):
+        '''Graceful shutdown: stop accepting new connections, let workers
+        complete the requests in progress, then close idle connections.
+        Not to be called from the thread running serve_forever()'''
+        self.stopping = True
+        self.shutdown()
+        with self.conn_lock:
+            for conn in self.connections:     # wake up workers waiting for requests
+                try:
+                    conn.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        self.pool.shutdown(wait=True)
+        self.server_close()
+
+def tel_start(telsim, logger):
+    'Create telescope cache. Returns None if the telescope is not available'
+    if not TELESCOPE:
+        logger.info('Telescope device unavailable (telecomm not found)')
+        return None
+    config = get_config(check_version=False, simul=telsim)
+    if not config.get('tel_ip'):
+        logger.info('Telescope device unavailable (not configured)')
+        return None
+    tcm = TeleCommunicator(config['tel_ip'], config['tel_port'],
+                           timeout=config.get('tel_tmout', 0.5))
+    logger.info('Telescope device: OnStep at %s:%d', config['tel_ip'], config['tel_port'])
+    return tc.TelescopeCache(tcm)
 
 def main():                     #pylint: disable=R0912,R0915,R0914
     'main entry point'
     if '-h' in sys.argv:
-        print(__doc__.format(ALP_PORT))
+        print(__doc__.format(ALP_SLOW_MS, ALP_PORT, ALP_WORKERS, ALP_IDLE_GRACE,
+                             ALP_IDLE_TIMEOUT, ALP_DISCOVERY_PORT,
+                             ALP_STREAM_PATH, ALP_STREAM_PATH))
         sys.exit()
     ksimul = False
     telsim = False
@@ -624,8 +1418,12 @@ def main():                     #pylint: disable=R0912,R0915,R0914
     alport = ALP_PORT
     debug = False
     logfile = None
+    nworkers = ALP_WORKERS
+    discovery = True
+    telescope = True
+    slow_ms = ALP_SLOW_MS
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], 'dkl:p:s')
+        opts, _ = getopt.getopt(sys.argv[1:], 'dikl:m:np:stw:')
     except getopt.error:
         print(ARGERR)
         sys.exit()
@@ -638,10 +1436,18 @@ def main():                     #pylint: disable=R0912,R0915,R0914
             lang = 'it'
         elif opt == '-l':
             logfile = val
+        elif opt == '-m':
+            slow_ms = float(val)
+        elif opt == '-n':
+            discovery = False
         elif opt == '-p':
             alport = int(val)
         elif opt == '-s':
             telsim = True
+        elif opt == '-t':
+            telescope = False
+        elif opt == '-w':
+            nworkers = int(val)
 
     loglevel = logging.DEBUG if debug else logging.INFO
     if logfile:
@@ -666,9 +1472,34 @@ def main():                     #pylint: disable=R0912,R0915,R0914
         raise
     logger.debug('dome_ctrl started')
     GB.dome_params = GB.dctrl.get_params()
-    GB.al_server = HTTPServer(('', alport), AlpacaHandler)
-    logger.debug('server started on port: %s', alport)
-    GB.al_server.serve_forever()
+    if telescope:
+        GB.tel = tel_start(telsim, logger)
+    GB.metrics = RequestMetrics(slow_ms)
+    GB.stream = StatusStream(GB.dctrl)
+    GB.stream.start()
+    GB.al_server = AlpacaServer(('', alport), AlpacaHandler, nworkers)
+    logger.debug('server started on port: %s (%d workers)', alport, nworkers)
+    if discovery:
+        try:
+            GB.discovery = DiscoveryResponder(alport)
+        except OSError as exc:
+            logger.error('discovery responder not available: %s', exc)
+        else:
+            GB.discovery.start()
+            logger.info('discovery responder listening on UDP port %d', ALP_DISCOVERY_PORT)
+    try:
+        GB.al_server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('interrupted: stopping dome controller')
+        Thread(target=GB.al_server.stop).start()
+        GB.dctrl.stop_server()
+    if GB.discovery:
+        GB.discovery.stop()
+    GB.stream.stop()
+    if GB.tls:
+        logger.debug('Stopping tel_sampler')
+        GB.tls.tel_stop()
+    logger.info('dome_alpaca terminated')
 
 if __name__ == '__main__':
     main()
@@ -30,6 +30,8 @@ import matplotlib.pyplot as plt
 #pylint: disable=W0401,W0614
 from dome_tools import *
 from k8055_simulator import K8055Simulator
+from calib_fit import accel_params, decel_params, tsafe_param, make_ptable, \
+                      record_trace, DYN_HTIME
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -465,8 +467,6 @@ def measure_t360(n360):
     print('Tempo per rotazione competa:', t360)
     return t360
 
-DYN_HTIME = 12     # Half duration of dyn parameters measure
-
 def _getint(prompt):
     'accetta valore intero'
     while True:
@@ -493,34 +493,11 @@ def _getfloat(prompt):
             break
     return ret
 
-def measure_dyn():             #pylint: disable=R0914
+def measure_dyn():
     'Misura parametri dinamici cupola'
     input('Premi <invio> per iniziare')
-    cnts = []
-    tmes = []
     tpoll = GLOB.dyn_data['t360']/GLOB.dyn_data['n360']/5
-    safe_clear_counter(GLOB.handle)
-    GLOB.handle.SetDigitalChannel(RIGHT_MOVE)
-    stoptime0 = time.time()+DYN_HTIME
-    stoptime1 = stoptime0+DYN_HTIME
-    idx = 0
-    stopidx = 0
-    while True:               # sample acceleration ramp
-        tme = time.time()
-        if stopidx == 0 and tme >= stoptime0:
-            stopidx = idx
-            GLOB.handle.ClearDigitalChannel(RIGHT_MOVE)
-        if tme >= stoptime1:
-            break
-        idx += 1
-        tmes.append(tme)
-        cnts.append(GLOB.handle.ReadCounter(ENCODER))
-        time.sleep(tpoll)
-    tm0 = tmes[0]
-    cn0 = cnts[0]
-    tmes = [(x-tm0) for x in tmes]
-    cnts = [(x-cn0) for x in cnts]
-    GLOB.dyn_data.update({'times': tmes, 'counts': cnts, 'nstop': stopidx, 'tpoll': tpoll})
+    GLOB.dyn_data.update(record_trace(GLOB.handle, tpoll, DYN_HTIME))
 
 def measure_one_step(tstep):
     'Misura spostamento corrispondente a step di data durata'
@@ -546,8 +523,7 @@ def measure_steps(max_t):
         times.append(tstep)
         counts.append(measure_one_step(tstep))
         tstep +=  0.5
-    ptable = np.interp(np.arange(counts[-1]), counts, times)
-    return ptable.tolist()
+    return make_ptable(times, counts)
 
 def save_data():
     'salva dati generati'
@@ -584,44 +560,6 @@ def print_all():
     print(f' - tempo di chiusura/apertura vano: {GLOB.dome_data["shuttime"]:.1f} s')
     print(' - num. elementi tabella impulsi per piccoli movimenti: ', len(GLOB.dome_data["ptable"]))
 
-def accel_params(times, counts, nstop):
-    'Calcola parametri della fase di accelerazione'
-    times = times[:nstop]
-    counts = counts[:nstop]
-    err = float('inf')
-    end_accel = 0
-    guard = nstop/2
-    while True:
-        if end_accel > guard:
-            print('Non converge!!!')
-            return None, None
-        line, res = np.polyfit(times[end_accel:],counts[end_accel:],1,full=True)[:2]
-        res = res[0]/len(times[end_accel:])
-        if res >= err:
-            break
-        err = res
-        end_accel += 1
-    vmax = line[0]
-    return end_accel, vmax
-
-def decel_params(times, counts, nstop):
-    'Calcola parametri della fase di decelerazione'
-    err = float('inf')
-    end_decel = nstop
-    guard = nstop+(len(times)-nstop)/2
-
-    while True:
-        if end_decel > guard:
-            print('Non converge!!!')
-            return None
-        _unused, res = np.polyfit(times[end_decel:],counts[end_decel:],1,full=True)[:2]
-        res = res[0]/len(times[end_decel:])
-        if res >= err:
-            break
-        err = res
-        end_decel += 1
-    return end_decel
-
 def do_plot(times, counts, end_accel, nstop, end_decel, xtsafe, ytsafe): #pylint: disable=R0913,R0914
     'Genera grafico'
     tacc = GLOB.dome_data['tstart']
@@ -721,6 +659,9 @@ def main():                        #pylint: disable=R0912,R0914,R0915
     nstop = GLOB.dyn_data['nstop']
     end_accel, vmax = accel_params(times, counts, nstop)
     end_decel = decel_params(times, counts, nstop)
+    if end_accel is None or end_decel is None:
+        print('Non converge!!!')
+        simulator_stop()
 
     GLOB.dome_data['hoffset'] = int(GLOB.dyn_data['hoffset'])
     GLOB.dome_data['n360'] = int(GLOB.dyn_data['n360'])
@@ -733,9 +674,8 @@ def main():                        #pylint: disable=R0912,R0914,R0915
     GLOB.dome_data['nstop'] = int(counts[end_decel]-counts[nstop])
     GLOB.dome_data['vmax'] = float(vmax)
 
-    stp = counts[1:]-counts[:-1]
-    stptm = times[np.asarray(stp).nonzero()]    # istanti di transizione
-    GLOB.dome_data['tsafe'] = (stptm[-1]-stptm[-2])*1.2
+    stptm = times[:-1][np.diff(counts) != 0]    # istanti di transizione
+    GLOB.dome_data['tsafe'] = tsafe_param(times, counts)
     ytsafe = counts[-1]+5
     ytsafe = (ytsafe, ytsafe)
     xtsafe = (stptm[-2], stptm[-2]+GLOB.dome_data['tsafe'])
@@ -42,6 +42,14 @@ where:
 #
 #               TelSampler.tel_stop() - called once, at the end of operations
 #                  to stop the communication with the telescope
+#
+#            The TelSampler may optionally provide the method:
+#
+#               TelSampler.az_ahead(tsec) - returns the azimuth required to the
+#                  dome tsec seconds ahead of the current time (-1.0 if it cannot
+#                  be computed). It is used to plan dome movements in slave mode
+#                  (see slave_planner.py); if missing, the azimuth is extrapolated
+#                  from recent values
 
 # If the module is available in the import path it will be imported and used,
 # otherwise, the controller will not support the slave mode
@@ -53,8 +61,10 @@ import sys
 import os
 import time
 import json
+import heapq
 import logging
-from threading import Thread, Lock
+from collections import namedtuple
+from threading import Thread, Lock, Event, Condition
 
 __version__ = '2.1'
 __author__ = 'Luca Fini'
@@ -67,7 +77,10 @@ except ModuleNotFoundError:
 
 from dome_tools import *     #pylint: disable=W0401,W0614
 
-from k8055_simulator import K8055Simulator
+from k8055_simulator import K8055Simulator, RealClock
+from slave_planner import SlavePlanner, SLAVE_TOL
+from motion_model import MotionModel
+from loop_stats import LoopStats, TimedDevice
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 sys.path.insert(0, os.path.abspath(os.path.join(THIS_DIR, "..")))
@@ -107,7 +120,10 @@ DEBUG_LOCK = False    # set to true to enable deadlock debugging mode
 
 _PULSE_TIME = 1       # Duration of pulsed relais for open/close shutter (sec)
 _SAMPLE_PERIOD = 2    # period of position logging
-_CHECK_PERIOD = 1     # period of connection checking
+_CHECK_PERIOD = 1     # period of device search when the board is responding
+_IDLE_POLL = 0.5      # polling period when the dome is idle (sec)
+_SLAVE_POLL = 0.2     # polling period when slaved and within tolerance (sec)
+_TIMING_PERIOD = 600  # period of timing statistics logging (sec)
 
 _NO_ERROR = ''
 
@@ -124,6 +140,7 @@ class ENGLISH:             #pylint: disable=R0903
     UNCONFIGURED = 'Dome - configuration parameter missing'
     UNIMPLEMENTED = 'Dome - function not yet implemented'
     VALUE_ERROR = 'Dome - value error'
+    WRITE_ERROR = 'Dome - error writing board outputs'
 
 class ITALIAN:             #pylint: disable=R0903
     'Italian messages'
@@ -138,6 +155,7 @@ class ITALIAN:             #pylint: disable=R0903
     UNCONFIGURED = 'Cupola - parametro di configurazione non definito'
     UNIMPLEMENTED = 'Cupola - operazione non ancora implementata'
     VALUE_ERROR = 'Cupola - valore errato'
+    WRITE_ERROR = 'Cupola - errore di scrittura uscite della scheda'
 
 _CANT_SLAVE = 0     # Slave mode unsupported
 _NO_AZIMUTH = 1     # Azimuth not available
@@ -171,6 +189,8 @@ _MORE_HELP = '''
     cs       - Close shutter
     c  n     - Close relay N (0..3)
     o  n     - Open relay N (0..3)
+    r  xxxx  - Set relays 0..3 with one operation (x: 1 close, 0 open,
+               - unchanged. E.g.: "r 1-01")
 
     sv       - Set/unset slave mode
 
@@ -203,7 +223,7 @@ class _GB:                  # pylint: disable=R0903
     loop = True
     server = None        # Serving Thread
     tsample = 0          # Position sampling time for debug
-    tcheck = 0           # Connection checking time
+    tcheck = 0           # Time of next device search
     movstat = IDLE       # Status of movement: IDLE(0): idle,
                          #                     STOPPING(1): stopping,
                          #                     AIMING(2): aiming at target,
@@ -225,7 +245,13 @@ class _GB:                  # pylint: disable=R0903
     ptable = []          # Pulse duration lookup table
     switch_stat = [0, 0, # 0: open, 1: closed
                    0, 0]
+    dout = 0             # Shadow of digital outputs (bit n-1: channel n)
+    dout_lock = Lock()   # Protect digital outputs
+    batch_out = False    # True if the board supports WriteAllDigital
     idletime = 0         # fraction of loop time remaining idle
+    timing = LoopStats() # timing statistics of control loop
+    ttiming = 0          # Time of next timing statistics logging
+    cmd_time = 0         # Time of last slew command (for latency measurement)
                          #### Dome data and parameters
     n360 = 0             # Steps per complete turn
     n180 = 0             # Steps per half turn
@@ -240,30 +266,79 @@ class _GB:                  # pylint: disable=R0903
     hoffset = None       # Offest zero.position-home.position (encoder steps)
     parkaz = None        # Park position (encoder steps)
     tpoll = None         # Main loop polling time (seconds)
+    wakeup = Event()     # Set to wake up the control loop
+    clock = RealClock()  # Clock for timers and waits (VirtualClock for simulations)
 
     telsamp = None   # Telescope sampler
+    planner = None       # Movement planner for slave mode
+    motion = None        # Motion model (None: use nstop/ptable positioning)
+    step_timer = None    # Pending timer for end of step
+    stop_timer = None    # Pending timer for stop detection
+    shut_timer = None    # Pending timer for shutter status update
 
 class _AFTER:                  # pylint: disable=R0903
     'support for timers'
     lock = Lock()
-    queue = []
+    heap = []            # Heap of timer entries: [firetime, seqnum, func]
+    seqnum = 0           # Insertion counter (keeps FIFO order for equal firetimes)
+    active = 0           # Number of pending (not cancelled) timers
 
 class _SWITCH:                  # pylint: disable=R0903
     'info about switches'
     names = ['SW-1', 'SW-2', 'SW-3', 'SW-4']
     descr = ['', '', '', '']
 
+# Status records are immutable: a new record is published by the control loop
+# (and by API calls modifying the status) replacing the previous one, so that
+# readers never need to acquire dome_lock
+
+DomeStatus = namedtuple('DomeStatus',
+                        ('connected',     # connection status
+                         'domeaz',        # Current azimuth (degrees), 0: north
+                         'direct',        # Movement direction:  0: idle
+                                          #                      1: clockwise
+                                          #                     -1: counterclockwise
+                         'idletime',      # fraction of loop time waiting idle
+                         'isslave',       # if True the dome is slaved to telescope
+                         'movstat',       # Movment status
+                         'targetaz'))     # Current target azimnuth (degrees)
+
+ExtStatus = namedtuple('ExtStatus', ('athome', 'atpark', 'connected', 'direct', 'domeaz',
+                                     'isslave', 'homeaz', 'movstat', 'targetaz', 'telstat'))
+
 class _STAT:                  # pylint: disable=R0903
-    'dome status'
-    connected = False     # connection status
-    domeaz = None         # Current azimuth (degrees), 0: north
-    direct = None         # Movement direction:  0: idle
-                          #                      1: clockwise
-                          #                     -1: counterclockwise
-    idletime = None       # fraction of loop time waiting idle
-    isslave = None        # if True the dome is slaved to telescope
-    movstat = None        # Movment status:
-    targetaz = -1         # Current target azimnuth (degrees)
+    'published status records'
+    status = DomeStatus(False, None, None, None, None, None, -1)
+    ext_status = ExtStatus(None, False, False, 0, 0, False, None, IDLE, -1, 0)
+    seq = 0                   # Incremented when status changes (idletime excluded)
+    changed = Condition()     # Notified when status changes
+
+def _status_changed(old, new):
+    'Compare status records, ignoring idletime'
+    return old[:3] != new[:3] or old[4:] != new[4:]
+
+def _publish():
+    'Publish current status (to protect with lock)'
+    if _GB.direct == RIGHT_MOVE:
+        direct = 1
+    elif _GB.direct == LEFT_MOVE:
+        direct = -1
+    else:
+        direct = 0
+    atpark = _GB.movstat == IDLE and _GB.parkaz is not None and \
+             abs(_ang_dist(_GB.domeaz, _GB.parkaz)) <= _GB.maxerr
+    _STAT.ext_status = ExtStatus(None, atpark, bool(_GB.handle), _GB.direct, _GB.domeaz,
+                                 _GB.isslave, _GB.hoffset, _GB.movstat, _GB.targetaz,
+                                 _GB.telstat)
+    status = DomeStatus((_GB.server is not None) and _GB.connected,
+                        _GB.domeaz*_GB.todeg, direct, _GB.idletime, _GB.isslave,
+                        _GB.movstat, _GB.targetaz*_GB.todeg)
+    changed = _status_changed(_STAT.status, status)
+    _STAT.status = status
+    if changed:
+        with _STAT.changed:
+            _STAT.seq += 1
+            _STAT.changed.notify_all()
 
 def _sample(cnt):
     'Record periodic status'
@@ -272,27 +347,59 @@ def _sample(cnt):
                     _GB.movstat, _GB.isslave, _GB.telstat)
 
 def _after(delay, func):
-    'timer for action'
-    firetime = time.time()+delay
+    'timer for action. Returns a handle which can be used to cancel the timer'
+    firetime = _GB.clock.time()+delay
     with _AFTER.lock:
-        _AFTER.queue.append((firetime, func))
-        _AFTER.queue.sort(key=lambda x: x[0])
+        _AFTER.seqnum += 1
+        entry = [firetime, _AFTER.seqnum, func]
+        heapq.heappush(_AFTER.heap, entry)
+        _AFTER.active += 1
+        first = _AFTER.heap[0] is entry
+    if first:                        # control loop may be sleeping longer
+        _wake()
+    return entry
+
+def _cancel(entry):
+    'cancel a pending timer (no effect if already executed or cancelled)'
+    if entry is None:
+        return
+    with _AFTER.lock:
+        if entry[2] is not None:
+            entry[2] = None          # cancelled entries are discarded when popped
+            _AFTER.active -= 1
+
+def _pending_timers():
+    'Number of pending timers'
+    with _AFTER.lock:
+        return _AFTER.active
+
+def _next_timer():
+    'Fire time of next timer (None if no timer is pending)'
+    with _AFTER.lock:
+        while _AFTER.heap and _AFTER.heap[0][2] is None:   # drop cancelled timers
+            heapq.heappop(_AFTER.heap)
+        return _AFTER.heap[0][0] if _AFTER.heap else None
+
+def _wake():
+    'Wake up the control loop (to be called when fast polling may be required)'
+    _GB.wakeup.set()
 
 def _exec_timers(now):
-    'get next timed function'
+    'execute expired timers'
     while True:
         with _AFTER.lock:
-            func = None
-            if _AFTER.queue:
-                ftime, func = _AFTER.queue[0]
-                if ftime <= now:
-                    _AFTER.queue.pop(0)
-                else:
-                    break
-            else:
+            if not _AFTER.heap or _AFTER.heap[0][0] > now:
                 break
+            entry = heapq.heappop(_AFTER.heap)
+            func = entry[2]
+            if func is not None:
+                entry[2] = None
+                _AFTER.active -= 1
         if func:
+            _GB.timing.record('timer_delay', max(0.0, _GB.clock.time()-entry[0]))
+            tstart = time.perf_counter()
             func()
+            _GB.timing.record('timer', time.perf_counter()-tstart)
 
 def _ang_dist(ang1, ang2):
     'compute angular distance ang1-ang2 (in unità encoder)'
@@ -303,6 +410,53 @@ def _ang_dist(ang1, ang2):
         dist += _GB.n360
     return dist
 
+def _bit(nchan):
+    'bit mask of digital output channel (1..8)'
+    return 1<<(nchan-1)
+
+_MOTOR_BITS = _bit(LEFT_MOVE)|_bit(RIGHT_MOVE)
+
+def _write_outputs(setmask=0, clearmask=0):
+    '''Set and clear digital outputs given as bit masks (a bit may be either in
+    setmask or in clearmask).
+
+    The new output status is computed from the shadow register and, if it
+    differs from current status, it is written with a single WriteAllDigital
+    call (or with one call per changed channel, if not supported).
+    Returns False if the change would activate both motor relays or if the
+    board call fails'''
+    with _GB.dout_lock:
+        new = (_GB.dout|setmask)&~clearmask&0xff
+        if new&_MOTOR_BITS == _MOTOR_BITS:
+            _GB.logger.error('refused output status: %02x (both motor relays)', new)
+            return False
+        changed = new^_GB.dout
+        if not changed:
+            return True
+        try:
+            if _GB.batch_out:
+                _GB.handle.WriteAllDigital(new)
+            else:
+                for nchan in range(1, 9):
+                    if changed&_bit(nchan):
+                        if new&_bit(nchan):
+                            _GB.handle.SetDigitalChannel(nchan)
+                        else:
+                            _GB.handle.ClearDigitalChannel(nchan)
+                        _GB.dout ^= _bit(nchan)     # track partial writes
+        except Exception as excp:                  #pylint: disable=W0703
+            _GB.logger.error('error writing output status %02x: %s', new, str(excp))
+            return False
+        _GB.dout = new
+    return True
+
+def _clear_outputs():
+    'Clear all digital outputs'
+    with _GB.dout_lock:
+        _GB.handle.ClearAllDigital()
+        _GB.dout = 0
+        _GB.switch_stat = [0, 0, 0, 0]
+
 def _start_lk(direct, tstep=None):
     'Start movement (to protect with lock)'
     _GB.logger.info('_start_lk(%d, %s)', direct, tstep)
@@ -312,57 +466,103 @@ def _start_lk(direct, tstep=None):
         _GB.logger.error(_GB.language.CANT_EXECUTE)
         return _GB.language.CANT_EXECUTE
     safe_clear_counter(_GB.handle)
+    if not _write_outputs(setmask=_bit(direct)):
+        _GB.logger.error(_GB.language.WRITE_ERROR)
+        return _GB.language.WRITE_ERROR
     _GB.saveaz = _GB.domeaz
     _GB.direct = direct
-    _GB.handle.SetDigitalChannel(_GB.direct)
+    if _GB.cmd_time:
+        _GB.timing.record('slew_latency', time.perf_counter()-_GB.cmd_time)
+        _GB.cmd_time = 0
+    _wake()
     if tstep is None:
         _GB.movstat = AIMING
     elif tstep < 0.0:
         _GB.movstat = RUNNING
     else:
-        _after(tstep, _end_step)
+        _GB.step_timer = _after(tstep, _end_step)
         _GB.movstat = STEPPING
+    _publish()
     return _NO_ERROR
 
 def _stop_lk(reason):
     'stop movement (to protect with lock)'
     _GB.logger.info('_stop_lk(%s)', reason)
-    _GB.handle.ClearDigitalChannel(_GB.direct)         # stop the motor
+    _write_outputs(clearmask=_MOTOR_BITS)              # stop the motor
     _GB.stopcn = _GB.handle.ReadCounter(ENCODER)       # get current count
     _GB.movstat = STOPPING
-    _after(_GB.tsafe, _check_stopped)
+    _publish()
+    _wake()
+    _cancel(_GB.step_timer)                            # step end is no more needed
+    _GB.step_timer = None
+    _cancel(_GB.stop_timer)
+    _GB.stop_timer = _after(_GB.tsafe, _check_stopped)
 
 def _check_stopped():
     'detect motion end'
     with _GB.dome_lock:
         cnt = _GB.handle.ReadCounter(ENCODER)
         _GB.logger.info('_check_stopped. cnt=%d', cnt)
+        if cnt < 0:                        # board not responding: retry later
+            _GB.connected = False
+            _GB.stop_timer = _after(_GB.tsafe, _check_stopped)
+            return
         if cnt == _GB.stopcn:
             if _GB.direct == LEFT_MOVE:
                 _GB.domeaz = int((_GB.saveaz-cnt)%_GB.n360)
             elif _GB.direct == RIGHT_MOVE:
                 _GB.domeaz = int((_GB.saveaz+cnt)%_GB.n360)
+            if _GB.motion:
+                _GB.motion.stopped(cnt)
             safe_clear_counter(_GB.handle)
             _GB.saveaz = _GB.domeaz
             _GB.direct = 0
             _GB.movstat = IDLE
             _GB.stopcn = -1
+            _GB.stop_timer = None
+            _publish()
             _GB.logger.info('_check_stopped: stop detected')
             return
         _GB.stopcn = cnt
-        _after(_GB.tsafe, _check_stopped)
+        _GB.stop_timer = _after(_GB.tsafe, _check_stopped)
 
 def _end_step():
     'End of time for pulse movement'
     with _GB.dome_lock:
+        _GB.step_timer = None
         if _GB.stopcn < 0:
             _stop_lk('_end_step')
 
 def _check_connection():
-    'Check connection status'
+    'Check connection status with a full device search'
     _GB.connected = _GB.handle.SearchDevices() > 0
     return _GB.connected
 
+def _read_counter(now):
+    '''Read encoder counter and check connection status (to protect with lock).
+
+    A successful counter reading proves that the board is responding, so the
+    device search is done only after an error or every _CHECK_PERIOD seconds.
+    Returns None if the board is not responding'''
+    if not _GB.connected or now >= _GB.tcheck:
+        was_connected = _GB.connected
+        _GB.tcheck = now+_CHECK_PERIOD
+        if not _check_connection():
+            if was_connected:
+                _GB.logger.error('device search failed: board not connected')
+            return None
+        if not was_connected:
+            _GB.logger.info('connection established')
+    try:
+        cnt = _GB.handle.ReadCounter(ENCODER)
+    except Exception:                  #pylint: disable=W0703
+        cnt = -1
+    if cnt < 0:
+        _GB.logger.error('error reading encoder counter')
+        _GB.connected = False
+        return None
+    return cnt
+
 def _dome_loop():                          #pylint: disable=R0912,R0915
     'Dome status update loop (executed as Thread)'
     _GB.logger.info('control loop starting')
@@ -372,71 +572,104 @@ def _dome_loop():                          #pylint: disable=R0912,R0915
             if _check_connection():
                 _GB.logger.info('connection established')
                 break
-        time.sleep(1)
+        _GB.clock.wait(_GB.wakeup, 1)
     if not _GB.connected:
         _GB.logger.info('control loop terminated while not connected')
         return
-    _GB.handle.ClearAllDigital()     # set a known status
+    _clear_outputs()                 # set a known status
+    _GB.ttiming = _GB.clock.time()+_TIMING_PERIOD
     while _GB.loop:
-        tstart = time.time()
+        tstart = _GB.clock.time()
+        tcycle = time.perf_counter()
+        _GB.wakeup.clear()
         _exec_timers(tstart)
+        if tstart >= _GB.ttiming:
+            _log_timing()
+            _GB.ttiming = tstart+_TIMING_PERIOD
+        tlock = time.perf_counter()
         with _GB.dome_lock:
-            if not _check_connection():      # periodically check connection
-                time.sleep(_GB.tpoll)
-                continue
-            cnt = _GB.handle.ReadCounter(ENCODER)                # update current position
-            if _GB.direct == RIGHT_MOVE:
-                _GB.domeaz = int((_GB.saveaz+cnt)%_GB.n360)
-            elif _GB.direct == LEFT_MOVE:
-                _GB.domeaz = int((_GB.saveaz-cnt)%_GB.n360)
-            if tstart > _GB.tsample and _GB.movstat != IDLE:    # periodically log
-                                                                # current position
-                _sample(cnt)
-                _GB.tsample = tstart+_SAMPLE_PERIOD
-            if _GB.canslave:
-                azh = _GB.telsamp.az_from_tel()
-                if azh < 0.0:
-                    _GB.telstat = _NO_AZIMUTH
-                else:
-                    _GB.telstat = _TEL_OK
-            else:
-                azh = -1
-            if _GB.isslave:                                     # manage slave mode
-                if azh < 0.0:
-                    _GB.targetaz = -1
-                else:
-                    _GB.targetaz = _to_encoder(azh)
-            if _GB.telstat != _GB.telsave:
-                _GB.logger.info('tel. status now: %d', _GB.telstat)
-                _GB.telsave = _GB.telstat
-            if _GB.targetaz < 0:
-                dst, adst = 0.0, 0.0
+            _GB.timing.record('lock_wait', time.perf_counter()-tlock)
+            cnt = _read_counter(tstart)                         # update current position
+            if cnt is None:                                     # not connected: retry later
+                _publish()
+                tpoll = _GB.tpoll if _GB.movstat != IDLE else _CHECK_PERIOD
             else:
-                dst = _ang_dist(_GB.targetaz, _GB.domeaz)
-                adst=abs(dst)
-            if _GB.movstat == IDLE:
-                if adst > _GB.nstop:
-                    direct = RIGHT_MOVE if dst > 0 else LEFT_MOVE
-                    _GB.logger.info('Start movement (dist=%d)', dst)
-                    _start_lk(direct)
-                elif adst > _GB.maxerr:
-                    direct = RIGHT_MOVE if dst > 0 else LEFT_MOVE
-                    pls = _GB.ptable[adst]
-                    _GB.logger.info('Stepping to final position (dist=%d, pulse=%.2f)', dst, pls)
-                    _start_lk(direct, tstep=pls)
+                if _GB.direct == RIGHT_MOVE:
+                    _GB.domeaz = int((_GB.saveaz+cnt)%_GB.n360)
+                elif _GB.direct == LEFT_MOVE:
+                    _GB.domeaz = int((_GB.saveaz-cnt)%_GB.n360)
+                if tstart > _GB.tsample and _GB.movstat != IDLE:    # periodically log
+                                                                    # current position
+                    _sample(cnt)
+                    _GB.tsample = tstart+_SAMPLE_PERIOD
+                if _GB.canslave:
+                    azh = _GB.telsamp.az_from_tel()
+                    if azh < 0.0:
+                        _GB.telstat = _NO_AZIMUTH
+                    else:
+                        _GB.telstat = _TEL_OK
                 else:
-                    _GB.targetaz = -1
-            elif _GB.movstat == AIMING:
-                if adst < _GB.nstop:
-                    _stop_lk('Approaching target')
+                    azh = -1
+                if _GB.isslave:                                     # manage slave mode
+                    if azh < 0.0:
+                        _GB.targetaz = -1
+                    else:
+                        _GB.targetaz = _GB.planner.target(_GB.telsamp, azh, _GB.domeaz)
+                if _GB.telstat != _GB.telsave:
+                    _GB.logger.info('tel. status now: %d', _GB.telstat)
+                    _GB.telsave = _GB.telstat
+                if _GB.targetaz < 0:
+                    dst, adst = 0.0, 0.0
                 else:
+                    dst = _ang_dist(_GB.targetaz, _GB.domeaz)
+                    adst=abs(dst)
+                if _GB.movstat == IDLE:
+                    if _GB.motion and adst > _GB.maxerr:
+                        direct = RIGHT_MOVE if dst > 0 else LEFT_MOVE
+                        _GB.logger.info('Start movement (dist=%d, run time: %.2f)',
+                                        dst, _GB.motion.run_time(adst))
+                        _start_lk(direct)
+                        _GB.motion.start(tstart)
+                    elif adst > _GB.nstop:
+                        direct = RIGHT_MOVE if dst > 0 else LEFT_MOVE
+                        _GB.logger.info('Start movement (dist=%d)', dst)
+                        _start_lk(direct)
+                    elif adst > _GB.maxerr:
+                        direct = RIGHT_MOVE if dst > 0 else LEFT_MOVE
+                        pls = _GB.ptable[adst]
+                        _GB.logger.info('Stepping to final position (dist=%d, pulse=%.2f)',
+                                        dst, pls)
+                        _start_lk(direct, tstep=pls)
+                    else:
+                        _GB.targetaz = -1
+                        _GB.cmd_time = 0
+                elif _GB.movstat == AIMING:
                     direct = RIGHT_MOVE if dst > 0 else LEFT_MOVE
-                    if direct != _GB.direct:
+                    if _GB.motion:
+                        if direct != _GB.direct:
+                            _stop_lk('Wrong direction')
+                        elif _GB.motion.must_stop(tstart, cnt, adst):
+                            _stop_lk('Predicted stop at target')
+                    elif adst < _GB.nstop:
+                        _stop_lk('Approaching target')
+                    elif direct != _GB.direct:
                         _stop_lk('Wrong direction')
-        nextpoll = _GB.tpoll - (time.time()-tstart)
-        _GB.idletime = nextpoll/_GB.tpoll
-        if nextpoll>0:
-            time.sleep(nextpoll)
+                _publish()
+                if _GB.movstat != IDLE or _GB.targetaz >= 0:   # fast polling while moving
+                    tpoll = _GB.tpoll
+                elif _GB.isslave:
+                    tpoll = _SLAVE_POLL
+                else:
+                    tpoll = _IDLE_POLL
+        _GB.timing.cycle(time.perf_counter()-tcycle, tpoll)
+        now = _GB.clock.time()
+        nextpoll = tpoll-(now-tstart)
+        _GB.idletime = nextpoll/tpoll
+        nexttimer = _next_timer()
+        if nexttimer is not None:
+            nextpoll = min(nextpoll, nexttimer-now)
+        if nextpoll > 0:
+            _GB.clock.wait(_GB.wakeup, nextpoll)
     _GB.logger.info('Dome - control loop terminated')
 
 ###### API support functions
@@ -450,14 +683,17 @@ def _start_pulse(n_rele, p_time):
     _GB.logger.info('_start_pulse(%d, %d)', n_rele, p_time)
     if not _GB.connected:
         return _GB.language.UNCONNECTED
-    _GB.handle.SetDigitalChannel(n_rele)
+    if not _write_outputs(setmask=_bit(n_rele)):
+        _GB.logger.error(_GB.language.WRITE_ERROR)
+        return _GB.language.WRITE_ERROR
     _after(p_time, lambda: _end_pulse(n_rele))
     return _NO_ERROR
 
 def _end_pulse(n_rele):
     'close relais after pulse period'
     _GB.logger.info('_end_pulse(%d)', n_rele)
-    _GB.handle.ClearDigitalChannel(n_rele)
+    if not _write_outputs(clearmask=_bit(n_rele)):
+        _GB.logger.error(_GB.language.WRITE_ERROR)
 
 def _slew_to(val):
     'Go to azimuth (in encoder units)'
@@ -469,12 +705,25 @@ def _slew_to(val):
             _GB.logger.error(_GB.language.CANT_EXECUTE)
             return _GB.language.CANT_EXECUTE
         _GB.targetaz = val
+        _GB.cmd_time = time.perf_counter()
+        _publish()
+    _wake()
     return _NO_ERROR
 
 def _set_shut_stat(val):
     'Set shutter status open(1)/closed(0)'
     _GB.shutstat = val
 
+def _log_timing():
+    'Log timing statistics of control loop'
+    summ = _GB.timing.summary()
+    _GB.logger.info('timing: %d cycles in %.0f s, %d overruns',
+                    summ.pop('cycles'), summ.pop('elapsed'), summ.pop('overruns'))
+    for name, hist in sorted(summ.items()):
+        _GB.logger.info('timing: %s n=%d mean=%.3f p50=%.3f p99=%.3f max=%.3f (ms)',
+                        name, hist['count'], hist['mean_ms'], hist['p50_ms'],
+                        hist['p99_ms'], hist['max_ms'])
+
 def _log_status():
     'Print status variables'
     _GB.logger.info('current status')
@@ -503,8 +752,8 @@ def _log_status():
 ##################################  API section  ############################
 
 ####################################################  Server management calls
-def start_server(logger=False, telsamp=None,                   #pylint: disable=R0915
-                 sim_k8055=False, language='', debug=False):
+def start_server(logger=False, telsamp=None,                   #pylint: disable=R0913,R0915
+                 sim_k8055=False, language='', debug=False, clock=None):
     '''
     Launch dome control loop.
 
@@ -526,11 +775,20 @@ def start_server(logger=False, telsamp=None,                   #pylint: disable=
     debug : bool
         Enables debug messages
 
+    clock : RealClock or VirtualClock
+        Clock used for timers and waits of the control loop and by the K8055
+        simulator (see k8055_simulator.py). With a VirtualClock the control loop
+        runs when other threads advance the time with clock.sleep(), so that
+        simulations run faster than real time and are reproducible.
+        Default: real time
+
     Returns
     -------
     dct : DomeController object
     '''
     _GB.debug = debug
+    if clock:
+        _GB.clock = clock
     if language.upper() == 'EN':
         _GB.language = ENGLISH
     elif language.upper() == 'IT':
@@ -559,7 +817,13 @@ def start_server(logger=False, telsamp=None,                   #pylint: disable=
         raise RuntimeError(_GB.language.NO_DOME_DATA) from exc
     if sim_k8055:
         _GB.logger.info('using K8055 simulator')
-        _GB.handle = K8055Simulator()
+        dyn_file = os.path.join(THIS_DIR, DOME_DYN_FILE)
+        _GB.handle = K8055Simulator(clock=_GB.clock,
+                                    dyn_file=dyn_file if os.path.exists(dyn_file) else None)
+    if not isinstance(_GB.handle, TimedDevice):
+        _GB.handle = TimedDevice(_GB.handle, _GB.timing)
+    _GB.batch_out = hasattr(_GB.handle, 'WriteAllDigital')
+    _GB.logger.info('batched output writes: %s', 'yes' if _GB.batch_out else 'no')
     try:
         _GB.handle.OpenDevice(K8055_PORT)
     except Exception as excp:
@@ -585,15 +849,29 @@ def start_server(logger=False, telsamp=None,                   #pylint: disable=
 
     _GB.targetaz = -1
     _GB.canslave = bool(telsamp)
-    if not _GB.canslave:
+    if _GB.canslave:
+        _GB.planner = SlavePlanner(dome_data, dome_data.get('slavetol', SLAVE_TOL),
+                                   os.path.join(THIS_DIR, DOME_DYN_FILE))
+    else:
         _GB.telstat = _CANT_SLAVE
     _GB.saveaz = _GB.domeaz
     _GB.n180 = _GB.n360/2
     _GB.todeg = 360./_GB.n360
     _GB.toenc = _GB.n360/360.
+    try:
+        _GB.motion = MotionModel.from_file(os.path.join(THIS_DIR, DOME_DYN_FILE))
+    except (FileNotFoundError, KeyError, ValueError):
+        _GB.logger.info('dynamic data not available: using nstop/ptable positioning')
+        _GB.motion = None
+    else:
+        _GB.logger.info('motion model: %s', str(_GB.motion.params()))
+
+    with _GB.dome_lock:                 # first status record from dome data
+        _publish()
 
     with _GB.cmd_lock:                  # block other API calls
         _GB.server = Thread(target=_dome_loop)
+        _GB.clock.attach(_GB.server)
         _GB.server.start()
         count = 10
         while not _GB.server.is_alive():
@@ -630,22 +908,23 @@ class DomeController:              #pylint: disable=R0904
             while True:                   # wait for dome complete stop
                 if _GB.movstat == IDLE:
                     break
-                time.sleep(_GB.tpoll)
+                _GB.clock.sleep(_GB.tpoll)
             _GB.logger.debug('Dome is idle')
-            while True:                 # wait for timers to be executed
-                with _AFTER.lock:
-                    if not _AFTER.queue:
-                        break
-                time.sleep(0.1)
+            while _pending_timers():    # wait for timers to be executed
+                _GB.clock.sleep(0.1)
             if _GB.server:
                 _GB.loop = False
+                _wake()
                 _GB.logger.info('waiting thread to exit')
                 _GB.server.join()        # wait server loop termination
                 _GB.logger.info('thread %d terminated', _GB.server.native_id)
             _GB.server = None
+            with _GB.dome_lock:
+                _publish()
         _GB.logger.info('clearing all digital outputs')
-        _GB.handle.ClearAllDigital()
-        if isinstance(_GB.handle, K8055Simulator):   # stop K8055 simulator, if necessary
+        _clear_outputs()
+        _log_timing()
+        if isinstance(_GB.handle.device, K8055Simulator):   # stop K8055 simulator, if necessary
             _GB.logger.info('stop K8055 simulator loop')
             _GB.handle.stop()
         try:
@@ -676,7 +955,9 @@ class DomeController:              #pylint: disable=R0904
         _GB.logger.info('Dome API - close_shutter()')
         with _GB.cmd_lock:
             ret = _start_pulse(CLOSE_SHUTTER, _PULSE_TIME)
-            _after(_GB.shuttime, lambda: _set_shut_stat(0))
+            if ret == _NO_ERROR:
+                _cancel(_GB.shut_timer)
+                _GB.shut_timer = _after(_GB.shuttime, lambda: _set_shut_stat(0))
         return ret
 
     @staticmethod
@@ -693,10 +974,15 @@ class DomeController:              #pylint: disable=R0904
             return 'find_home:' +_GB.language.UNIMPLEMENTED
 
     @staticmethod
-    def get_ext_status():
+    def get_ext_status(timing=True):
         '''
         Read extended dome status
 
+        Parameters
+        ----------
+        timing : bool
+            If False the timing statistics are not included
+
         Returns
         -------
         status : dict
@@ -712,24 +998,23 @@ class DomeController:              #pylint: disable=R0904
             targetaz       Current target azimuth in encoder units
             telstat        Telescope status: 0: cannot slave, 1: azimuth not avaliable
                                              2: telescope ok
+            timing         Control loop timing statistics (dict):
+                               elapsed   time since start of statistics (sec)
+                               cycles    number of loop cycles
+                               overruns  number of cycles longer than polling period
+                           and, for each measured item, a dict with: count, mean_ms,
+                           p50_ms, p99_ms, max_ms. Measured items are:
+                               cycle         busy time of loop cycle
+                               lock_wait     wait for dome lock in loop cycle
+                               timer         execution time of timer actions
+                               timer_delay   delay of timer actions from due time
+                               slew_latency  time from slew command to motor relay
+                               <method>      duration of K8055 calls (ReadCounter,
+                                             SetDigitalChannel, ...)
          '''
-        ret = {}
-        with _GB.cmd_lock:
-            with _GB.dome_lock:
-                direct = _GB.direct
-                movstat = _GB.movstat
-                domeaz = _GB.domeaz
-                targetaz = _GB.targetaz
-            ret['athome'] = None    # TBD
-            ret['atpark'] = movstat == IDLE and abs(_ang_dist(domeaz, _GB.parkaz)) <= _GB.maxerr
-            ret['connected'] = bool(_GB.handle)
-            ret['direct'] = direct
-            ret['domeaz'] = domeaz
-            ret['isslave'] = _GB.isslave
-            ret['homeaz'] = _GB.hoffset
-            ret['movstat'] = movstat
-            ret['targetaz'] = targetaz
-            ret['telstat'] = _GB.telstat
+        ret = _STAT.ext_status._asdict()
+        if timing:
+            ret['timing'] = _GB.timing.summary()
         return ret
 
     @staticmethod
@@ -798,7 +1083,7 @@ class DomeController:              #pylint: disable=R0904
 
         Returns
         -------
-        status : STAT class
+        status : DomeStatus (immutable record)
             connected - True if dome is connected
             domeaz    - Current azimuth (degrees)
             direct    - Moving status: 0=idle, 1=clockwise, -1=counterclockwise
@@ -808,27 +1093,7 @@ class DomeController:              #pylint: disable=R0904
             targetaz  - Current target azimuth (degrees). If < 0, then target
                         azimuth is not set
         '''
-#   _dc_log('API: get_status()')
-        with _GB.cmd_lock:
-            with _GB.dome_lock:
-                domeaz = _GB.domeaz
-                direct = _GB.direct
-                idtime = _GB.idletime
-                movstat = _GB.movstat
-                targetaz = _GB.targetaz
-            _STAT.idletime = idtime
-            _STAT.movstat = movstat
-            _STAT.connected = (_GB.server is not None) and _GB.connected
-            _STAT.domeaz = domeaz*_GB.todeg
-            _STAT.targetaz = targetaz*_GB.todeg
-            _STAT.isslave = _GB.isslave
-            if direct == RIGHT_MOVE:
-                _STAT.direct = 1
-            elif direct == LEFT_MOVE:
-                _STAT.direct = -1
-            else:
-                _STAT.direct = 0
-        return _STAT
+        return _STAT.status
 
     @staticmethod
     def get_switch_names():
@@ -861,8 +1126,7 @@ class DomeController:              #pylint: disable=R0904
         -------
         states : [int]   0: open,  1: closed
         '''
-        with _GB.cmd_lock:
-            return _GB.switch_stat.copy()
+        return list(_GB.switch_stat)      # the list is replaced, never modified
 
     @staticmethod
     def get_version():
@@ -888,7 +1152,9 @@ class DomeController:              #pylint: disable=R0904
         with _GB.cmd_lock:
             _GB.logger.info('Dome API - open_shutter()')
             ret = _start_pulse(OPEN_SHUTTER, _PULSE_TIME)
-            _after(_GB.shuttime, lambda: _set_shut_stat(1))
+            if ret == _NO_ERROR:
+                _cancel(_GB.shut_timer)
+                _GB.shut_timer = _after(_GB.shuttime, lambda: _set_shut_stat(1))
         return ret
 
     @staticmethod
@@ -926,6 +1192,7 @@ class DomeController:              #pylint: disable=R0904
                     _GB.logger.error(_GB.language.CANT_EXECUTE)
                     return _GB.language.CANT_EXECUTE
                 _GB.parkaz = _GB.domeaz
+                _publish()
         return _NO_ERROR
 
     @staticmethod
@@ -951,10 +1218,55 @@ class DomeController:              #pylint: disable=R0904
                 if _GB.movstat != IDLE:
                     _GB.logger.error(_GB.language.CANT_EXECUTE)
                     return _GB.language.CANT_EXECUTE
+                _GB.planner.reset()
                 _GB.isslave = True
+                _publish()
+            _wake()
             return _NO_ERROR
         return _NO_ERROR
 
+    @staticmethod
+    def set_switches(states):
+        '''
+        Set/clear a group of switches with a single operation on the board
+
+        Parameters
+        ----------
+        states : dict or sequence
+            Either a dict {n_switch: enable} or a sequence of up to four
+            values (one for each switch, starting from 0) where enable is:
+            True: close switch, False: open switch, None: leave unchanged
+
+        Returns
+        -------
+        err : str
+            Error message. No error is an empty string
+        '''
+        _GB.logger.info('Dome API - set_switches(%s)', str(states))
+        if not isinstance(states, dict):
+            states = dict(enumerate(states))
+        setmask = clearmask = 0
+        try:
+            for n_rele, enable in states.items():
+                n_rele = int(n_rele)
+                if not 0 <= n_rele <= 3:
+                    return _GB.language.VALUE_ERROR
+                if enable is None:
+                    continue
+                if enable:
+                    setmask |= _bit(AUX_RELE_1+n_rele)
+                else:
+                    clearmask |= _bit(AUX_RELE_1+n_rele)
+        except (TypeError, ValueError):
+            return _GB.language.VALUE_ERROR
+        with _GB.cmd_lock:
+            if not _GB.connected:
+                return _GB.language.UNCONNECTED
+            if not _write_outputs(setmask, clearmask):
+                return _GB.language.WRITE_ERROR
+            _GB.switch_stat = [(_GB.dout>>(AUX_RELE_1-1+n))&1 for n in range(4)]
+        return _NO_ERROR
+
     @staticmethod
     def slew_to_azimuth(azh):
         '''
@@ -1068,10 +1380,12 @@ class DomeController:              #pylint: disable=R0904
             with _GB.dome_lock:
                 _GB.isslave = False
                 if _GB.movstat == IDLE:
+                    _publish()
                     return _NO_ERROR
                 if _GB.movstat in (AIMING, STEPPING, RUNNING):
                     _stop_lk('Stop command')
                 _GB.targetaz = -1
+                _publish()
         return _NO_ERROR
 
     @staticmethod
@@ -1091,23 +1405,8 @@ class DomeController:              #pylint: disable=R0904
         err : str
             Error message. No error is an empty string
         '''
-        _GB.logger.info('Dome API - switch(%d, %d)', n_rele, enable)
-        with _GB.cmd_lock:
-            if not _GB.connected:
-                return _GB.language.UNCONNECTED
-            try:
-                n_rele = int(n_rele)
-            except ValueError:
-                return _GB.language.VALUE_ERROR
-            if 0 <= n_rele <= 3:
-                if enable:
-                    _GB.handle.SetDigitalChannel(AUX_RELE_1+n_rele)
-                    _GB.switch_stat[n_rele] = 1
-                else:
-                    _GB.handle.ClearDigitalChannel(AUX_RELE_1+n_rele)
-                    _GB.switch_stat[n_rele] = 0
-                return _NO_ERROR
-        return _GB.language.VALUE_ERROR
+        _GB.logger.info('Dome API - switch(%s, %d)', n_rele, enable)
+        return DomeController.set_switches({n_rele: bool(enable)})
 
     @staticmethod
     def sync_to_azimuth(azh):
@@ -1137,6 +1436,7 @@ class DomeController:              #pylint: disable=R0904
                     _GB.logger.error(_GB.language.CANT_EXECUTE)
                     return _GB.language.CANT_EXECUTE
                 _GB.domeaz = domeaz
+                _publish()
         return _NO_ERROR
 
     @staticmethod
@@ -1145,6 +1445,32 @@ class DomeController:              #pylint: disable=R0904
         if _GB.server is not None:
             _GB.server.join()
 
+    @staticmethod
+    def wait_status_change(seq, timeout=None):
+        '''
+        Wait for a change of dome status (changes of idletime are ignored)
+
+        Parameters
+        ----------
+        seq : int
+            Sequence number of last status seen by the caller (0 at start)
+
+        timeout : float
+            Max waiting time (sec). None: wait forever
+
+        Returns
+        -------
+        seq : int
+            Sequence number of current status (equal to the argument if
+            the timeout expired without changes)
+
+        status : DomeStatus
+            Current status (see get_status())
+        '''
+        with _STAT.changed:
+            _STAT.changed.wait_for(lambda: _STAT.seq != seq, timeout)
+            return _STAT.seq, _STAT.status
+
 #################################################### test section #################################
 def _print_err(err):
     'Print error string'
@@ -1384,6 +1710,11 @@ def main():                     #pylint: disable=R0912,R0915,R0914
             ret = dct.switch(ans[1], True)
             _print_err(ret)
             continue
+        if ans[0] == 'r':
+            states = [{'1': True, '0': False}.get(x) for x in ans[1][:4]]
+            ret = dct.set_switches(states)
+            _print_err(ret)
+            continue
         if ans[0] == 'sp':
             ret = dct.set_park()
             _print_err(ret)
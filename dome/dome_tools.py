@@ -25,6 +25,7 @@ ENCODER = 1
 MICROSWITCH = 5     # Warning: ReadDigitalChannel not working on windows
 
 DOME_DATA_FILE = 'dome_data.json'
+DOME_DYN_FILE = 'dome_dyn.json'
 
 def safe_clear_counter(handle):
     'Clear encoder counter with check'
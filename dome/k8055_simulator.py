@@ -2,19 +2,55 @@
 k8055_simulator.py  - Simulatore di skcheda k8055 per tests
 
 Uso:
-    python k8055_simulator.py [-t] [-1] [-0] [-d]
+    python k8055_simulator.py [-t] [-v] [-l] [-1] [-0] [-d]
 
 Dove:
     -1   Crea file di controllo con valore 1 (simula scheda attiva)
     -0   Crea file di controllo con valore 1 (simula scheda assente)
     -t   Test funzionamento
+    -v   Test funzionamento con orologio virtuale e modello dinamico da dome_dyn.json
+    -l   Con -v: usa la legge di frenata lineare (vedi sotto)
     -d   Cancella file di controllo
+
+Il simulatore non usa thread: lo stato della cupola viene aggiornato, integrando
+il modello dinamico a passi di tempo fissi, ad ogni chiamata delle funzioni
+della scheda. Il tempo può essere quello reale o quello di un orologio virtuale
+(VirtualClock) che consente di eseguire simulazioni più veloci del tempo reale
+e riproducibili.
+
+Modelli dinamici:
+    - default: accelerazione e decelerazione costanti (ACCEL, MAX_SPEED)
+    - con dati da dome_dyn.json (parametro dyn_file): ritardo ed accelerazione
+      del primo ordine (vedi motion_model.py) e frenata secondo la legge
+      scelta con il parametro braking:
+
+        'costante': velocità mantenuta per un ritardo tdelay dallo
+                    spegnimento del motore, poi decelerazione costante.
+                    tdelay e decel sono ricavati dal fit della curva di
+                    arresto registrata (motion_model.coast_fit(); per
+                    dome_dyn.json: 0.4 s e 2.8 conteggi/sec^2, scarto
+                    quadratico medio 0.16 conteggi).
+                    Spazio di arresto: v*tdelay+v^2/(2*decel)
+        'lineare':  decelerazione proporzionale alla velocità, con lo stesso
+                    spazio di arresto alla velocità massima: spazio di
+                    arresto proporzionale alla velocità
+
+      NOTA: motion_model.py usa la legge 'costante'. Con la legge 'lineare'
+      le due leggi coincidono solo vicino alla velocità massima: le
+      simulazioni verificano il modello anche fuori dalle sue ipotesi
+
+La presenza della scheda può essere controllata con il metodo set_present()
+o, da un altro processo, con il file di controllo (opzioni -0/-1). Con la
+scheda assente tutte le funzioni di lettura e scrittura riportano -1 e non
+modificano lo stato del simulatore (0: operazione eseguita).
 '''
 
 import sys
 import os
 import time
-from threading import Timer, Lock
+import json
+import random
+from threading import Lock, Condition, current_thread
 
 from dome_tools import *     #pylint: disable=W0401,W0614
 
@@ -25,70 +61,280 @@ TMPPATH = DEVPATH+'.tmp'
 
 #pylint: disable=C0103
 
+BRAKING_LAWS = ('costante', 'lineare')
+
+class VirtualClock:
+    '''
+    Orologio virtuale: il tempo avanza solo con sleep() o advance()
+
+    Un thread di controllo (es.: il loop di dome_ctrl), registrato con
+    attach(), attende con wait(): resta fermo finché gli altri thread non
+    fanno avanzare il tempo con sleep() fino alla scadenza dell'attesa, o
+    finché l'evento dato non viene attivato. sleep() ritorna solo quando il
+    thread di controllo ha eseguito tutte le operazioni previste fino al
+    nuovo tempo corrente: le operazioni avvengono quindi a tempi virtuali
+    indipendenti dal tempo reale di esecuzione e le simulazioni sono
+    riproducibili
+    '''
+    POLL = 0.005        # intervallo reale di verifica dell'evento in wait() (sec)
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self._cond = Condition()
+        self._waiter = None         # thread di controllo
+        self._deadline = None       # scadenza dell'attesa in corso (None: thread attivo)
+        self._event = None          # evento dell'attesa in corso
+        self._limit = start         # limite di avanzamento per il thread di controllo
+
+    def time(self):
+        'Tempo corrente (sec)'
+        return self.now
+
+    def attach(self, thread):
+        'Registra il thread di controllo (da chiamare prima di avviarlo)'
+        with self._cond:
+            self._waiter = thread
+
+    def _waiter_active(self):
+        'Vero se il thread di controllo è in esecuzione (o non ancora avviato)'
+        return self._waiter is not None and \
+               (self._waiter.ident is None or self._waiter.is_alive()) and \
+               self._waiter is not current_thread()
+
+    def sleep(self, dt):
+        'Avanza il tempo di dt secondi'
+        with self._cond:
+            tend = self.now+max(dt, 0.0)
+            self._limit = max(self._limit, tend)
+            self._cond.notify_all()
+            while self._waiter_active() and (self._deadline is None or self._deadline <= tend
+                                             or self._event.is_set()):
+                self._cond.wait(self.POLL)
+            self.now = max(self.now, tend)
+
+    advance = sleep
+
+    def wait(self, event, timeout):
+        '''
+        Attesa del thread di controllo fino all'attivazione di event o per
+        timeout secondi. Riporta lo stato di event'''
+        with self._cond:
+            deadline = self.now+timeout
+            self._deadline = deadline
+            self._event = event
+            self._cond.notify_all()
+            try:
+                while not event.is_set():
+                    if deadline <= self._limit:
+                        self.now = max(self.now, deadline)
+                        return False
+                    self._cond.wait(self.POLL)
+                return True
+            finally:
+                self._deadline = None
+                self._cond.notify_all()
+
+class RealClock:
+    'Orologio reale (stessa interfaccia di VirtualClock)'
+    @staticmethod
+    def time():
+        'Tempo corrente (sec)'
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(dt):
+        'Attesa di dt secondi'
+        time.sleep(dt)
+
+    @staticmethod
+    def attach(_unused):
+        'Registrazione thread di controllo (nessuna azione)'
+
+    @staticmethod
+    def wait(event, timeout):
+        'Attesa fino all\'attivazione di event o per timeout secondi. Riporta lo stato di event'
+        return event.wait(timeout)
+
 class K8055Simulator:            #pylint: disable=R0902
-    'k8055 simulator'
-    PERIOD = 0.1        # simulator update period
-    ACCEL = 0.03        # simulator acceleration
-    MAX_SPEED = 1       # simulator max speed
-    def __init__(self):
-        self.count = 0
+    '''
+    k8055 simulator
+
+    Parameters
+    ----------
+    clock : object
+        Orologio (con metodo time()). Default: tempo reale
+
+    dyn_file : str
+        File con dati dinamici (dome_dyn.json). Se non specificato si usa
+        il modello ad accelerazione costante
+
+    noise : float
+        Rumore relativo sulla velocità (deviazione standard)
+
+    miss : float
+        Probabilità di perdita di un impulso di encoder
+
+    seed : int
+        Seme per il generatore di numeri casuali (per simulazioni riproducibili)
+
+    braking : str
+        Legge di frenata con dyn_file: 'costante' o 'lineare' (vedi sopra)
+    '''
+    PERIOD = 0.1        # periodo di riferimento per ACCEL e MAX_SPEED
+    ACCEL = 0.03        # accelerazione (conteggi/PERIOD per PERIOD)
+    MAX_SPEED = 1       # velocità massima (conteggi/PERIOD)
+    DT = 0.01           # passo di integrazione (sec)
+    VMIN = 0.05         # velocità sotto la quale la cupola si ferma (conteggi/sec)
+    def __init__(self, clock=None, dyn_file=None, noise=0.0, miss=0.0, seed=None,  #pylint: disable=R0913
+                 braking='costante'):
+        self.clock = clock if clock else RealClock()
         self.dig_channels = [0, 0, 0, 0, 0, 0, 0, 0]
         self.counters = [0, 0]
-        self.goon = True
-        self.next_t = time.time()
         self.direct = 0
-        self.speed = 0
+        self.speed = 0.0            # conteggi/sec
+        self.pos = 0.0              # posizione (conteggi, frazionaria)
+        self.ton = 0.0              # tempo dall'accensione del motore
+        self.toff = 0.0             # tempo dallo spegnimento del motore
+        self.noise = noise
+        self.miss = miss
+        self.rnd = random.Random(seed)
         self.lock = Lock()
-        self._run()
-        self.step = 0
+        self.tlast = self.clock.time()
+        self.missed = 0             # numero di impulsi persi
         self._dev = 1
+        self.model = None
+        if braking not in BRAKING_LAWS:
+            raise ValueError(f'Unknown braking law: {braking}')
+        self.braking = braking
+        if dyn_file:
+            from motion_model import MotionModel, coast_fit     #pylint: disable=C0415
+            with open(dyn_file, encoding='utf8') as f_in:
+                dyn_data = json.load(f_in)
+            self.model = MotionModel(dyn_data)
+            self.tdelay, self.decel = coast_fit(dyn_data, self.model.vmax)
+            self.tcoast = self.tdelay+self.model.vmax/(2.*self.decel)  # legge lineare
 
-    def _run(self):
-        'position update loop'
-        if self.direct != 0:
-            self.speed = self.speed+self.ACCEL if self.speed < self.MAX_SPEED else self.MAX_SPEED
+    def _accel(self, dt):
+        'Nuova velocità dopo dt secondi'
+        if self.model:
+            if self.direct != 0:
+                self.ton += dt
+                self.toff = 0.0
+                if self.ton <= self.model.tdead:
+                    return 0.0
+                return self.model.vmax+(self.speed-self.model.vmax)*(1.-dt/self.model.tau)
+            self.toff += dt
+            if self.braking == 'costante':
+                if self.toff <= self.tdelay:
+                    return self.speed
+                speed = self.speed-self.decel*dt
+            else:
+                speed = self.speed*(1.-dt/self.tcoast)
         else:
-            self.speed = self.speed-self.ACCEL if self.speed > 0 else 0
-        if self.speed > 0:
-            with self.lock:
-                self.counters[ENCODER] += self.speed
+            accel = self.ACCEL/self.PERIOD/self.PERIOD
+            vmax = self.MAX_SPEED/self.PERIOD
+            if self.direct != 0:
+                return min(self.speed+accel*dt, vmax)
+            speed = self.speed-accel*dt
+        return speed if speed > self.VMIN else 0.0
 
-        self.next_t += self.PERIOD
-        if self.goon:
-            Timer(self.next_t-time.time(), self._run).start()
+    def _update(self):
+        'Aggiorna stato fino al tempo corrente (da proteggere con lock)'
+        now = self.clock.time()
+        while self.tlast+self.DT <= now:
+            self.tlast += self.DT
+            if self.direct == 0 and self.speed == 0.0:
+                self.tlast = now-(now-self.tlast)%self.DT
+                break
+            self.speed = self._accel(self.DT)
+            speed = self.speed
+            if self.noise and speed > 0:
+                speed = max(0.0, speed*(1.+self.rnd.gauss(0.0, self.noise)))
+            newpos = self.pos+speed*self.DT
+            for _unused in range(int(newpos)-int(self.pos)):
+                if self.miss and self.rnd.random() < self.miss:
+                    self.missed += 1
+                else:
+                    self.counters[ENCODER] += 1
+            self.pos = newpos
 
     def stop(self):
-        'stop simulator'
-        self.goon = False
+        'stop simulator (nessuna azione: mantenuto per compatibilità)'
+
+    def set_present(self, present):
+        'Simula presenza/assenza della scheda'
+        self._dev = 1 if present else 0
 
     def OpenDevice(self, _unused):
         'simulated entry'
 
     def ClearAllDigital(self):
-        'simulated entry'
-        self.dig_channels = [0, 0, 0, 0, 0, 0, 0, 0]
+        'simulated entry (returns -1 when the board is simulated as absent)'
+        if self._dev <= 0:
+            return -1
+        with self.lock:
+            self._update()
+            self.dig_channels = [0, 0, 0, 0, 0, 0, 0, 0]
+            self.direct = 0
+        return 0
 
     def ClearDigitalChannel(self, nchan):
-        'simulated entry'
-        self.dig_channels[nchan-1] = 0
-        if nchan in (RIGHT_MOVE, LEFT_MOVE):
-            self.direct = 0
+        'simulated entry (returns -1 when the board is simulated as absent)'
+        if self._dev <= 0:
+            return -1
+        with self.lock:
+            self._update()
+            self.dig_channels[nchan-1] = 0
+            if nchan in (RIGHT_MOVE, LEFT_MOVE):
+                self.direct = 0
+        return 0
 
     def SetDigitalChannel(self, nchan):
-        'simulated entry'
-        self.dig_channels[nchan-1] = 1
-        if nchan in (RIGHT_MOVE, LEFT_MOVE):
-            self.direct = nchan
+        'simulated entry (returns -1 when the board is simulated as absent)'
+        if self._dev <= 0:
+            return -1
+        with self.lock:
+            self._update()
+            self.dig_channels[nchan-1] = 1
+            if nchan in (RIGHT_MOVE, LEFT_MOVE):
+                if self.direct == 0:
+                    self.ton = 0.0
+                self.direct = nchan
+        return 0
+
+    def WriteAllDigital(self, data):
+        '''simulated entry (bit n-1 di data: stato del canale n).
+        Returns -1 when the board is simulated as absent'''
+        if self._dev <= 0:
+            return -1
+        with self.lock:
+            self._update()
+            self.dig_channels = [(data>>nbit)&1 for nbit in range(8)]
+            direct = 0
+            for nchan in (RIGHT_MOVE, LEFT_MOVE):
+                if self.dig_channels[nchan-1]:
+                    direct = nchan
+            if direct and self.direct == 0:
+                self.ton = 0.0
+            self.direct = direct
+        return 0
 
     def ReadCounter(self, ncnt):
-        'simulated entry'
+        'simulated entry (returns -1 when the board is simulated as absent)'
+        if self._dev <= 0:
+            return -1
         with self.lock:
+            self._update()
             return int(self.counters[ncnt])
 
     def ResetCounter(self, ncnt):
-        'simulated entry'
+        'simulated entry (returns -1 when the board is simulated as absent)'
+        if self._dev <= 0:
+            return -1
         with self.lock:
+            self._update()
             self.counters[ncnt] = 0
+        return 0
 
     def SearchDevices(self):
         'simulated entry'
@@ -99,14 +345,14 @@ class K8055Simulator:            #pylint: disable=R0902
             del_file()
         return self._dev
 
-def test_print(duration, cnt0):
+def test_print(duration, cnt0, clock=time):
     'print counter and speed'
     for _unused in range(duration):
         cnt1 = K_SIM.ReadCounter(ENCODER)
         spe = cnt1-cnt0
         print('Counter:', cnt1, spe)
         cnt0 = cnt1
-        time.sleep(0.5)
+        clock.sleep(0.5)
     return cnt1
 
 def set_file(num):
@@ -136,15 +382,25 @@ if __name__ == '__main__':
     if '-0' in sys.argv:
         set_file(0)
         sys.exit()
-    if '-t' in sys.argv:
+    if '-d' in sys.argv:
+        del_file()
+        sys.exit()
+    if '-t' in sys.argv or '-v' in sys.argv:
         CNT0 = 0
-        K_SIM = K8055Simulator()
+        if '-v' in sys.argv:
+            CLOCK = VirtualClock()
+            K_SIM = K8055Simulator(clock=CLOCK, dyn_file=os.path.join(os.path.dirname(DEVPATH),
+                                                                      DOME_DYN_FILE),
+                                   braking='lineare' if '-l' in sys.argv else 'costante')
+        else:
+            CLOCK = time
+            K_SIM = K8055Simulator()
         print('**** Start')
         K_SIM.SetDigitalChannel(RIGHT_MOVE)
-        CNT = test_print(20, 0)
+        CNT = test_print(20, 0, CLOCK)
         print('**** Stop')
         K_SIM.ClearDigitalChannel(RIGHT_MOVE)
-        test_print(20, CNT)
+        test_print(20, CNT, CLOCK)
         print('**** End')
         K_SIM.stop()
         sys.exit()
@@ -38,6 +38,7 @@ Comandi definiti:
     s <n>    Set canale n (n: 1..8)
     sa       Set tutti i canali
     sh       Cerca dispositivi
+    w <n>    Scrive tutti i canali (n: 0..255, bit 0: canale 1)
     v        Mostra versione DLL
 """
 
@@ -188,6 +189,14 @@ def main():                      #pylint: disable=R0915,R0912
             tm1 = time.time_ns()
             print_result('ClearAllDigital', None, ret, tm0, tm1)
             continue
+        if ans[0] == "w":
+            args = check(ans, int)
+            if args:
+                tm0 = time.time_ns()
+                ret = handle.WriteAllDigital(args[0])
+                tm1 = time.time_ns()
+                print_result('WriteAllDigital', args[0], ret, tm0, tm1)
+            continue
         if ans[0] == "ra":
             tm0 = time.time_ns()
             ret = handle.ReadAllDigital()
@@ -0,0 +1,141 @@
+'''
+loop_stats - Timing statistics for the dome control loop
+
+Durations are accumulated into histograms with logarithmic bins (ratio 2,
+from 10 microseconds to about 40 seconds), so that recording a value has a
+small constant cost and percentiles can be estimated at any time without
+storing the samples.
+
+Values are recorded by the control loop thread and read by API calls: a
+summary taken while the loop is running may be slightly inconsistent (e.g.
+a count may be one more than the sum of bins), which is irrelevant for
+monitoring purposes.
+'''
+
+import math
+import time
+
+BIN_MIN = 1.e-5       # Upper limit of first bin (sec)
+N_BINS = 23           # Number of bins (the last one collects all larger values)
+
+class Histogram:
+    'Histogram of durations (seconds) with logarithmic bins'
+    __slots__ = ('bins', 'count', 'total', 'vmax')
+
+    def __init__(self):
+        self.bins = [0]*N_BINS
+        self.count = 0
+        self.total = 0.0
+        self.vmax = 0.0
+
+    def record(self, value):
+        'Add a value (sec)'
+        if value > BIN_MIN:
+            mant, expo = math.frexp(value/BIN_MIN)
+            idx = min(expo if mant > 0.5 else expo-1, N_BINS-1)
+        else:
+            idx = 0
+        self.bins[idx] += 1
+        self.count += 1
+        self.total += value
+        if value > self.vmax:
+            self.vmax = value
+
+    def percentile(self, pct):
+        'Estimated percentile (upper limit of bin, in seconds)'
+        if not self.count:
+            return 0.0
+        need = self.count*pct/100.
+        acc = 0
+        limit = BIN_MIN
+        for nval in self.bins:
+            acc += nval
+            if acc >= need:
+                break
+            limit += limit
+        return min(limit, self.vmax)
+
+    def summary(self):
+        'Summary dictionary (times in milliseconds)'
+        return {'count': self.count,
+                'mean_ms': self.total/self.count*1000. if self.count else 0.0,
+                'p50_ms': self.percentile(50)*1000.,
+                'p99_ms': self.percentile(99)*1000.,
+                'max_ms': self.vmax*1000.}
+
+class LoopStats:
+    '''
+    Collection of timing histograms for the control loop
+
+    Histograms are created on first use, so the set of names is open
+    '''
+    def __init__(self):
+        self.hists = {}
+        self.overruns = 0            # Number of cycles longer than polling period
+        self.cycles = 0              # Number of loop cycles
+        self.tstart = time.monotonic()
+
+    def record(self, name, value):
+        'Add a duration (sec) to the named histogram'
+        hist = self.hists.get(name)
+        if hist is None:
+            hist = self.hists[name] = Histogram()
+        hist.record(value)
+
+    def cycle(self, busy, period):
+        'Record the busy time of a loop cycle with the given polling period'
+        self.cycles += 1
+        self.record('cycle', busy)
+        if busy > period:
+            self.overruns += 1
+
+    def reset(self):
+        'Clear all statistics'
+        self.__init__()
+
+    def summary(self):
+        'Summary dictionary of all statistics'
+        ret = {'elapsed': time.monotonic()-self.tstart,
+               'cycles': self.cycles,
+               'overruns': self.overruns}
+        for name, hist in list(self.hists.items()):
+            ret[name] = hist.summary()
+        return ret
+
+class TimedDevice:
+    '''
+    Proxy for a K8055 handle recording the duration of calls
+
+    Parameters
+    ----------
+    device : object
+        K8055 handle (library, DLL or simulator)
+
+    stats : LoopStats
+        Statistics collector. Each call to a method listed in TIMED
+        is recorded in a histogram named after the method
+    '''
+    TIMED = ('ClearAllDigital', 'ClearDigitalChannel', 'ReadCounter', 'ResetCounter',
+             'SearchDevices', 'SetDigitalChannel', 'WriteAllDigital')
+
+    def __init__(self, device, stats):
+        self.device = device
+        self.stats = stats
+        for name in self.TIMED:
+            if hasattr(device, name):
+                setattr(self, name, self._timed(name, getattr(device, name)))
+
+    def _timed(self, name, func):
+        'Make timed version of func'
+        record = self.stats.record
+        clock = time.perf_counter
+        def timed(*args):
+            tstart = clock()
+            try:
+                return func(*args)
+            finally:
+                record(name, clock()-tstart)
+        return timed
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
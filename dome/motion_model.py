@@ -0,0 +1,213 @@
+'''
+motion_model - Motion profile model for dome positioning
+
+The model is fitted to the acceleration and coasting curves recorded by
+dome_calib.py in dome_dyn.json:
+
+    - during acceleration the dome speed follows a first order lag:
+      v(t) = vmax*(1-exp(-(t-tdead)/tau))
+    - after the motor is switched off the dome keeps its speed for a delay
+      tdelay, then decelerates at constant rate decel, so that the coasting
+      distance at stop speed v is: coast = v*tdelay+v^2/(2*decel)
+
+A movement is executed as a single run: the motor is switched off as soon
+as the distance covered plus the predicted coasting distance reaches the
+target. A scale factor of the coasting distance (kscale) is refined after
+each movement from the observed overshoot.
+'''
+
+import json
+import math
+from collections import deque
+
+ALPHA = 0.3           # Weight of new measure for online refinement of kscale
+SPEED_SPAN = 0.5      # Time span for speed measurement (sec)
+MIN_REFINE = 3.0      # Minimum predicted coasting (counts) for refinement
+COAST_STEP = 0.005    # Search step for coasting delay (sec)
+
+class MotionModel:                          # pylint: disable=R0902
+    '''
+    Dome motion model
+
+    Parameters
+    ----------
+    dyn_data : dict
+        Dynamic data as stored into dome_dyn.json (keys: times, counts, nstop)
+    '''
+    def __init__(self, dyn_data):
+        times = dyn_data['times']
+        counts = dyn_data['counts']
+        nstop = dyn_data['nstop']
+        self.vmax, self.tdead, self.tau = _fit_accel(times[:nstop+1], counts[:nstop+1])
+        self.tdelay, self.decel = coast_fit(dyn_data, self.vmax)
+        self.kscale = 1.0
+        self.nmoves = 0              # Number of completed movements
+        self.last_error = 0.0        # Prediction error of last coasting (counts)
+        self._tstart = 0.0
+        self._samples = deque()
+        self._stop = None            # (moved, speed) at stop time
+
+    @classmethod
+    def from_file(cls, dyn_file):
+        'Create model from dome_dyn.json file'
+        with open(dyn_file, encoding='utf8') as f_in:
+            return cls(json.load(f_in))
+
+    def speed(self, tsec):
+        'Model speed (counts/sec) after tsec seconds from start'
+        tsec -= self.tdead
+        if tsec <= 0:
+            return 0.0
+        return self.vmax*(1.0-math.exp(-tsec/self.tau))
+
+    def distance(self, tsec):
+        'Model distance (counts) covered after tsec seconds from start'
+        tsec -= self.tdead
+        if tsec <= 0:
+            return 0.0
+        return self.vmax*(tsec-self.tau*(1.0-math.exp(-tsec/self.tau)))
+
+    def coast(self, speed):
+        'Predicted coasting distance (counts) for given speed'
+        return self.kscale*(speed*self.tdelay+speed*speed/(2.*self.decel))
+
+    def run_time(self, dist):
+        'Motor on time (sec) required for a movement of given length (counts)'
+        dist = abs(dist)
+        tlow, thigh = 0.0, self.tdead+self.tau+dist/self.vmax+1.0
+        for _unused in range(40):                       # bisection
+            tmid = (tlow+thigh)/2
+            if self.distance(tmid)+self.coast(self.speed(tmid)) < dist:
+                tlow = tmid
+            else:
+                thigh = tmid
+        return thigh
+
+    def start(self, now):
+        'Start tracking a movement'
+        self._tstart = now
+        self._samples.clear()
+        self._samples.append((now, 0))
+        self._stop = None
+
+    def measured_speed(self, now, moved):
+        '''Speed estimated from the instants of recent count changes (model speed
+        if too few counts)'''
+        if moved != self._samples[-1][1]:
+            self._samples.append((now, moved))
+        while len(self._samples) > 2 and self._samples[0][0] < now-SPEED_SPAN:
+            self._samples.popleft()
+        tm0, cnt0 = self._samples[0]
+        tm1, cnt1 = self._samples[-1]
+        if cnt1-cnt0 >= 2 and tm1 > tm0:
+            return (cnt1-cnt0)/(tm1-tm0)
+        return self.speed(now-self._tstart)
+
+    def must_stop(self, now, moved, remaining):
+        '''
+        Check whether the motor must be switched off
+
+        Parameters
+        ----------
+        now : float
+            Current time (sec)
+        moved : int
+            Distance covered since start (counts)
+        remaining : int
+            Current distance from target (counts)
+
+        Returns
+        -------
+        stop : bool
+            True if the dome will reach the target by coasting
+        '''
+        speed = self.measured_speed(now, abs(moved))
+        if self.coast(speed) >= abs(remaining)-0.5:
+            self._stop = (abs(moved), speed)
+            return True
+        return False
+
+    def stopped(self, moved):
+        'Refine model from the final distance covered (counts) after a planned stop'
+        if self._stop is None:
+            return
+        stop_moved, speed = self._stop
+        self._stop = None
+        observed = abs(moved)-stop_moved
+        predicted = self.coast(speed)
+        self.last_error = observed-predicted
+        if predicted >= MIN_REFINE:
+            self.kscale += ALPHA*(observed/predicted-1.0)*self.kscale
+        self.nmoves += 1
+
+    def params(self):
+        'Model parameters'
+        return {'vmax': self.vmax, 'tdead': self.tdead, 'tau': self.tau,
+                'tdelay': self.tdelay, 'decel': self.decel, 'kscale': self.kscale,
+                'nmoves': self.nmoves, 'last_error': self.last_error}
+
+def _fit_accel(times, counts):
+    'Fit acceleration curve. Returns vmax, tdead, tau'
+    npts = len(times)
+    tail = max(npts//5, 2)                 # Fit straight line to final part
+    t_tail = times[-tail:]
+    c_tail = counts[-tail:]
+    tmean = sum(t_tail)/tail
+    cmean = sum(c_tail)/tail
+    stt = sum((x-tmean)**2 for x in t_tail)
+    vmax = sum((x-tmean)*(y-cmean) for x, y in zip(t_tail, c_tail))/stt if stt > 0 else 0.0
+    if vmax <= 0:
+        return 1.0, 0.0, 1.0
+    lag = tmean-cmean/vmax                 # Time lag at full speed: tdead+tau
+    tdead = 0.0                            # Dead time: first movement seen
+    for tim, cnt in zip(times, counts):
+        if cnt > 0:
+            tdead = tim-1.0/vmax
+            break
+    tdead = max(0.0, min(tdead, lag))
+    tau = max(lag-tdead, 0.01)
+    return vmax, tdead, tau
+
+def coast_fit(dyn_data, vstop):
+    '''
+    Fit coasting curve with delay and constant deceleration
+
+    The recorded coasting curve is fitted (least squares, up to the last
+    count) as: d(t) = vstop*t for t < tdelay, then
+    d(t) = vstop*t-decel*(t-tdelay)^2/2
+
+    Parameters
+    ----------
+    dyn_data : dict
+        Dynamic data as stored into dome_dyn.json
+    vstop : float
+        Speed at motor stop (counts/sec)
+
+    Returns
+    -------
+    tdelay, decel : float
+        Coasting delay (sec) and deceleration (counts/sec^2)
+    '''
+    times = dyn_data['times']
+    counts = dyn_data['counts']
+    nstop = dyn_data['nstop']
+    pts = []
+    for tim, cnt in zip(times[nstop+1:], counts[nstop+1:]):
+        if not pts or cnt-counts[nstop] != pts[-1][1]:     # count change instants
+            pts.append((tim-times[nstop], cnt-counts[nstop]))
+    if len(pts) < 3:
+        raise ValueError('coasting curve too short')
+    best = None
+    for step in range(int(pts[-1][0]/COAST_STEP)):
+        tdelay = step*COAST_STEP
+        decs = [(max(x-tdelay, 0.0), vstop*x-y) for x, y in pts]    # decel*s^2/2 = vstop*t-d
+        s_ss = sum(s**4 for s, _ in decs)
+        if s_ss <= 0:
+            continue
+        decel = 2.*sum(s*s*r for s, r in decs)/s_ss
+        resid = sum((decel*s*s/2.-r)**2 for s, r in decs)
+        if decel > 0 and (best is None or resid < best[0]):
+            best = (resid, tdelay, decel)
+    if best is None:
+        raise ValueError('invalid coasting curve')
+    return best[1], best[2]
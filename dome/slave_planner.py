@@ -0,0 +1,190 @@
+'''
+slave_planner - Movement planner for dome slave mode
+
+The planner decides where the dome must go while following the telescope.
+Instead of chasing the current telescope azimuth (which gives frequent
+short start-stop movements while tracking) a new movement is started only
+when the slit is about to go out of tolerance; the target is then computed
+from the required azimuth predicted ahead in time, so that the slit stays
+within tolerance for the longest possible time after the movement.
+
+The required azimuth ahead in time is obtained from the telescope sampler
+method az_ahead(tsec), if available, or by linear extrapolation of recent
+samples of az_from_tel().
+'''
+
+import os
+import json
+import time
+from collections import deque
+
+LOOKAHEAD = 300.0     # Max prediction time (sec)
+LOOKSTEP = 10.0       # Step for prediction (sec)
+SLAVE_TOL = 2.0       # Default tolerance in slave mode (degrees)
+RATE_SPAN = 30.0      # Time span of samples used for rate estimation (sec)
+
+class SlavePlanner:                       # pylint: disable=R0902
+    '''
+    Dome movement planner for slave mode
+
+    Parameters
+    ----------
+    dome_data : dict
+        Dome calibration data (as in dome_data.json)
+
+    tolerance : float
+        Max allowed distance between dome and telescope (degrees)
+
+    dyn_file : str
+        Path of file with dynamic data (dome_dyn.json). If missing the
+        movement times are estimated from tstart, tstop and vmax
+
+    lookahead : float
+        Max prediction time (sec)
+    '''
+    def __init__(self, dome_data, tolerance=SLAVE_TOL, dyn_file=None, lookahead=LOOKAHEAD):
+        self.n360 = dome_data['n360']
+        self.n180 = self.n360/2
+        self.toenc = self.n360/360.
+        self.maxerr = dome_data['maxerr']
+        self.tstart = dome_data['tstart']
+        self.tstop = dome_data['tstop']
+        self.vmax = dome_data['vmax']
+        self.tolerance = max(int(tolerance*self.toenc), self.maxerr)
+        self.lookahead = lookahead
+        self.plan = -1                # Current target (encoder units)
+        self.nplans = 0               # Number of planned movements
+        self.samples = deque()        # Recent (time, azimuth) samples
+        self.dyn = None
+        if dyn_file and os.path.exists(dyn_file):
+            self.dyn = _dyn_profile(dyn_file)
+
+    def _dist(self, ang1, ang2):
+        'angular distance ang1-ang2 (encoder units)'
+        dist = ang1-ang2
+        if dist > self.n180:
+            dist -= self.n360
+        elif dist < -self.n180:
+            dist += self.n360
+        return dist
+
+    def move_time(self, dist):
+        'Estimated duration of a movement of given length (encoder units)'
+        dist = abs(dist)
+        if self.dyn:
+            times, counts, coast, tcoast = self.dyn
+            if dist <= counts[-1]+coast:
+                for tmv, cnt in zip(times, counts):
+                    if cnt+coast >= dist:
+                        return tmv+tcoast
+            return times[-1]+(dist-counts[-1]-coast)/self.vmax+tcoast
+        return self.tstart+self.tstop+dist/self.vmax
+
+    def _sample(self, azh):
+        'Record azimuth sample for rate estimation'
+        now = time.monotonic()
+        self.samples.append((now, azh))
+        while self.samples and self.samples[0][0] < now-RATE_SPAN:
+            self.samples.popleft()
+
+    def _extrapolate(self, azh, tsec):
+        'Extrapolate required azimuth (degrees) from recent samples'
+        if len(self.samples) < 2:
+            return azh
+        (tm0, az0), (tm1, az1) = self.samples[0], self.samples[-1]
+        if tm1-tm0 < 1.0:
+            return azh
+        daz = (az1-az0+180.)%360.-180.
+        return (azh+daz/(tm1-tm0)*tsec)%360.
+
+    def _make_plan(self, azfunc, domeaz):
+        'Compute target of new movement (encoder units)'
+        ref = azfunc(0.0)
+        tmove = self.move_time(self._dist(ref, domeaz))
+        azt = azfunc(tmove)
+        if azt < 0:
+            return ref
+        ref = azt
+        low = high = 0
+        tsec = tmove+LOOKSTEP
+        while tsec <= tmove+self.lookahead:
+            azt = azfunc(tsec)
+            if azt < 0:
+                break
+            dist = self._dist(azt, ref)
+            nlow, nhigh = min(low, dist), max(high, dist)
+            if nhigh-nlow > 2*self.tolerance:
+                break
+            low, high = nlow, nhigh
+            tsec += LOOKSTEP
+        return int(ref+(low+high)/2)%self.n360
+
+    def target(self, telsamp, azh, domeaz):
+        '''
+        Compute dome target
+
+        Parameters
+        ----------
+        telsamp : TelSampler
+            Telescope sampler
+
+        azh : float
+            Current required azimuth (degrees)
+
+        domeaz : int
+            Current dome azimuth (encoder units)
+
+        Returns
+        -------
+        target : int
+            Dome target (encoder units). -1 if no movement is required
+        '''
+        self._sample(azh)
+        if hasattr(telsamp, 'az_ahead'):
+            def azdeg(tsec):
+                return telsamp.az_ahead(tsec) if tsec > 0 else azh
+        else:
+            def azdeg(tsec):
+                return self._extrapolate(azh, tsec)
+
+        def azfunc(tsec):
+            azt = azdeg(tsec)
+            return int(azt*self.toenc+0.5)%self.n360 if azt >= 0 else -1
+
+        reqaz = azfunc(0.0)
+        if self.plan >= 0:
+            if abs(self._dist(self.plan, domeaz)) <= self.maxerr:       # target reached
+                self.plan = -1
+            elif abs(self._dist(reqaz, self.plan)) <= 2*self.tolerance:  # still valid
+                return self.plan
+        if self.plan < 0:
+            react = azfunc(self.tstart)
+            if react < 0:
+                react = reqaz
+            if abs(self._dist(reqaz, domeaz)) <= self.tolerance and \
+               abs(self._dist(react, domeaz)) <= self.tolerance:
+                return -1
+        self.plan = self._make_plan(azfunc, domeaz)
+        self.nplans += 1
+        return self.plan
+
+    def reset(self):
+        'Forget current plan (e.g. when slave mode is cleared)'
+        self.plan = -1
+        self.samples.clear()
+
+def _dyn_profile(dyn_file):
+    'Get movement profile from dynamic data: (times, counts, coast, tcoast)'
+    with open(dyn_file, encoding='utf8') as f_in:
+        dyn = json.load(f_in)
+    nstop = dyn['nstop']
+    times = dyn['times'][:nstop+1]
+    counts = dyn['counts'][:nstop+1]
+    final = dyn['counts'][-1]
+    coast = final-counts[-1]
+    tcoast = 0.0
+    for tmv, cnt in zip(dyn['times'][nstop:], dyn['counts'][nstop:]):
+        if cnt >= final:
+            tcoast = tmv-times[-1]
+            break
+    return times, counts, coast, tcoast
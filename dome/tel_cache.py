@@ -0,0 +1,244 @@
+'''
+tel_cache - Shared access to the OnStep telescope controller for Alpaca clients
+
+OnStep serves one command at a time on its network link, and each property
+read by an Alpaca client (RightAscension, Declination, Slewing, ...) would
+otherwise be a separate LX200 command competing with the other clients.
+
+All commands are sent through a single TeleCommunicator protected by a lock.
+Values read from the controller are kept in a cache for a short time (TTL):
+
+    - reads of fresh values are served from the cache without locking
+    - concurrent reads of a stale value are coalesced: the first client
+      sends the command, the others wait for the lock and then find the
+      new value in the cache
+    - related values are read together (right ascension with declination,
+      altitude with azimuth) and the :GU status string feeds the Slewing,
+      Tracking, AtPark, AtHome and IsPulseGuiding properties
+
+Commands which change the telescope state are executed as a whole under the
+lock (e.g. set target coordinates and slew) and invalidate the cache.
+'''
+
+import time
+from threading import Lock
+
+POSITION_TTL = 0.5    # Max age of position and status values (sec)
+TARGET_TTL = 5.0      # Max age of target coordinates (sec)
+SITE_TTL = 3600.0     # Max age of site data (sec)
+
+def _read_radec(tcm):
+    'Read current coordinates (hours, degrees)'
+    rah = tcm.get_current_rah()
+    if rah is None:
+        return None
+    deh = tcm.get_current_deh()
+    if deh is None:
+        return None
+    return rah, deh
+
+def _read_altaz(tcm):
+    'Read current horizontal coordinates (degrees)'
+    alt = tcm.get_alt()
+    if alt is None:
+        return None
+    azh = tcm.get_az()
+    if azh is None:
+        return None
+    return alt, azh
+
+def _read_target(tcm):
+    'Read target coordinates (hours, degrees)'
+    rah = tcm.get_target_rah()
+    if rah is None:
+        return None
+    deh = tcm.get_target_deh()
+    if deh is None:
+        return None
+    return rah, deh
+
+def _read_site(tcm):
+    'Read site coordinates (degrees, OnStep longitude is positive westward)'
+    lat = tcm.get_lat()
+    if lat is None:
+        return None
+    lon = tcm.get_lon()
+    if lon is None:
+        return None
+    return lat, -lon
+
+def _read_status(tcm):
+    'Read status string (see telecomm.gst_info)'
+    return tcm.get_status() or None
+
+def _read_pierside(tcm):
+    'Read pier side (E, W, N: unknown)'
+    return tcm.get_pside() or None
+
+#           name        reader          TTL
+READERS = {'radec': (_read_radec, POSITION_TTL),
+           'altaz': (_read_altaz, POSITION_TTL),
+           'status': (_read_status, POSITION_TTL),
+           'pierside': (_read_pierside, POSITION_TTL),
+           'target': (_read_target, TARGET_TTL),
+           'site': (_read_site, SITE_TTL),
+          }
+
+# Command sequences, to be executed with TelescopeCache.execute(). Return
+# values: '' on success, error message if the command is refused by the
+# controller, None on communication errors
+
+def _result(ret, success, errmsg):
+    'Check controller reply'
+    if ret is None:
+        return None
+    return '' if ret in success else f'{errmsg} (reply: {ret})'
+
+def set_target(tcm, rah=None, ded=None):
+    'Set target coordinates (hours, degrees; None: unchanged)'
+    if rah is not None:
+        ret = _result(tcm.set_ra(rah), ('1',), 'target right ascension refused')
+        if ret != '':
+            return ret
+    if ded is not None:
+        return _result(tcm.set_de(ded), ('1',), 'target declination refused')
+    return ''
+
+def slew_to_target(tcm):
+    'Start slew to target coordinates'
+    return _result(tcm.move_target(), ('', '0'), 'slew refused')
+
+def slew_to(tcm, rah, ded):
+    'Set target coordinates and start slew'
+    ret = set_target(tcm, rah, ded)
+    return slew_to_target(tcm) if ret == '' else ret
+
+def sync_to(tcm, rah=None, ded=None):
+    'Sync telescope position with given coordinates (None: current target)'
+    ret = set_target(tcm, rah, ded)
+    return tcm.sync_radec() if ret == '' else ret
+
+def abort_slew(tcm):
+    'Stop any movement'
+    return tcm.stop()
+
+def find_home(tcm):
+    'Move telescope to home position'
+    return tcm.goto_home()
+
+def park(tcm):
+    'Move telescope to park position'
+    return _result(tcm.park(), ('1',), 'park refused')
+
+def unpark(tcm):
+    'Unpark telescope'
+    return _result(tcm.unpark(), ('1',), 'unpark refused')
+
+def set_park(tcm):
+    'Set park position at current position'
+    return tcm.set_park()
+
+def set_tracking(tcm, enable):
+    'Enable/disable sidereal tracking'
+    ret = tcm.track_on() if enable else tcm.track_off()
+    return _result(ret, ('1',), 'tracking command refused')
+
+def pulse_guide(tcm, direct, msec):
+    'Guide pulse. direct: 0 north, 1 south, 2 east, 3 west; msec: 20..16399'
+    funcs = (tcm.pulse_guide_north, tcm.pulse_guide_south,
+             tcm.pulse_guide_east, tcm.pulse_guide_west)
+    return funcs[direct](msec)
+
+class TelescopeCache:
+    '''
+    Cached and serialized access to the telescope controller
+
+    Parameters
+    ----------
+    tcm : TeleCommunicator
+        Communicator with the telescope controller
+
+    clock : callable
+        Time function (default: time.monotonic)
+    '''
+    def __init__(self, tcm, clock=time.monotonic):
+        self.tcm = tcm
+        self.clock = clock
+        self.lock = Lock()            # Serializes commands to the controller
+        self.cache = {}               # name: (time, value)
+        self.online = False           # Result of last communication
+        self.errmsg = ''              # Last communication error
+        self.ncmds = 0                # Number of command sequences sent
+        self.nreads = 0               # Number of reads
+        self.nhits = 0                # Reads served from cache
+        self.ncoalesced = 0           # Reads served from cache after waiting for lock
+
+    def _fresh(self, name, ttl):
+        'Return cache entry if younger than ttl, else None'
+        entry = self.cache.get(name)
+        if entry and self.clock()-entry[0] < ttl:
+            return entry
+        return None
+
+    def read(self, name):
+        '''
+        Read a value from cache or controller
+
+        Parameters
+        ----------
+        name : str
+            Value name (see READERS)
+
+        Returns
+        -------
+        value : object
+            Value read. None on communication errors (see errmsg)
+        '''
+        reader, ttl = READERS[name]
+        self.nreads += 1
+        entry = self._fresh(name, ttl)
+        if entry:
+            self.nhits += 1
+            return entry[1]
+        with self.lock:
+            entry = self._fresh(name, ttl)       # Read by another client while waiting
+            if entry:
+                self.ncoalesced += 1
+                return entry[1]
+            tstart = self.clock()
+            value = reader(self.tcm)
+            self._done(value is not None)
+            if value is not None:
+                self.cache[name] = (tstart, value)
+        return value
+
+    def execute(self, func, *args):
+        '''
+        Execute a command sequence and invalidate the cache
+
+        Parameters
+        ----------
+        func : callable
+            Function called as func(tcm, *args) while holding the lock
+
+        Returns
+        -------
+        ret : object
+            Value returned by func. None on communication errors (see errmsg)
+        '''
+        with self.lock:
+            ret = func(self.tcm, *args)
+            self.cache.clear()
+            self._done(ret is not None)
+        return ret
+
+    def _done(self, success):
+        'Update communication status (to protect with lock)'
+        self.ncmds += 1
+        self.online = success
+        self.errmsg = '' if success else self.tcm.last_error()
+
+    def stats(self):
+        'Cache statistics'
+        return {'ncmds': self.ncmds, 'nreads': self.nreads, 'nhits': self.nhits,
+                'ncoalesced': self.ncoalesced, 'online': self.online}
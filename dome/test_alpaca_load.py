@@ -0,0 +1,54 @@
+'''
+test_alpaca_load.py - verifica automatica della prova di carico (alpaca_load.py)
+
+Esegue alpaca_load.py per una breve durata, con i simulatori (K8055 e
+telescopio) e la prova iniziale con connessioni inattive, e verifica che
+termini senza violazioni.
+
+Il server (dome_alpaca.py) richiede il file di configurazione OPC: in sua
+assenza il test viene saltato. Il file dome_data.json, aggiornato dal server
+alla chiusura, viene ripristinato al termine.
+
+Uso:
+    python test_alpaca_load.py
+'''
+
+import sys
+import os
+import subprocess
+import unittest
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(THIS_DIR, "..")))
+
+from opc import constants as const      # pylint: disable=C0413
+
+DATA_FILE = os.path.join(THIS_DIR, 'dome_data.json')
+
+PORT = 7877              # Port IP del server (diverso dal default)
+DURATION = 5             # Durata della prova (sec)
+N_CLIENTS = 2            # Numero di clienti di sola lettura
+MAX_TIME = 240           # Durata massima del processo (sec)
+
+@unittest.skipUnless(os.path.exists(const.CONFIG_PATH), 'manca il file di configurazione OPC')
+class TestAll(unittest.TestCase):
+    'Prova di carico breve'
+
+    def test_load(self):
+        'Test alpaca_load.py: nessuna violazione'
+        with open(DATA_FILE, encoding='utf8') as f_in:
+            data_save = f_in.read()
+        try:
+            ret = subprocess.run([sys.executable, os.path.join(THIS_DIR, 'alpaca_load.py'),
+                                  '-p', str(PORT), '-t', str(DURATION), '-c', str(N_CLIENTS)],
+                                 cwd=THIS_DIR, capture_output=True, text=True,
+                                 timeout=MAX_TIME, check=False)
+        finally:
+            with open(DATA_FILE, 'w', encoding='utf8') as f_out:
+                f_out.write(data_save)
+        self.assertEqual(ret.returncode, 0, msg=ret.stdout+ret.stderr)
+        self.assertIn('connessioni inattive servito', ret.stdout)
+        self.assertIn('Violazioni: 0', ret.stdout)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+'''
+test_calib_fit.py - test di regressione per calib_fit.py
+
+Confronta i risultati di accel_params/decel_params di calib_fit.py con quelli
+della versione originale (ricerca sequenziale con np.polyfit, riportata
+qui sotto) sui dati di calibrazione registrati (dome_dyn.json) e su
+tracciati generati con il simulatore k8055.
+
+Uso:
+    python test_calib_fit.py
+'''
+
+import os
+import json
+import unittest
+
+import numpy as np
+
+import calib_fit
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+DYN_FILE = os.path.join(THIS_DIR, 'dome_dyn.json')
+DATA_FILE = os.path.join(THIS_DIR, 'dome_data.json')
+
+N_SIMUL = 6              # Numero di tracciati simulati
+NOISES = (0.0, 0.03, 0.1)  # Rumore del simulatore (frazione della velocità)
+
+def orig_accel_params(times, counts, nstop):
+    'Versione originale (dome_calib.py) di accel_params'
+    times = times[:nstop]
+    counts = counts[:nstop]
+    err = float('inf')
+    end_accel = 0
+    guard = nstop/2
+    while True:
+        if end_accel > guard:
+            return None, None
+        line, res = np.polyfit(times[end_accel:],counts[end_accel:],1,full=True)[:2]
+        res = res[0]/len(times[end_accel:])
+        if res >= err:
+            break
+        err = res
+        end_accel += 1
+    vmax = line[0]
+    return end_accel, vmax
+
+def orig_decel_params(times, counts, nstop):
+    'Versione originale (dome_calib.py) di decel_params'
+    err = float('inf')
+    end_decel = nstop
+    guard = nstop+(len(times)-nstop)/2
+    while True:
+        if end_decel > guard:
+            return None
+        _unused, res = np.polyfit(times[end_decel:],counts[end_decel:],1,full=True)[:2]
+        res = res[0]/len(times[end_decel:])
+        if res >= err:
+            break
+        err = res
+        end_decel += 1
+    return end_decel
+
+class TestAll(unittest.TestCase):
+    'Confronto con la versione originale'
+    dyn_data = None
+
+    @classmethod
+    def setUpClass(cls):
+        with open(DYN_FILE, encoding='utf8') as f_in:
+            cls.dyn_data = json.load(f_in)
+
+    def _compare(self, dyn_data, label):
+        times = dyn_data['times']
+        counts = dyn_data['counts']
+        nstop = dyn_data['nstop']
+        orig = orig_accel_params(times, counts, nstop)
+        new = calib_fit.accel_params(times, counts, nstop)
+        self.assertEqual(orig, new, msg=f'accel_params, {label}: {orig=}, {new=}')
+        orig = orig_decel_params(times, counts, nstop)
+        new = calib_fit.decel_params(times, counts, nstop)
+        self.assertEqual(orig, new, msg=f'decel_params, {label}: {orig=}, {new=}')
+
+    def test_recorded(self):
+        'Test su dati registrati (dome_dyn.json)'
+        self._compare(self.dyn_data, 'dome_dyn.json')
+
+    def test_dome_data(self):
+        'Test parametri calcolati rispetto a quelli in dome_data.json'
+        with open(DATA_FILE, encoding='utf8') as f_in:
+            dome_data = json.load(f_in)
+        result = calib_fit.fit_dyn(self.dyn_data)
+        for name in ('tstart', 'nstart', 'tstop', 'nstop', 'vmax'):
+            self.assertEqual(result[name], dome_data[name], msg=name)
+
+    def test_simulated(self):
+        'Test su tracciati generati con il simulatore'
+        for seed in range(N_SIMUL):
+            noise = NOISES[seed%len(NOISES)]
+            dyn_data = calib_fit.simulate(DYN_FILE, noise=noise, seed=seed)
+            self._compare(dyn_data, f'simulatore ({seed=}, {noise=})')
+
+    def test_constant_tail(self):
+        'Test su tracciato con lungo tratto finale a conteggio costante'
+        times = [x*0.05 for x in range(400)]
+        counts = [min(int(x*0.05*10), 150) for x in range(400)]
+        self._compare({'times': times, 'counts': counts, 'nstop': 100}, 'coda costante')
+
+if __name__ == '__main__':
+    unittest.main()
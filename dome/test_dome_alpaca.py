@@ -0,0 +1,132 @@
+'''
+test_dome_alpaca.py - test del dispositivo telescopio di dome_alpaca.py
+
+Il server Alpaca (solo dispositivo telescopio, senza controllo cupola) ed il
+simulatore di telescopio (opc/telsimulator.py) sono eseguiti nello stesso
+processo, su port IP diversi da quelli di default.
+
+Uso:
+    python test_dome_alpaca.py
+'''
+
+import sys
+import os
+import time
+import json
+import calendar
+import unittest
+from threading import Thread
+from urllib.request import Request, urlopen
+from urllib.parse import urlencode
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(THIS_DIR, '..', 'opc'))
+
+import dome_alpaca as da               # pylint: disable=C0413
+import tel_cache as tc                 # pylint: disable=C0413
+import telsimulator as tsim            # pylint: disable=C0413,E0401
+
+TEL_PORT = tsim.TEL_PORT+101    # Port IP del simulatore di telescopio
+ALP_PORT = da.ALP_PORT+101      # Port IP del server Alpaca
+BASE_URL = f'http://127.0.0.1:{ALP_PORT}/api/v1/telescope/0/'
+
+MAX_DT = 2.0             # Differenza massima UTCDate - orologio locale (sec)
+PULSE_MS = 2000          # Durata impulso di guida (ms)
+
+                         # Membri ITelescopeV3 non implementati
+UNIMPL_GET = ('aperturearea', 'aperturediameter', 'destinationsideofpier', 'focallength',
+              'guideratedeclination', 'guideraterightascension')
+UNIMPL_PUT = ('declinationrate', 'moveaxis', 'siteelevation', 'slewsettletime',
+              'slewtoaltaz', 'slewtocoordinates', 'slewtotarget', 'synctoaltaz', 'utcdate')
+
+def _get(command, **params):
+    'Richiesta GET. Riporta la risposta decodificata'
+    query = '?'+urlencode(params) if params else ''
+    with urlopen(BASE_URL+command+query, timeout=5) as reply:
+        return json.loads(reply.read())
+
+def _put(command, **data):
+    'Richiesta PUT. Riporta la risposta decodificata'
+    req = Request(BASE_URL+command, data=urlencode(data).encode('ascii'), method='PUT')
+    with urlopen(req, timeout=5) as reply:
+        return json.loads(reply.read())
+
+class GLOB:              # pylint: disable=R0903
+    'Simulatore e server in esecuzione'
+    tsim = None
+    server = None
+
+class TestAll(unittest.TestCase):
+    'Test del dispositivo telescopio'
+
+    @classmethod
+    def setUpClass(cls):
+        GLOB.tsim = tsim.LX200(0, port=TEL_PORT, verbose=False)
+        GLOB.tsim.start()
+        time.sleep(0.2)
+        da.GB.tel = tc.TelescopeCache(da.TeleCommunicator('127.0.0.1', TEL_PORT, timeout=1))
+        da.GB.metrics = da.RequestMetrics(da.ALP_SLOW_MS)
+        GLOB.server = da.AlpacaServer(('127.0.0.1', ALP_PORT), da.AlpacaHandler, 2)
+        Thread(target=GLOB.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        GLOB.server.stop()
+        GLOB.tsim.stop()
+        da.GB.tel = None
+
+    def test_utcdate(self):
+        'Test UTCDate'
+        ret = _get('utcdate')
+        self.assertEqual(ret['ErrorNumber'], 0)
+        value = ret['Value']
+        self.assertTrue(value.endswith('Z'), msg=value)
+        tsec = calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+        self.assertLess(abs(tsec-time.time()), MAX_DT, msg=value)
+
+    def test_static(self):
+        'Test proprietà locali: SiteElevation, SlewSettleTime, AxisRates'
+        self.assertEqual(_get('siteelevation')['Value'], da.astro.OPC.elevation)
+        self.assertEqual(_get('slewsettletime')['Value'], 0)
+        for axis in range(3):
+            ret = _get('axisrates', Axis=axis)
+            self.assertEqual((ret['ErrorNumber'], ret['Value']), (0, []), msg=f'{axis=}')
+        for axis in ('3', '-1', '1.5', 'x'):
+            self.assertEqual(_get('axisrates', Axis=axis)['ErrorNumber'],
+                             da.ALP_INVALID_VALUE[0], msg=f'{axis=}')
+
+    def test_unimplemented(self):
+        'Test membri non implementati (1024) e sconosciuti (1035)'
+        for command in UNIMPL_GET:
+            self.assertEqual(_get(command)['ErrorNumber'], da.ALP_UNIMPL_PROP[0], msg=command)
+        for command in UNIMPL_PUT:
+            self.assertEqual(_put(command)['ErrorNumber'], da.ALP_UNIMPL_PROP[0], msg=command)
+        self.assertEqual(_get('nonexistent')['ErrorNumber'], da.ALP_INVALID_OPERATION[0])
+        self.assertEqual(_put('nonexistent')['ErrorNumber'], da.ALP_INVALID_OPERATION[0])
+
+    def test_pulseguide_args(self):
+        'Test verifica argomento Direction di PulseGuide'
+        for direct in ('4', '-1', '1.5', 'x'):
+            ret = _put('pulseguide', Direction=direct, Duration=100)
+            self.assertEqual(ret['ErrorNumber'], da.ALP_INVALID_VALUE[0], msg=f'{direct=}')
+        ret = _put('pulseguide', Duration=100)
+        self.assertEqual(ret['ErrorNumber'], da.ALP_VALUE_NOT_SET[0])
+
+    def test_pulseguide(self):
+        'Test PulseGuide ed IsPulseGuiding'
+        ret = _put('pulseguide', Direction=0, Duration=PULSE_MS)
+        self.assertEqual(ret['ErrorNumber'], 0, msg=ret['ErrorMessage'])
+        time.sleep(tc.POSITION_TTL)
+        self.assertTrue(_get('ispulseguiding')['Value'])
+        time.sleep(PULSE_MS/1000.+tc.POSITION_TTL)
+        self.assertFalse(_get('ispulseguiding')['Value'])
+
+    def test_coordinates(self):
+        'Test lettura coordinate dal simulatore'
+        for command, vmin, vmax in (('rightascension', 0, 24), ('declination', -90, 90)):
+            ret = _get(command)
+            self.assertEqual(ret['ErrorNumber'], 0, msg=ret['ErrorMessage'])
+            self.assertTrue(vmin <= ret['Value'] <= vmax, msg=f'{command}: {ret["Value"]}')
+
+if __name__ == '__main__':
+    unittest.main()
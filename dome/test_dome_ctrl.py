@@ -0,0 +1,125 @@
+'''
+test_dome_ctrl.py - test per dome_ctrl.py con simulatore K8055 ad orologio virtuale
+
+Il controller viene eseguito con il simulatore K8055 ed un orologio virtuale
+(k8055_simulator.VirtualClock): una sequenza di movimenti viene eseguita in
+un tempo reale molto minore di quello simulato ed i risultati sono
+riproducibili.
+
+Poiché il controller non può essere riavviato nello stesso processo, ogni
+sequenza viene eseguita in un processo separato (python test_dome_ctrl.py -r).
+
+Il file dome_data.json, aggiornato da dome_ctrl alla chiusura, viene
+ripristinato al termine dei test.
+
+Uso:
+    python test_dome_ctrl.py
+'''
+
+import sys
+import os
+import time
+import json
+import subprocess
+import unittest
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+
+DATA_FILE = os.path.join(THIS_DIR, 'dome_data.json')
+
+SLEWS = (30, 45, 44, 20, 25, 60, 58, 57.5, 53, 150, 148.5, 140)   # Sequenza di azimut (gradi)
+
+POLL = 0.05              # Intervallo di verifica stato (sec, tempo virtuale)
+MAX_SLEW = 120           # Durata massima di un movimento (sec, tempo virtuale)
+MIN_SPEEDUP = 10         # Rapporto minimo tempo simulato/tempo reale
+
+def run_slews():
+    'Esegue la sequenza di movimenti. Riporta dizionario con i risultati'
+    import dome_ctrl                                      #pylint: disable=C0415
+    from k8055_simulator import VirtualClock              #pylint: disable=C0415
+    clock = VirtualClock()
+    dctrl = dome_ctrl.start_server(sim_k8055=True, clock=clock)
+    clock.sleep(1.5)
+    dctrl.sync_to_azimuth(0)
+    treal = time.time()
+    slews = []
+    for azh in SLEWS:
+        tstart = clock.time()
+        dctrl.slew_to_azimuth(azh)
+        while clock.time()-tstart < MAX_SLEW:
+            clock.sleep(POLL)
+            stat = dctrl.get_status()
+            if stat.movstat == 0 and stat.targetaz < 0:
+                break
+        slews.append((azh, clock.time()-tstart, stat.domeaz))
+    treal = time.time()-treal
+    board = dome_ctrl._GB.handle.device                   #pylint: disable=W0212
+    board.set_present(False)                              # scheda assente
+    clock.sleep(3)
+    absent = dctrl.get_status().connected
+    board.set_present(True)
+    clock.sleep(3)
+    present = dctrl.get_status().connected
+    params = dctrl.get_params()
+    dctrl.stop_server()
+    return {'slews': slews, 'real_time': treal, 'absent': absent, 'present': present,
+            'maxerr': (params['maxerr']+0.5)*360./params['n360']}  # +0.5: target rounding
+
+def _run_process():
+    'Esegue run_slews() in un processo separato'
+    ret = subprocess.run([sys.executable, os.path.abspath(__file__), '-r'], cwd=THIS_DIR,
+                         capture_output=True, text=True, timeout=300, check=True)
+    return json.loads(ret.stdout.splitlines()[-1])
+
+class TestAll(unittest.TestCase):
+    'Test del controller con orologio virtuale'
+    runs = []
+    data_save = None
+
+    @classmethod
+    def setUpClass(cls):
+        with open(DATA_FILE, encoding='utf8') as f_in:
+            cls.data_save = f_in.read()
+        try:
+            for _unused in range(2):
+                cls.runs.append(_run_process())
+                with open(DATA_FILE, 'w', encoding='utf8') as f_out:
+                    f_out.write(cls.data_save)
+        except Exception:
+            cls.tearDownClass()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        with open(DATA_FILE, 'w', encoding='utf8') as f_out:
+            f_out.write(cls.data_save)
+
+    def test_positioning(self):
+        'Test errore di posizionamento'
+        run = self.runs[0]
+        for azh, tslew, domeaz in run['slews']:
+            err = (domeaz-azh+180)%360-180
+            self.assertLess(tslew, MAX_SLEW, msg=f'{azh=}')
+            self.assertLessEqual(abs(err), run['maxerr']+1.e-6, msg=f'{azh=}, {domeaz=}')
+
+    def test_reproducible(self):
+        'Test riproducibilità'
+        self.assertEqual(self.runs[0]['slews'], self.runs[1]['slews'])
+
+    def test_speedup(self):
+        'Test esecuzione più veloce del tempo reale'
+        run = self.runs[0]
+        tsim = sum(x[1] for x in run['slews'])
+        self.assertGreater(tsim, MIN_SPEEDUP*run['real_time'], msg=f'{tsim=}')
+
+    def test_board_absent(self):
+        'Test rilevazione scheda assente e riconnessione'
+        run = self.runs[0]
+        self.assertFalse(run['absent'])
+        self.assertTrue(run['present'])
+
+if __name__ == '__main__':
+    if '-r' in sys.argv:
+        print(json.dumps(run_slews()))
+    else:
+        unittest.main()
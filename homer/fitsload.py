@@ -0,0 +1,221 @@
+"""
+fitsload.py - Lettura di immagini FITS per homer
+
+Funzioni di basso livello per le immagini di guida, che sono lette una
+volta sola e di cui serve solo una parte dei pixel:
+
+    - l'intestazione viene letta a blocchi fino al record END, decodificando
+      solo le chiavi che servono (dimensioni, BSCALE, BZERO, tempo di posa)
+
+    - i dati sono acceduti tramite memory map: dal disco vengono lette solo
+      le pagine che contengono la regione usata
+
+    - la conversione in valori fisici (BSCALE, BZERO), la riduzione (binning)
+      e la normalizzazione al tempo di posa sono scritte in un buffer che
+      viene riutilizzato per tutte le immagini della stessa dimensione
+
+I file che non contengono una semplice immagine 2D nella HDU primaria sono
+letti con astropy.
+"""
+
+import mmap
+import warnings
+from collections import namedtuple
+import numpy as np
+from astropy.io import fits
+
+BLOCK_SIZE = 2880   # Dimensione blocco FITS
+CARD_SIZE = 80      # Dimensione record di intestazione FITS
+
+_STRUCT_KEYS = (b'BITPIX', b'NAXIS', b'PCOUNT', b'GCOUNT', b'BSCALE', b'BZERO')
+
+_DTYPES = {8: '>u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}
+
+class FitsFormatError(ValueError):
+    'File non leggibile con memory map'
+
+ImageInfo = namedtuple('ImageInfo', 'shape dtype offset bscale bzero values')
+
+def card_value(card):
+    'Valore di un record di intestazione (int, float, bool o str)'
+    value = card[10:].decode('ascii', 'replace')
+    if value.lstrip().startswith("'"):
+        return value.split("'")[1].rstrip()
+    value = value.split('/')[0].strip()
+    if value in ('T', 'F'):
+        return value == 'T'
+    try:
+        return int(value)
+    except ValueError:
+        return float(value.replace('D', 'E'))
+
+def read_header(f_in, offset=0, first=True, wanted=()):
+    '''
+    Legge intestazione di una HDU
+
+    Parametri
+    ---------
+    f_in : file
+        File aperto in modo binario
+    offset : int
+        Posizione dell'intestazione nel file
+    first : bool
+        True: HDU primaria (primo record: SIMPLE), altrimenti estensione
+    wanted : tuple
+        Chiavi da decodificare oltre a quelle delle dimensioni dei dati
+
+    Ritorna
+    -------
+    header : tuple o bool o None
+        (fine intestazione, dict chiave: valore) oppure: False se
+        l'intestazione è incompleta, None se non è FITS
+    '''
+    f_in.seek(offset)
+    wanted = tuple(x.encode('ascii') for x in wanted)
+    keys = {}
+    nblocks = 0
+    while True:
+        block = f_in.read(BLOCK_SIZE)
+        if nblocks == 0:
+            start = b'SIMPLE  =' if first else b'XTENSION='
+            if block[:len(start)] != start[:len(block)]:
+                return None
+        if len(block) < BLOCK_SIZE:
+            return False
+        nblocks += 1
+        for pos in range(0, BLOCK_SIZE, CARD_SIZE):
+            card = block[pos:pos+CARD_SIZE]
+            key = card[:8].rstrip()
+            if key == b'END':
+                return offset+nblocks*BLOCK_SIZE, keys
+            if key in _STRUCT_KEYS or key.startswith(b'NAXIS') or key in wanted:
+                keys[key.decode('ascii')] = card_value(card)
+
+def data_size(keys):
+    'Dimensione in byte dei dati di una HDU (senza riempimento)'
+    naxis = keys.get('NAXIS', 0)
+    if naxis == 0:
+        return 0
+    npix = 1
+    for axis in range(1, naxis+1):
+        dim = keys[f'NAXIS{axis}']
+        if axis == 1 and dim == 0:       # Random groups
+            continue
+        npix *= dim
+    return abs(keys['BITPIX'])//8*keys.get('GCOUNT', 1)*(keys.get('PCOUNT', 0)+npix)
+
+def image_info(f_in, wanted=()):
+    '''
+    Descrizione dell'immagine nella HDU primaria
+
+    Ritorna ImageInfo(shape, dtype, offset, bscale, bzero, values), dove
+    values contiene le chiavi richieste in wanted presenti nell'intestazione.
+    Genera FitsFormatError se la HDU primaria non contiene un'immagine 2D
+    '''
+    try:
+        ret = read_header(f_in, wanted=wanted)
+    except ValueError as excp:
+        raise FitsFormatError(str(excp)) from excp
+    if not ret:
+        raise FitsFormatError('FITS header not found or incomplete')
+    offset, keys = ret
+    naxis = keys.get('NAXIS', 0)
+    shape = tuple(keys.get(f'NAXIS{x}', 0) for x in range(naxis, 0, -1))
+    while len(shape) > 2 and shape[0] == 1:          # Es.: NAXIS3 = 1
+        shape = shape[1:]
+    if len(shape) != 2 or keys.get('BITPIX') not in _DTYPES:
+        raise FitsFormatError('primary HDU is not a 2D image')
+    values = {x: keys[x] for x in wanted if x in keys}
+    return ImageInfo(shape, np.dtype(_DTYPES[keys['BITPIX']]), offset,
+                     keys.get('BSCALE', 1.0), keys.get('BZERO', 0.0), values)
+
+def image_shape(path):
+    'Dimensioni (y, x) dell\'immagine nella HDU primaria'
+    try:
+        with open(path, 'rb') as f_in:
+            return image_info(f_in).shape
+    except FitsFormatError:
+        header = fits.getheader(path, 0)
+        return header['NAXIS2'], header['NAXIS1']
+
+class FrameLoader:
+    '''
+    Lettura di una regione di immagini FITS in un buffer riutilizzato
+
+    Parametri
+    ---------
+    binning : int
+        Fattore di riduzione dell'immagine (1: nessuna riduzione)
+    exposure : str
+        Chiave del tempo di posa (se non presente si usa 1.0)
+    '''
+    def __init__(self, binning=1, exposure='EXPOSURE'):
+        self.binning = binning
+        self.exposure = exposure
+        self.buffer = None
+
+    def _buffer(self, shape):
+        'Buffer per i dati (riallocato solo se cambiano le dimensioni)'
+        if self.buffer is None or self.buffer.shape != shape:
+            self.buffer = np.empty(shape, dtype=np.float32)
+        return self.buffer
+
+    def _exposure(self, values):
+        'Tempo di posa (come Donuts: 1.0 se non specificato)'
+        try:
+            return float(values[self.exposure])
+        except (KeyError, TypeError, ValueError):
+            warnings.warn(f'Exposure time keyword "{self.exposure}" not found, assuming 1.0')
+            return 1.0
+
+    def _convert(self, data, region, scale, zero):      # pylint: disable=R0913
+        'Converte la regione nel buffer: valore = dato*scale+zero'
+        low_y, upp_y, low_x, upp_x = region
+        fac = self.binning
+        ysize, xsize = (upp_y-low_y)//fac, (upp_x-low_x)//fac
+        buf = self._buffer((ysize, xsize))
+        data = data[low_y:low_y+ysize*fac, low_x:low_x+xsize*fac]
+        if fac > 1:
+            data.reshape(ysize, fac, xsize, fac).sum(axis=(1, 3), dtype=np.float32, out=buf)
+            zero *= fac*fac
+        else:
+            np.copyto(buf, data, casting='unsafe')
+        buf *= scale
+        buf += zero
+        return buf
+
+    def load(self, path, region):
+        '''
+        Legge una regione dell'immagine nella HDU primaria
+
+        Parametri
+        ---------
+        path : str
+            File FITS
+        region : tuple
+            (lower_y, upper_y, lower_x, upper_x), in pixel dell'immagine
+            originale
+
+        Ritorna
+        -------
+        data : numpy.ndarray
+            Regione (ridotta se binning > 1) in valori fisici divisi per il
+            tempo di posa. Il buffer è riutilizzato alla chiamata successiva
+        '''
+        with open(path, 'rb') as f_in:
+            try:
+                info = image_info(f_in, (self.exposure,))
+            except FitsFormatError:
+                info = None
+            if info:
+                exposure = self._exposure(info.values)
+                with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mem:
+                    data = np.frombuffer(mem, info.dtype, info.shape[0]*info.shape[1],
+                                         info.offset).reshape(info.shape)
+                    try:
+                        return self._convert(data, region, info.bscale/exposure,
+                                             info.bzero/exposure)
+                    finally:
+                        del data                 # Necessario per chiudere la memory map
+        data, header = fits.getdata(path, 0, header=True)
+        return self._convert(data, region, 1.0/self._exposure(header), 0.0)
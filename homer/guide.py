@@ -3,9 +3,11 @@ guide.py  Autoguida da immagini scientifiche
 
 uso per test:
 
-    python guide.py [-s] sci_dir sci_calib  [aux_dir, aux_calib]
+    python guide.py [-1] [-s] sci_dir sci_calib  [aux_dir, aux_calib]
 
 Dove:
+    -1:        impulsi di guida su un asse alla volta (default: entrambi
+               gli assi in contemporanea, con un'unica attesa)
     -s:        connessione al simulatore (default: telescope)
 
     sci_dir    Directory per immagini principali (scientifiche)
@@ -17,13 +19,34 @@ Dove:
 # La funzione guideloop() è strutturata per essere lanciata in un processo
 # La comunicazione con il programma chiamante avviene tramite la classe Comm
 
+# All'interno del processo la guida è organizzata in una pipeline a tre stadi:
+#
+#   - acquisizione (thread principale): rileva le nuove immagini e gestisce
+#     i comandi dal programma chiamante
+#   - misura (GuidePipeline.measure, thread dedicato): calcola lo shift con
+#     Donuts e gestisce le immagini di riferimento
+#   - correzione (GuidePipeline.correct, thread dedicato): invia gli impulsi
+#     al telescopio e attende la fine del movimento
+#
+# Così la misura dell'immagine successiva può iniziare mentre la correzione
+# precedente è ancora in corso. Ogni stadio elabora sempre il dato più
+# recente: quelli non ancora elaborati vengono scartati quando ne arriva
+# uno più nuovo (come faceva il loop seriale prendendo l'ultimo file)
+#
+# Le immagini la cui posa è iniziata prima della fine dell'ultima correzione
+# non vengono misurate (la posizione del telescopio è cambiata durante la
+# posa). Ogni misura riporta il numero di correzioni eseguite al momento
+# della misura (generazione): lo stadio di correzione scarta le misure di
+# una generazione precedente
+
 import sys
 import os
 import time
 import json
 import signal
+import traceback
 import multiprocessing as mp
-from donuts import Donuts
+from threading import Thread, Condition, Lock
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
@@ -32,8 +55,16 @@ from opc import constants as const
 from opc.utils import get_config
 from opc.telecomm import TeleCommunicator
 from homer.calibrate import Transformer
+from homer.imgwatch import ImageWatcher
+from homer.shiftmeter import ShiftMeter
+from homer.fitsload import read_header
 
 LOOP_TIME = 0.2    # Tempo di ritardo loop principale (secondi)
+STAGE_JOIN = 10.0  # Attesa massima per la terminazione degli stadi (secondi)
+
+SETTLE_POLL = 0.05   # Intervallo di lettura stato durante gli impulsi di guida (secondi)
+SETTLE_MARGIN = 2.0  # Attesa massima oltre la durata degli impulsi (secondi)
+DUAL_AXIS = True     # True: impulsi di guida sui due assi in contemporanea
 
 HOUR_TO_DEG = 15.0 # Conversione ore->gradi
 
@@ -42,6 +73,12 @@ SCI_TILES = 32  # Numero di "tiles" da usare nell'inizializzazione
                 # di donuts sull'immagine scientifica
 AUX_TILES = 32  # ... e nell'immagine ausiliaria
 
+ROI_SIZE = 0    # Lato della regione centrale usata per la misura dello shift
+                # (pixel, 0: immagine intera). Per sensori di grandi dimensioni
+BINNING = 1     # Fattore di riduzione delle immagini per la misura dello shift
+
+EXPOSURE_KEYS = ('EXPOSURE', 'EXPTIME')   # Chiavi FITS del tempo di posa (sec)
+
 ASRATE = 15     # Conversione spostamento "pulse" da arcsec in secondi di durata
 NOMINAL_COEFF = 1000/ASRATE
 
@@ -124,7 +161,9 @@ class GLOB:                                # pylint: disable=R0903
     debug = False
     loop = True
     comm = FakeQueue()
+    comm_lock = Lock()
     tel = None
+    dual_axis = DUAL_AXIS
 
 def set_debug(enable):
     "Abilita/disabilita debug mode"
@@ -153,109 +192,281 @@ def _debug(*pars):
     if GLOB.debug:
         print("GUIDE DBG>", *pars)
 
-FITS_EXT = (".fit", ".fits", ".FIT", ".FITS")
-
-
-@protect
-def last_file(dirpath, keep=0):
-    "Trova file più recente nella directory"
-    all_fits = list(os.path.join(dirpath, x) for x in os.listdir(dirpath) if x.endswith(FITS_EXT))
-    all_fits.sort(key=os.path.getmtime)
-    if keep > 0:
-        for remove in all_fits[:-keep]:
-            os.unlink(remove)
-    if all_fits:
-        last = all_fits[-1]
-        last_size = os.path.getsize(last)
-        while True:                       # Trucchetto per aspettare che il file sia stabile
-            time.sleep(0.1)               # ... si spera che la scrittura dei file non abbia
-            size = os.path.getsize(last)  # pause di durata maggiore
-            if last_size == size:
-                break
-            last_size = size
-        return last
-    return None
-
 def init_donuts(image_file, ntiles, ident):
     "Inizializza Donuts con nuova immagine"
     _debug(f'init_donuts({image_file}, {ntiles}, {ident})')
     send('LOG', f'[{ident}] Init. donuts on image: {image_file} (ntiles={ntiles})')
     try:
-        donuts = Donuts(refimage=image_file, image_ext=0, overscan_width=20, prescan_width=20,
-                        border=64, normalise=True, downweight_edges=False,
-                        exposure='EXPOSURE', subtract_bkg=True, ntiles=ntiles)
+        donuts = ShiftMeter(image_file, ntiles, roi=ROI_SIZE, binning=BINNING)
     except Exception as excp:            # pylint: disable=W0703
         if GLOB.debug:
             raise
         send('LOG', f'[{ident}] *** Error initializing Donuts [{str(excp)}]')
         return None
+    send('LOG', f'[{ident}] Shift measurement area: {donuts.describe()}')
     return donuts
 
 def send(code, what):
     "comunica con GUI"
     _debug(f'send({code}, {what})')
-    GLOB.comm.put((code, what))
-
-def adjust_tel(trans, xsh, ysh, ident):     #pylint: disable=R0914,R0912,R0915
-    "Calcola e corregge posizione telescopio"
+    with GLOB.comm_lock:                  # send() è usata da più thread
+        GLOB.comm.put((code, what))
+
+def _pulse(direct, mover, duration, ident):
+    "Invia impulso di guida"
+    send('LOG', f'[{ident}] Pulse guide {direct} {duration}')
+    time0 = time.time_ns()
+    stat = mover(duration)
+    time1 = time.time_ns()
+    delay = (time1-time0)*0.000001
+    if stat != '':
+        send('LOG', f'[{ident}] *** Error: {GLOB.tel.last_error()} [delay: {delay:.3f} ms]')
+    else:
+        send('LOG', f'[{ident}] Pulse guide {direct} - OK [delay: {delay:.3f} ms]')
+
+def _settle(duration, ident):
+    "Attende la fine degli impulsi di guida in corso (durata in ms)"
+    send('LOG', f'[{ident}] Telescope moving... ({duration} ms)')
+    time.sleep(duration*0.001)                 # Il controllore non può finire prima
+    deadline = time.monotonic()+SETTLE_MARGIN
+    while True:
+        stat = GLOB.tel.get_status()
+        if not stat or "G" not in stat:        # "G": impulso di guida in corso
+            break
+        if time.monotonic() > deadline:
+            send('LOG', f'[{ident}] *** Error: guide pulse not terminated')
+            break
+        time.sleep(SETTLE_POLL)
+
+def exposure_time(image):
+    "Tempo di posa dell'immagine (sec, 0 se non specificato)"
+    try:
+        with open(image, 'rb') as f_in:
+            header = read_header(f_in, wanted=EXPOSURE_KEYS)
+    except (OSError, ValueError):
+        return 0
+    keys = header[1] if header else {}
+    return next((keys[x] for x in EXPOSURE_KEYS if isinstance(keys.get(x), (int, float))), 0)
+
+def adjust_tel(trans, xsh, ysh, ident):
+    """Calcola e corregge posizione telescopio. Ritorna il numero di impulsi
+    inviati (None in caso di errore)"""
     ra_shift, de_shift = trans.transform(xsh, ysh)    # Calcolo aggiustamento
     send('LOG', f'[{ident}] Computed move (RA, DEC): '
          f'({ra_shift:.2f}, {de_shift:.2f}) arcsec')
     ra_abs, de_abs = abs(ra_shift), abs(de_shift)    # Controlla spostamento eccessivo
     if ra_abs > 120 or de_abs > 120:
         send('LOG', f'[{ident}] *** Error: RA/DE shift higher than 2 arcmins... guiding stopped')
-        return False
+        return None
+    pulses = []
                     # Ricentro il telescopio  in A.R.
-    moved = False
     duration = int(ra_abs*MULT.ar_mult*NOMINAL_COEFF)
     if 20 < duration < 16399:
         if ra_shift <= 0:
-            direct = "east"
-            mover = GLOB.tel.pulse_guide_east
+            pulses.append(("east", GLOB.tel.pulse_guide_east, duration))
         else:
-            direct = "west"
-            mover = GLOB.tel.pulse_guide_west
-        send('LOG', f'[{ident}] Pulse guide {direct} {duration}')
-        moved = True
-        time0 = time.time_ns()
-        stat = mover(duration)
-        time1 = time.time_ns()
-        delay = (time1-time0)*0.000001
-        if stat != '':
-            send('LOG', f'[{ident}] *** Error: {GLOB.tel.last_error()} [delay: {delay:.3f} ms]')
-        else:
-            send('LOG', f'[{ident}] Pulse guide {direct} - OK [delay: {delay:.3f} ms]')
+            pulses.append(("west", GLOB.tel.pulse_guide_west, duration))
     else:
         send('LOG', f'[{ident}] Telescope not moved in RA. Pulse was: {duration}')
                     # Ricentro il telescopio  in DEC.
     duration = int(de_abs*MULT.de_mult*NOMINAL_COEFF)
     if 20 < duration < 16399:
         if de_shift <= 0:
-            direct = "north"
-            mover = GLOB.tel.pulse_guide_north
-        else:
-            direct = "south"
-            mover = GLOB.tel.pulse_guide_south
-        send('LOG', f'[{ident}] Pulse guide {direct} {duration}')
-        moved = True
-        time0 = time.time_ns()
-        stat = mover(duration)
-        time1 = time.time_ns()
-        delay = (time1-time0)*0.000001
-        if stat != '':
-            send('LOG', f'[{ident}] *** Error: {GLOB.tel.last_error()} [delay: {delay:.3f} ms]')
+            pulses.append(("north", GLOB.tel.pulse_guide_north, duration))
         else:
-            send('LOG', f'[{ident}] Pulse guide {direct} - OK [delay: {delay:.3f} ms]')
+            pulses.append(("south", GLOB.tel.pulse_guide_south, duration))
     else:
         send('LOG', f'[{ident}] Telescope not moved in DE. Pulse was: {duration}')
-    if moved:
-        while GLOB.tel.get_status() == 'n':
-            send('LOG', f'[{ident}] Telescope moving...')
-            time.sleep(0.5)
+    if pulses:
+        if GLOB.dual_axis:          # Impulsi sui due assi in contemporanea
+            for direct, mover, duration in pulses:
+                _pulse(direct, mover, duration, ident)
+            _settle(max(x[2] for x in pulses), ident)
+        else:                       # Un asse alla volta
+            for direct, mover, duration in pulses:
+                _pulse(direct, mover, duration, ident)
+                _settle(duration, ident)
                     # Invia comando sync al telescopio
         send('LOG', f'[{ident}] Telescope sync')
         GLOB.tel.sync_radec()
-    return True
+    return len(pulses)
+
+class Stage(Thread):
+    '''
+    Stadio della pipeline di guida
+
+    Esegue func(key, item) in un thread dedicato per ogni dato ricevuto.
+    Per ogni chiave ("sci", "aux") si mantiene solo il dato più recente;
+    i dati sono elaborati nell'ordine di priorità delle chiavi
+    '''
+    def __init__(self, name, func, priority, on_error):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.priority = priority
+        self.on_error = on_error
+        self.cond = Condition()
+        self.slots = {}
+        self.stopped = False
+
+    def put(self, key, item):
+        'Accoda dato. Ritorna il dato scartato (o None)'
+        with self.cond:
+            dropped = self.slots.get(key)
+            self.slots[key] = item
+            self.cond.notify()
+        return dropped
+
+    def discard(self, key):
+        'Scarta dato in attesa'
+        with self.cond:
+            self.slots.pop(key, None)
+
+    def stop(self):
+        'Termina il thread al termine dell\'elaborazione in corso'
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.slots and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                key = next(x for x in self.priority if x in self.slots)
+                item = self.slots.pop(key)
+            try:
+                self.func(key, item)
+            except Exception as excp:            # pylint: disable=W0703
+                if GLOB.debug:
+                    traceback.print_exc()
+                self.on_error(f'[{key}] Error in {self.name} stage [{str(excp)}]')
+
+class GuidePipeline:                              # pylint: disable=R0902
+    '''
+    Stadi di misura e correzione della guida
+
+    Parametri
+    ---------
+    sci_trans : Transformer
+        Trasformazione per immagini scientifiche
+    sci_tiles : int
+        numero tiles per valutazione background
+    aux_trans : Transformer
+        Trasformazione per immagini ausiliarie (None: non usate)
+    aux_tiles : int
+        numero tiles per valutazione background
+    '''
+    def __init__(self, sci_trans, sci_tiles, aux_trans, aux_tiles):
+        self.trans = {"sci": sci_trans, "aux": aux_trans}
+        self.tiles = {"sci": sci_tiles, "aux": aux_tiles}
+        self.guard_x = sci_trans.imagew/10
+        self.guard_y = sci_trans.imageh/10
+        self.sci_donuts = None           # Accessi da misura (scrittura)
+        self.aux_donuts = None           # ... e da acquisizione (lettura)
+        self.aux_reset = False           # Richiesta nuovo riferimento ausiliario
+        self.error = None                # Errore che termina la guida
+        self.t_settled = 0.0             # Fine ultima correzione (time.time()) ed
+        self.generation = 0              # numero di correzioni (scritti da correzione)
+        self.measure_stage = Stage("measure", self.measure, ("sci", "aux"), self.fail)
+        self.correct_stage = Stage("correct", self.correct, ("sci", "aux"), self.fail)
+
+    def start(self):
+        'Avvia gli stadi di misura e correzione'
+        self.measure_stage.start()
+        self.correct_stage.start()
+
+    def stop(self):
+        'Termina gli stadi, attendendo la fine delle operazioni in corso'
+        self.measure_stage.stop()
+        self.correct_stage.stop()
+        self.measure_stage.join(STAGE_JOIN)
+        self.correct_stage.join(STAGE_JOIN)
+
+    def fail(self, errmsg):
+        'Segnala errore che termina la guida'
+        if not self.error:
+            self.error = errmsg
+
+    def ingest(self, ident, image):
+        'Invia nuova immagine allo stadio di misura'
+        dropped = self.measure_stage.put(ident, (image, time.time()))
+        if dropped:
+            send('LOG', f'[{ident}] Image skipped (newer image available): {dropped[0]}')
+
+    def _shift(self, donuts, image, ident):
+        'Calcola shift. Ritorna (x, y) o None'
+        try:
+            return donuts.measure(image)
+        except Exception as excp:            # pylint: disable=W0703
+            if GLOB.debug:
+                raise
+            send('LOG', f'[{ident}] Donuts error on last image [{str(excp)}]')
+            return None
+
+    def measure(self, ident, job):
+        'Stadio di misura: calcola shift ed invia allo stadio di correzione'
+        image, t_image = job
+        generation = self.generation
+        t_start = t_image-exposure_time(image)-LOOP_TIME    # t_image: rilevazione del file
+        if t_start < self.t_settled:
+            send('LOG', f'[{ident}] Image skipped (taken before end of last correction): {image}')
+            return
+        if ident == "sci":
+            if not self.sci_donuts:      # Prima immagine utile
+                send('LOG', "[sci] First image: "+image)
+                self.sci_donuts = init_donuts(image, self.tiles["sci"], "sci")
+                if not self.sci_donuts:
+                    self.fail('Donut initialization failed')
+                return
+            send('LOG', "[sci] New image: "+str(image))
+            shift = self._shift(self.sci_donuts, image, "sci")
+            if not shift:
+                return
+            self.aux_donuts = None
+            self.correct_stage.discard("aux")
+            xsh, ysh = shift
+            send('LOG', f'[sci] Computed shift (X, Y): ({xsh:.1f}, {ysh:.1f})')
+            send("SHIFT", (xsh, ysh))
+            if abs(xsh) > self.guard_x or abs(ysh) > self.guard_y:  # In caso di drift l'ultima
+                send('LOG', "[sci] Recentering Donuts")               # immagine diventa il
+                self.sci_donuts.recenter()                            # riferimento
+        else:
+            if self.aux_reset:
+                self.aux_reset = False
+                self.aux_donuts = None
+            if not self.aux_donuts:
+                send('LOG', "[aux] First image: "+image)
+                self.aux_donuts = init_donuts(image, self.tiles["aux"], "aux")
+                return
+            send('LOG', "[aux] New image: "+str(image))
+            shift = self._shift(self.aux_donuts, image, "aux")
+            if not shift:
+                return
+            xsh, ysh = shift
+            send('LOG', f'[aux] Computed shift (X, Y): ({xsh:.2f}, {ysh:.2f})')
+            send("SHIFT", (xsh, ysh))
+        dropped = self.correct_stage.put(ident, (xsh, ysh, t_image, generation))
+        if dropped:
+            send('LOG', f'[{ident}] Correction skipped (newer shift available)')
+
+    def correct(self, ident, job):
+        'Stadio di correzione: movimento del telescopio'
+        xsh, ysh, t_image, generation = job
+        if generation != self.generation:
+            send('LOG', f'[{ident}] Correction skipped (shift measured before last correction)')
+            return
+        npulses = adjust_tel(self.trans[ident], xsh, ysh, ident)
+        if npulses:                      # t_settled prima di generation (vedi measure)
+            self.t_settled = time.time()
+            self.generation += 1
+        if npulses is not None:
+            send('LOG', f'[{ident}] Correction done {time.time()-t_image:.3f} s after image')
+        elif ident == "sci":
+            self.fail("Telescope movement failed")
+        else:
+            self.aux_reset = True
 
 def guideloop(comm_serv, sci_dir, sci_calib, sci_tiles,      # pylint: disable=R0912,R0915,R0913,R0914
               aux_dir, aux_calib, aux_tiles, simul, debug_on):
@@ -325,86 +536,33 @@ def guideloop(comm_serv, sci_dir, sci_calib, sci_tiles,      # pylint: disable=R
         send('LOG', "[aux] Calib.params: "+str(aux_trans))
         _debug("Aux calibration file OK")
     send("ORNT", sci_trans.orient)
-    guard_x = sci_trans.imagew/10
-    guard_y = sci_trans.imageh/10
-    sci_donuts = None
-    aux_donuts = None
-    first_sci_im = None
-    first_aux_im = None
-    while GLOB.loop:                 # pylint: disable=R1702
-        time.sleep(LOOP_TIME)
+    sci_watch = ImageWatcher(sci_dir)
+    aux_watch = ImageWatcher(aux_dir, keep=3) if aux_calib else None
+    send('LOG', f'[sci] New images detection: {sci_watch.method()}')
+    pipeline = GuidePipeline(sci_trans, sci_tiles, aux_trans if aux_calib else None, aux_tiles)
+    pipeline.start()
+    while GLOB.loop:
+        sci_watch.wait(LOOP_TIME)
         if not GLOB.comm.empty():
             cmd = GLOB.comm.get()
             _debug("Input command:", cmd)
             if cmd == "STOP":
                 break
             send('LOG', "*** Error: illegal command: "+str(cmd))
-        if not sci_donuts: # Aspetta prima immagine utile
-            first_sci_im = last_file(sci_dir)
-            if first_sci_im:
-                send('LOG', "[sci] First image: "+first_sci_im)
-                sci_donuts = init_donuts(first_sci_im, sci_tiles, "sci")
-                if not sci_donuts:
-                    send("ERR", 'Donut initialization failed')
-                    break
-                last_sci_im = first_sci_im
-            continue
-        next_sci_im = last_file(sci_dir)
-        if next_sci_im and (next_sci_im != last_sci_im):
-            send('LOG', "[sci] New image: "+str(next_sci_im))
-            last_sci_im = next_sci_im
-
-            # Calcolo shift su immagine scientifica
-            try:
-                shift_result = sci_donuts.measure_shift(last_sci_im)
-            except Exception as excp:            # pylint: disable=W0703
-                if GLOB.debug:
-                    raise
-                send('LOG', f'[sci] Donuts error on last image [{str(excp)}]')
-                continue
-            aux_donuts = None
-            xsh, ysh = shift_result.x.value, shift_result.y.value
-            send('LOG', f'[sci] Computed shift (X, Y): ({xsh:.1f}, {ysh:.1f})')
-            send("SHIFT", (xsh, ysh))
-            abs_x, abs_y = abs(xsh), abs(ysh)
-            if abs_x > guard_x or abs_y > guard_y:  # reinizializza Donuts in caso di drift
-                send('LOG', "[sci] Recentering Donuts")
-                sci_donuts = init_donuts(last_sci_im, sci_tiles, "sci")
-                if not sci_donuts:
-                    send("ERR", 'Donuts initialization failed')
-                    break
-            adjusted = adjust_tel(sci_trans, xsh, ysh, "sci")   # Movimento telescopio
-            if not adjusted:
-                send("ERR", "Telescope movement failed")
-                break
-        elif aux_calib:                # Aggiusta con guida ausiliaria
-            if not aux_donuts:
-                first_aux_im = last_file(aux_dir, keep=3)
-                if first_aux_im:
-                    send('LOG', "[aux] First image: "+first_aux_im)
-                    aux_donuts = init_donuts(first_aux_im, aux_tiles, "aux")
-                    if aux_donuts:
-                        last_aux_im = first_aux_im
-                continue
-            next_aux_im = last_file(aux_dir, keep=3)
-            if next_aux_im and (next_aux_im != last_aux_im):
-                send('LOG', "[aux] New image: "+str(next_aux_im))
-                last_aux_im = next_aux_im
-                # Calcolo shift su immagine ausiliaria
-                try:
-                    shift_result = aux_donuts.measure_shift(last_aux_im)
-                except Exception as excp:            # pylint: disable=W0703
-                    if GLOB.debug:
-                        raise
-                    send('LOG', f'[aux] Donuts error on last image [{str(excp)}]')
-                    continue
-                xsh, ysh = shift_result.x.value, shift_result.y.value
-                send('LOG', '[aux] Computed shift (X, Y): ({xsh:.2f}, {ysh:.2f})')
-                send("SHIFT", (xsh, ysh))
-                abs_x, abs_y = abs(xsh), abs(ysh)
-                adjusted = adjust_tel(aux_trans, xsh, ysh, "aux")   # Movimento telescopio
-                if not adjusted:
-                    aux_donuts = None
+        if pipeline.error:
+            send("ERR", pipeline.error)
+            break
+        next_sci_im = sci_watch.newest()
+        if next_sci_im:
+            pipeline.ingest("sci", next_sci_im)
+        elif aux_watch and pipeline.sci_donuts:  # Aggiusta con guida ausiliaria
+            next_aux_im = aux_watch.newest()
+            if next_aux_im:
+                pipeline.ingest("aux", next_aux_im)
+    pipeline.stop()
+    sci_watch.close()
+    if aux_watch:
+        aux_watch.close()
     send("TERM", "stopped by master")
 
 def test():
@@ -412,14 +570,11 @@ def test():
     if "-h" in sys.argv:
         print(__doc__)
         sys.exit()
-    if "-s" in sys.argv:
-        simul = True
-        argspt = 2
-    else:
-        simul = False
-        argspt = 1
+    if "-1" in sys.argv:
+        GLOB.dual_axis = False
+    simul = "-s" in sys.argv
 
-    args = sys.argv[argspt:]
+    args = [x for x in sys.argv[1:] if x not in ("-1", "-s")]
     if len(args) == 2:
         sci_dir = args[0]
         sci_cal = args[1]
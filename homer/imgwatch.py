@@ -0,0 +1,316 @@
+"""
+imgwatch.py - Rilevamento di nuove immagini FITS in una directory
+
+Sostituisce la scansione periodica dell'intera directory: un oggetto
+ImageWatcher genera un evento "file completo" per ogni nuova immagine,
+senza attese attive per verificare che la scrittura sia terminata.
+
+Metodi di rilevamento:
+
+    - inotify (solo Linux, tramite ctypes): il kernel segnala la chiusura
+      dei file scritti (IN_CLOSE_WRITE) e quelli spostati nella
+      directory (IN_MOVED_TO)
+
+    - polling (tutti i sistemi): la directory viene riletta solo quando
+      cambia la sua data di modifica (o comunque ogni RESCAN_TIME secondi)
+      e l'indice dei file già completi viene aggiornato in modo
+      incrementale: solo i file nuovi vengono esaminati
+
+Un file è completo quando la sua dimensione corrisponde a quella
+calcolata dalle intestazioni FITS (blocchi di intestazione più dati di
+tutte le HDU presenti). Per i file non FITS, o scritti senza il riempimento
+finale del blocco dati, si usa la chiusura del file (inotify) o la
+stabilità della dimensione fra due controlli successivi.
+
+NOTA: col metodo polling un file riscritto con lo stesso nome non viene
+      rilevato: i programmi di acquisizione generano un nuovo nome per
+      ogni immagine.
+
+uso per test:
+
+    python imgwatch.py [-p] dir
+
+Dove:
+    -p:   usa il metodo polling anche in Linux
+    dir   directory da controllare
+"""
+
+import sys
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from collections import deque
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# pylint: disable=C0413
+from homer.fitsload import BLOCK_SIZE, read_header, data_size
+
+FITS_EXT = (".fit", ".fits", ".FIT", ".FITS")
+
+RESCAN_TIME = 5.0   # Intervallo massimo fra riletture della directory (polling)
+
+                    # Costanti inotify (da <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+WATCH_MASK = IN_CLOSE_WRITE|IN_MOVED_TO|IN_MOVED_FROM|IN_DELETE|IN_DELETE_SELF|IN_MOVE_SELF
+
+EVENT_HEAD = struct.Struct('iIII')     # wd, mask, cookie, len
+
+def fits_complete(path, size):
+    '''
+    Verifica se un file FITS è completo
+
+    Parametri
+    ---------
+    path : str
+        Nome del file
+    size : int
+        Dimensione attuale del file
+
+    Ritorna
+    -------
+    status : bool o None
+        True: dimensione corrispondente alle intestazioni, False: file
+        incompleto, None: file non FITS o senza riempimento finale (non
+        si può decidere)
+    '''
+    try:
+        with open(path, 'rb') as f_in:
+            offset = 0
+            first = True
+            while True:
+                ret = read_header(f_in, offset, first)
+                if ret is False:
+                    return False
+                if ret is None:          # Non FITS, o dati estranei dopo l'ultima HDU
+                    return None if first else True
+                data_start, keys = ret
+                nbytes = data_size(keys)
+                data_end = data_start+nbytes
+                padded_end = data_start+(nbytes+BLOCK_SIZE-1)//BLOCK_SIZE*BLOCK_SIZE
+                if size < data_end:
+                    return False
+                if size == padded_end:
+                    return True
+                if size < padded_end:
+                    return None
+                offset = padded_end
+                first = False
+    except (OSError, ValueError, KeyError):
+        return None
+
+class _Inotify:
+    'Interfaccia minima a inotify tramite ctypes'
+    def __init__(self, dirpath):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK|os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        wdesc = libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+        if wdesc < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch', dirpath)
+
+    def read(self):
+        'Legge eventi disponibili. Ritorna lista di (mask, nome)'
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos < len(buf):
+                _unused, mask, _unused, nlen = EVENT_HEAD.unpack_from(buf, pos)
+                pos += EVENT_HEAD.size
+                name = os.fsdecode(buf[pos:pos+nlen].rstrip(b'\0'))
+                pos += nlen
+                events.append((mask, name))
+
+    def close(self):
+        'Chiude il descrittore inotify'
+        os.close(self.fd)
+
+class ImageWatcher:                     #pylint: disable=R0902
+    '''
+    Rileva nuove immagini complete in una directory
+
+    Parametri
+    ---------
+    dirpath : str
+        Directory da controllare
+    keep : int
+        Se maggiore di zero, numero di immagini complete da mantenere: le
+        più vecchie vengono cancellate
+    polling : bool
+        True: usa il metodo polling anche se inotify è disponibile
+
+    Le immagini già presenti nella directory sono segnalate alla prima
+    chiamata di poll(), in ordine di data di modifica
+    '''
+    def __init__(self, dirpath, keep=0, polling=False):
+        self.dirpath = dirpath
+        self.keep = keep
+        self.inotify = None
+        self.pending = {}              # file da completare: nome -> (dimensione, mtime)
+        self.done = set()              # Indice dei file completi
+        self.kept = deque()            # File completi mantenuti (vedi keep)
+        self.dir_mtime = None
+        self.last_scan = 0.0
+        self.rescan = True
+        if not polling and sys.platform.startswith('linux'):
+            try:
+                self.inotify = _Inotify(dirpath)
+            except (OSError, AttributeError):
+                self.inotify = None
+
+    def method(self):
+        'Metodo di rilevamento in uso'
+        return 'inotify' if self.inotify else 'polling'
+
+    def _scan(self):
+        'Rilegge la directory e aggiunge i file nuovi a quelli da completare'
+        try:
+            dir_mtime = os.stat(self.dirpath).st_mtime_ns
+            now = time.monotonic()
+            if not self.rescan and dir_mtime == self.dir_mtime and \
+               now-self.last_scan < RESCAN_TIME:
+                return
+            with os.scandir(self.dirpath) as entries:
+                names = {x.name for x in entries if x.name.endswith(FITS_EXT)}
+        except OSError:
+            return
+        self.dir_mtime = dir_mtime
+        self.last_scan = now
+        self.rescan = False
+        self.done &= names
+        for name in names-self.done:
+            self.pending.setdefault(name, None)
+        for name in list(self.pending):
+            if name not in names:
+                del self.pending[name]
+
+    def _events(self):
+        'Elabora eventi inotify. Ritorna i file chiusi dopo la scrittura'
+        closed = set()
+        for mask, name in self.inotify.read():
+            if mask&(IN_Q_OVERFLOW|IN_IGNORED|IN_DELETE_SELF|IN_MOVE_SELF):
+                self.rescan = True
+                if mask&(IN_IGNORED|IN_DELETE_SELF|IN_MOVE_SELF):
+                    self.inotify.close()        # Directory rimossa: si passa
+                    self.inotify = None         # al metodo polling
+                    break
+                continue
+            if not name.endswith(FITS_EXT):
+                continue
+            if mask&(IN_DELETE|IN_MOVED_FROM):
+                self.pending.pop(name, None)
+                self.done.discard(name)
+            else:
+                self.pending[name] = None
+                self.done.discard(name)
+                closed.add(name)
+        return closed
+
+    def _check(self, closed):
+        'Verifica file da completare. Ritorna lista di (mtime, nome) completati'
+        completed = []
+        for name, prev in list(self.pending.items()):
+            path = os.path.join(self.dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[name]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            status = fits_complete(path, stat.st_size)
+            if status is None:           # Decide chiusura o dimensione stabile
+                status = name in closed or (stat.st_size > 0 and current == prev)
+            if status:
+                del self.pending[name]
+                self.done.add(name)
+                completed.append((stat.st_mtime_ns, name))
+            else:
+                self.pending[name] = current
+        completed.sort()
+        return completed
+
+    def poll(self):
+        '''
+        Rileva immagini completate dall'ultima chiamata
+
+        Ritorna
+        -------
+        files : list
+            Path delle nuove immagini complete, dalla più vecchia
+        '''
+        closed = set()
+        if self.inotify:
+            closed = self._events()
+        if self.rescan or not self.inotify:
+            self._scan()
+        ret = []
+        for _unused, name in self._check(closed):
+            path = os.path.join(self.dirpath, name)
+            ret.append(path)
+            if self.keep > 0:
+                self.kept.append(path)
+                while len(self.kept) > self.keep:
+                    remove = self.kept.popleft()
+                    self.done.discard(os.path.basename(remove))
+                    try:
+                        os.unlink(remove)
+                    except OSError:
+                        pass
+        if self.keep > 0:
+            ret = [x for x in ret if x in self.kept]
+        return ret
+
+    def newest(self):
+        'Immagine completa più recente dall\'ultima chiamata (None se non ci sono novità)'
+        files = self.poll()
+        return files[-1] if files else None
+
+    def wait(self, timeout):
+        'Attende possibili novità (al massimo timeout secondi)'
+        if self.inotify and not self.pending:
+            select.select([self.inotify.fd], [], [], timeout)
+        else:
+            time.sleep(timeout)
+
+    def close(self):
+        'Termina il rilevamento'
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+def main():
+    'Procedura di test'
+    if '-h' in sys.argv or len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit()
+    watcher = ImageWatcher(sys.argv[-1], polling='-p' in sys.argv)
+    print('Metodo:', watcher.method(), '- CTRL-C per terminare')
+    try:
+        while True:
+            watcher.wait(1.0)
+            for path in watcher.poll():
+                print(time.strftime('%H:%M:%S'), 'Nuova immagine:', path)
+    except KeyboardInterrupt:
+        pass
+    watcher.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+shift_bench.py - Misura dei tempi di calcolo dello shift (shiftmeter.py)
+
+uso:
+     python shift_bench.py [-h] [-b binning] [-n nimg] [-r roi] [-t ntiles] [image]
+
+dove:
+     image       Immagine da usare (default: testim2.fit)
+     -b binning  Fattore di riduzione (default: {})
+     -n nimg     Numero di immagini shiftate da generare (default: {})
+     -r roi      Lato della regione di interesse in pixel (default: {})
+     -t ntiles   Numero di tiles per il fondo cielo (default: {})
+
+Dall'immagine data vengono generate immagini con shift noti (su una
+directory temporanea), poi per ogni modo di misura (immagine intera, ROI,
+binning, ROI con binning) e per Donuts usato direttamente, vengono mostrati:
+
+    - il tempo di inizializzazione del riferimento da file
+    - il tempo medio di misura e l'errore massimo rispetto allo shift noto
+    - la memoria allocata (picco) per la misura di un'immagine a regime
+    - il tempo di cambio del riferimento con l'ultima immagine misurata
+      (ShiftMeter.recenter) e quello di reinizializzazione da file
+"""
+
+import sys
+import os
+import time
+import tracemalloc
+import getopt
+import random
+import tempfile
+import warnings
+from astropy.io import fits
+
+# pylint: disable=C0413
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from donuts import Donuts
+from homer import shiftmeter
+from homer.shiftmeter import ShiftMeter
+
+IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testim2.fit')
+BINNING = 2
+N_IMAGES = 10
+ROI = 512
+N_TILES = 32
+
+MAX_SHIFT = 10       # Massimo shift generato (pixel)
+
+def make_images(imgfile, destdir, nimg):
+    'Genera immagini shiftate. Ritorna lista di (file, shift x, shift y)'
+    data, header = fits.getdata(imgfile, header=True)
+    ysize, xsize = data.shape
+    ysize -= 2*MAX_SHIFT
+    xsize -= 2*MAX_SHIFT
+    random.seed(1)
+    ret = []
+    for nimage in range(nimg+1):
+        if nimage == 0:
+            xsh, ysh = 0, 0                      # Riferimento
+        else:
+            xsh = random.randint(-MAX_SHIFT, MAX_SHIFT)
+            ysh = random.randint(-MAX_SHIFT, MAX_SHIFT)
+        xofs, yofs = MAX_SHIFT+xsh, MAX_SHIFT+ysh
+        fname = os.path.join(destdir, f'img_{nimage:03d}.fit')
+        hdu = fits.PrimaryHDU(data[yofs:yofs+ysize, xofs:xofs+xsize], header=header)
+        hdu.writeto(fname)
+        ret.append((fname, xsh, ysh))
+    return ret
+
+def new_donuts(image, ntiles):
+    'Donuts inizializzato come in shiftmeter, senza ottimizzazioni'
+    return Donuts(refimage=image, image_ext=shiftmeter.IMAGE_EXT,
+                  overscan_width=shiftmeter.OVERSCAN, prescan_width=shiftmeter.PRESCAN,
+                  border=shiftmeter.BORDER, normalise=True, downweight_edges=False,
+                  exposure=shiftmeter.EXPOSURE, subtract_bkg=True, ntiles=ntiles)
+
+def peak_alloc(measure, image):
+    'Picco di memoria allocata (kB) durante la misura di un\'immagine'
+    tracemalloc.start()
+    measure(image)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak/1024
+
+def bench_donuts(images, ntiles):
+    'Misura tempi con Donuts (senza riferimento in memoria)'
+    tm0 = time.perf_counter()
+    donuts = new_donuts(images[0][0], ntiles)
+    t_init = time.perf_counter()-tm0
+    times = []
+    error = 0.0
+    for fname, xsh, ysh in images[1:]:
+        tm0 = time.perf_counter()
+        result = donuts.measure_shift(fname)
+        times.append(time.perf_counter()-tm0)
+        error = max(error, abs(result.x.value-xsh), abs(result.y.value-ysh))
+    alloc = peak_alloc(donuts.measure_shift, images[-1][0])
+    tm0 = time.perf_counter()
+    new_donuts(images[-1][0], ntiles)
+    t_reinit = time.perf_counter()-tm0
+    print(f'{"Donuts, full frame":38s} {t_init*1000:8.1f} {sum(times)/len(times)*1000:8.1f} '
+          f'{error:8.3f} {alloc:9.0f} {"-":>9s} {t_reinit*1000:9.1f}')
+
+def bench(images, ntiles, roi, binning):
+    'Misura tempi per un modo di misura'
+    tm0 = time.perf_counter()
+    meter = ShiftMeter(images[0][0], ntiles, roi=roi, binning=binning)
+    t_init = time.perf_counter()-tm0
+    times = []
+    error = 0.0
+    for fname, xsh, ysh in images[1:]:
+        tm0 = time.perf_counter()
+        xmeas, ymeas = meter.measure(fname)
+        times.append(time.perf_counter()-tm0)
+        error = max(error, abs(xmeas-xsh), abs(ymeas-ysh))
+    alloc = peak_alloc(meter.measure, images[-1][0])
+    tm0 = time.perf_counter()
+    meter.recenter()
+    t_recenter = time.perf_counter()-tm0
+    tm0 = time.perf_counter()
+    ShiftMeter(images[-1][0], ntiles, roi=roi, binning=binning)
+    t_reinit = time.perf_counter()-tm0
+    print(f'{meter.describe():38s} {t_init*1000:8.1f} {sum(times)/len(times)*1000:8.1f} '
+          f'{error:8.3f} {alloc:9.0f} {t_recenter*1000:9.3f} {t_reinit*1000:9.1f}')
+
+def main():
+    'Programma principale'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hb:n:r:t:')
+    except getopt.error:
+        print('Errore argomenti. Usa -h per aiuto')
+        sys.exit()
+    binning = BINNING
+    nimg = N_IMAGES
+    roi = ROI
+    ntiles = N_TILES
+    for opt, val in opts:
+        if opt == '-h':
+            print(__doc__.format(BINNING, N_IMAGES, ROI, N_TILES))
+            sys.exit()
+        if opt == '-b':
+            binning = int(val)
+        elif opt == '-n':
+            nimg = int(val)
+        elif opt == '-r':
+            roi = int(val)
+        elif opt == '-t':
+            ntiles = int(val)
+    imgfile = args[0] if args else IMAGE
+    warnings.simplefilter('ignore')          # Avvisi di Donuts su bordi ed esposizione
+    with tempfile.TemporaryDirectory() as tmpdir:
+        images = make_images(imgfile, tmpdir, nimg)
+        print(f'Immagine: {imgfile} - {nimg} immagini, shift max: {MAX_SHIFT} pixel')
+        print()
+        print(f'{"Modo":38s} {"Init":>8s} {"Misura":>8s} {"Err.max":>8s} '
+              f'{"Alloc":>9s} {"Recenter":>9s} {"Reinit":>9s}')
+        print(f'{"":38s} {"(ms)":>8s} {"(ms)":>8s} {"(pixel)":>8s} {"(kB)":>9s} {"(ms)":>9s} {"(ms)":>9s}')
+        bench_donuts(images, ntiles)
+        bench(images, ntiles, 0, 1)
+        bench(images, ntiles, roi, 1)
+        bench(images, ntiles, 0, binning)
+        bench(images, ntiles, roi, binning)
+
+if __name__ == '__main__':
+    main()
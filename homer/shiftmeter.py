@@ -0,0 +1,210 @@
+"""
+shiftmeter.py - Misura dello shift fra immagini per homer (algoritmo Donuts)
+
+Le immagini sono elaborate come in Donuts (normalizzazione al tempo di
+posa, sottrazione del fondo cielo stimato su tiles, proiezioni X e Y) e lo
+shift è calcolato con donuts.image.Image (cross correlazione delle
+proiezioni). Rispetto all'uso diretto di Donuts:
+
+    - riferimento in memoria: delle immagini elaborate si conservano solo
+      le proiezioni X e Y; per cambiare immagine di riferimento (ad es. in
+      caso di drift) si usa l'ultima immagine misurata, senza rileggere e
+      rielaborare il file
+
+    - misura su una regione di interesse (ROI) centrata nell'immagine e/o
+      su immagine ridotta (binning): l'elaborazione (sottrazione del fondo
+      cielo, proiezioni, ...) ha costo proporzionale ai pixel usati e non
+      alla dimensione del sensore. Gli shift sono sempre riportati in pixel
+      dell'immagine originale. Nella ROI il numero di tiles per il fondo
+      cielo è ridotto in proporzione, per mantenere la dimensione dei tiles
+
+    - lettura delle immagini tramite memory map (vedi fitsload.py) ed
+      elaborazione in buffer allocati alla prima immagine e riutilizzati
+      per le successive: a regime per ogni immagine si allocano solo le
+      proiezioni
+
+    - mappa del fondo cielo calcolata con operazioni vettoriali invece che
+      con un loop sui tiles: mediana dei tiles e interpolazione lineare
+      (come skimage.transform.resize con mode='edge', usato da Donuts)
+
+Per la misura dei tempi vedere: shift_bench.py
+"""
+
+import numpy as np
+from donuts.image import Image
+
+from homer.fitsload import FrameLoader, image_shape
+
+IMAGE_EXT = 0        # Estensione FITS con l'immagine (solo HDU primaria)
+PRESCAN = 20         # Larghezza prescan (pixel)
+OVERSCAN = 20        # Larghezza overscan (pixel)
+BORDER = 64          # Bordo escluso dalla misura (pixel)
+EXPOSURE = 'EXPOSURE'
+
+MIN_ROI_TILES = 4    # Numero minimo di tiles nella ROI
+
+def _roi_area(xsize, ysize, roi, ntiles, margin):       # pylint: disable=R0913
+    '''
+    Calcola regione di interesse quadrata centrata nell'immagine
+
+    Ritorna ((lower_y, upper_y, lower_x, upper_x), ntiles) o None se
+    la ROI non è più piccola dell'area utile dell'immagine
+    '''
+    xmin, xmax = margin[0], xsize-margin[1]
+    ymin, ymax = margin[2], ysize-margin[2]
+    if roi >= xmax-xmin or roi >= ymax-ymin:
+        return None
+    roi_tiles = max(MIN_ROI_TILES, round(ntiles*roi/(xmax-xmin)))
+    side = max(roi-roi%roi_tiles, roi_tiles)    # Multiplo di ntiles
+    low_x = max(xmin, (xsize-side)//2)
+    low_y = max(ymin, (ysize-side)//2)
+    return (low_y, low_y+side, low_x, low_x+side), roi_tiles
+
+def _image_area(xsize, ysize, ntiles, margin):
+    '''
+    Area utile dell'immagine intera (come Image.calculate_image_geometry
+    di Donuts)
+
+    Ritorna (lower_y, upper_y, lower_x, upper_x)
+    '''
+    low_x, upp_x = margin[0], xsize-margin[1]
+    low_y, upp_y = margin[2], ysize-margin[2]
+    upp_x -= (upp_x-low_x)%ntiles               # Multiplo di ntiles
+    upp_y -= (upp_y-low_y)%ntiles
+    if upp_x <= low_x or upp_y <= low_y:
+        raise ValueError(f'Image too small for measurement ({xsize}x{ysize})')
+    return low_y, upp_y, low_x, upp_x
+
+def _interp_matrix(nout, nin):
+    'Matrice di interpolazione lineare da nin a nout punti, con estremi costanti'
+    pos = np.clip((np.arange(nout)+0.5)*nin/nout-0.5, 0, nin-1)
+    low = np.minimum(pos.astype(int), nin-2) if nin > 1 else np.zeros(nout, dtype=int)
+    frac = pos-low
+    mat = np.zeros((nout, nin), dtype=np.float32)
+    rows = np.arange(nout)
+    mat[rows, low] = 1.0-frac
+    if nin > 1:
+        mat[rows, low+1] = frac
+    return mat
+
+class _Background:
+    '''
+    Sottrazione del fondo cielo con buffer riutilizzati
+
+    La mappa del fondo è la mediana di ntiles x ntiles tiles, interpolata
+    linearmente alla dimensione dell'immagine
+    '''
+    def __init__(self, shape, ntiles):
+        ysize, xsize = shape
+        self.ntiles = ntiles
+        self.tile = (ysize//ntiles, xsize//ntiles)
+        npix = self.tile[0]*self.tile[1]
+        self.kth = [npix//2-1, npix//2] if npix%2 == 0 else [npix//2]
+        self.work = np.empty(shape, dtype=np.float32)   # Copia dei tiles, poi mappa del fondo
+        self.coarse = np.empty((ntiles, ntiles), dtype=np.float32)
+        self.rows = _interp_matrix(ysize, ntiles)
+        self.cols = _interp_matrix(xsize, ntiles).T.copy()
+        self.partial = np.empty((ysize, ntiles), dtype=np.float32)
+
+    def subtract(self, data):
+        'Sottrae il fondo cielo (in place)'
+        ntl = self.ntiles
+        tly, tlx = self.tile
+        tiles = self.work.reshape(ntl, ntl, tly*tlx)
+        np.copyto(tiles.reshape(ntl, ntl, tly, tlx),
+                  data.reshape(ntl, tly, ntl, tlx).swapaxes(1, 2))
+        tiles.partition(self.kth, axis=2)
+        if len(self.kth) == 2:
+            np.add(tiles[:, :, self.kth[0]], tiles[:, :, self.kth[1]], out=self.coarse)
+            self.coarse *= 0.5
+        else:
+            np.copyto(self.coarse, tiles[:, :, self.kth[0]])
+        np.matmul(self.rows, self.coarse, out=self.partial)
+        np.matmul(self.partial, self.cols, out=self.work)
+        data -= self.work
+
+class ShiftMeter:                                 # pylint: disable=R0902
+    '''
+    Misura dello shift rispetto ad un'immagine di riferimento
+
+    Parametri
+    ---------
+    refimage : str
+        File FITS dell'immagine di riferimento
+    ntiles : int
+        numero tiles per valutazione background
+    roi : int
+        Lato della regione di interesse in pixel (0: immagine intera)
+    binning : int
+        Fattore di riduzione dell'immagine (1: nessuna riduzione)
+    '''
+    def __init__(self, refimage, ntiles, roi=0, binning=1):
+        self.binning = max(1, int(binning))
+        ysize, xsize = (x//self.binning for x in image_shape(refimage))
+        border = BORDER//self.binning
+        margin = (PRESCAN//self.binning+border, OVERSCAN//self.binning+border, border)
+        roi_area = _roi_area(xsize, ysize, roi//self.binning, ntiles, margin) if roi > 0 else None
+        if roi_area:
+            area, ntiles = roi_area
+        else:
+            area = _image_area(xsize, ysize, ntiles, margin)
+        self.roi = roi_area is not None
+        self.ntiles = ntiles
+        self.region = tuple(x*self.binning for x in area)   # In pixel originali
+        self.loader = FrameLoader(self.binning, EXPOSURE)
+        self.background = _Background((area[1]-area[0], area[3]-area[2]), ntiles)
+        self.reference = self._process(refimage)
+        self.last = None
+
+    def _process(self, image):
+        'Elabora un\'immagine. Ritorna donuts.image.Image con le sole proiezioni'
+        data = self.loader.load(image, self.region)
+        self.background.subtract(data)
+        ret = Image(None)
+        ret.proj_x = data.sum(axis=0, dtype=np.float64)
+        ret.proj_y = data.sum(axis=1, dtype=np.float64)
+        return ret
+
+    def describe(self):
+        'Descrizione dell\'area di misura'
+        if self.roi:
+            low_y, upp_y, low_x, upp_x = self.region
+            ret = f'ROI: X {low_x}-{upp_x}, Y {low_y}-{upp_y}'
+        else:
+            ret = 'full frame'
+        if self.binning > 1:
+            ret += f', binning {self.binning}x{self.binning}'
+        return ret
+
+    def measure(self, image):
+        '''
+        Misura lo shift di un'immagine
+
+        Parametri
+        ---------
+        image : str
+            File FITS dell'immagine
+
+        Ritorna
+        -------
+        shift : tuple
+            Shift (X, Y) in pixel dell'immagine originale
+        '''
+        result = self._process(image).compute_offset(self.reference)
+        self.last = result
+        return result.x.value*self.binning, result.y.value*self.binning
+
+    def recenter(self):
+        '''
+        Usa l'ultima immagine misurata come nuovo riferimento
+
+        Ritorna
+        -------
+        done : bool
+            False se non ci sono immagini misurate dall'ultimo cambio
+        '''
+        if self.last is None:
+            return False
+        self.reference = self.last
+        self.last = None
+        return True
@@ -0,0 +1,285 @@
+"""
+telbench.py - Generatore di carico e misura latenza per comunicazione con il telescopio
+
+Uso:
+
+      python telbench.py [-h] [-s] [-c n] [-d sec] [-m mix] [-o file] [-t tmout] [ip:port]
+
+Dove:
+      -h       Mostra questa pagina ed esci
+      -s       Collegamento al simulatore (IP: 127.0.0.1, Port: 9753)
+      -c n     Numero di clienti virtuali concorrenti (default: {})
+      -d sec   Durata della prova in secondi (default: {})
+      -m mix   Composizione del carico: lista di comandi con peso relativo
+               nella forma: comando=peso,comando=peso,...
+               (default: {})
+      -o file  Scrive i risultati in formato JSON nel file dato
+      -t tmout Timeout di comunicazione (default: da configurazione)
+
+      ip:port  Indirizzo del controllore (se non specificato si usa
+               la configurazione, o il simulatore con -s)
+
+I comandi del mix sono nomi di metodi di interrogazione (get_*) di
+TeleCommunicator che possono essere chiamati senza argomenti (ad es.:
+get_current_rah, get_current_deh, get_status, get_pside, get_tsid). I comandi
+che modificano lo stato del telescopio (movimento, parcheggio, impostazioni)
+non sono ammessi.
+
+Sono contati come errori i comandi che generano un'eccezione o che
+riportano un valore non valido: None o un numero non finito (NaN, inf),
+anche se contenuto in una tupla o lista.
+
+Il file JSON contiene, per ogni comando e per il totale: numero di chiamate,
+errori, throughput e latenze p50/p95/p99 (ms). Può essere usato per
+confrontare le prestazioni nel tempo.
+"""
+
+import sys
+import os
+import time
+import json
+import getopt
+import inspect
+import math
+import random
+import platform
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# pylint: disable=C0413
+from opc import utils
+from opc import constants as const
+from opc.telecomm import TeleCommunicator
+
+__version__ = "1.0"
+__date__ = "Ottobre 2026"
+__author__ = "L.Fini"
+
+N_CLIENTS = 4           # Numero di default di clienti concorrenti
+DURATION = 10           # Durata di default della prova (sec)
+
+DEFAULT_MIX = "get_current_rah=3,get_current_deh=3,get_pside=1,get_status=2,get_tsid=1"
+
+PERCENTILES = (50, 95, 99)
+
+class GLOB:          # pylint: disable=R0903
+    "Per evitare global"
+    goon = True
+
+def parse_mix(spec):
+    "Decodifica specifica del mix di comandi. Riporta lista di (comando, peso)"
+    mix = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "=" in item:
+            name, weight = item.split("=", 1)
+            weight = float(weight)
+        else:
+            name, weight = item, 1.0
+        name = name.strip()
+        func = getattr(TeleCommunicator, name, None)
+        if not callable(func):
+            raise ValueError(f"Comando sconosciuto: {name}")
+        if not name.startswith("get_"):
+            raise ValueError(f"Comando non ammesso (solo interrogazioni get_*): {name}")
+        try:
+            inspect.signature(func).bind(None)          # None: self
+        except (TypeError, ValueError) as excp:
+            raise ValueError(f"Il comando {name} richiede argomenti") from excp
+        if weight <= 0:
+            raise ValueError(f"Peso non valido per {name}: {weight}")
+        mix.append((name, weight))
+    if not mix:
+        raise ValueError("Mix di comandi vuoto")
+    return mix
+
+def valid(ret):
+    "Verifica valore riportato da un comando (None o numeri non finiti: errore)"
+    if ret is None:
+        return False
+    if isinstance(ret, float):
+        return math.isfinite(ret)
+    if isinstance(ret, (tuple, list)):
+        return all(valid(x) for x in ret)
+    return True
+
+def percentile(sorted_data, perc):
+    "Calcola percentile (interpolazione lineare) da lista ordinata"
+    if not sorted_data:
+        return None
+    pos = (len(sorted_data)-1)*perc/100.
+    low = int(pos)
+    high = min(low+1, len(sorted_data)-1)
+    return sorted_data[low]+(sorted_data[high]-sorted_data[low])*(pos-low)
+
+class Client(threading.Thread):
+    "Cliente virtuale: esegue comandi estratti dal mix fino a fine prova"
+    def __init__(self, ident, ipadr, port, timeout, mix, seed=None):     # pylint: disable=R0913
+        threading.Thread.__init__(self, daemon=True)
+        self.client_id = ident
+        self.tcm = TeleCommunicator(ipadr, port, timeout=timeout)
+        self.names = [x[0] for x in mix]
+        self.weights = [x[1] for x in mix]
+        self.rnd = random.Random(seed)
+        self.samples = {x: [] for x in self.names}     # latenze in secondi
+        self.errors = {x: 0 for x in self.names}
+        self.messages = {}
+
+    def run(self):
+        "Loop di invio comandi"
+        while GLOB.goon:
+            name = self.rnd.choices(self.names, self.weights)[0]
+            func = getattr(self.tcm, name)
+            tm0 = time.perf_counter()
+            try:
+                ret = func()
+            except Exception as excp:               # pylint: disable=W0703
+                ret = None
+                errmsg = f"{name}: {excp}"
+            else:
+                errmsg = f"{name}: valore non valido ({ret!r})"
+            tm1 = time.perf_counter()
+            if not valid(ret):
+                self.errors[name] += 1
+                self.messages[errmsg] = self.messages.get(errmsg, 0)+1
+            else:
+                self.samples[name].append(tm1-tm0)
+
+def _summary(latencies, nerrors, elapsed):
+    "Genera riassunto statistico per una serie di misure"
+    latencies.sort()
+    ncalls = len(latencies)+nerrors
+    ret = {"calls": ncalls,
+           "errors": nerrors,
+           "error_rate": nerrors/ncalls if ncalls else 0.0,
+           "throughput": len(latencies)/elapsed if elapsed > 0 else 0.0}
+    for perc in PERCENTILES:
+        val = percentile(latencies, perc)
+        ret[f"p{perc}_ms"] = val*1000. if val is not None else None
+    ret["max_ms"] = latencies[-1]*1000. if latencies else None
+    return ret
+
+def run_bench(ipadr, port, timeout, mix, n_clients, duration):     # pylint: disable=R0913
+    "Esegue la prova di carico. Riporta dict con risultati"
+    GLOB.goon = True
+    clients = [Client(n, ipadr, port, timeout, mix, seed=n) for n in range(n_clients)]
+    tm0 = time.perf_counter()
+    for clnt in clients:
+        clnt.start()
+    try:
+        time.sleep(duration)
+    except KeyboardInterrupt:
+        pass
+    GLOB.goon = False
+    for clnt in clients:
+        clnt.join()
+    elapsed = time.perf_counter()-tm0
+    results = {"version": __version__,
+               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "host": platform.node(),
+               "target": f"{ipadr}:{port}",
+               "clients": n_clients,
+               "duration": elapsed,
+               "mix": dict(mix),
+               "commands": {}}
+    all_lat = []
+    all_err = 0
+    errmsgs = {}
+    for name, _unused in mix:
+        lat = []
+        nerr = 0
+        for clnt in clients:
+            lat.extend(clnt.samples[name])
+            nerr += clnt.errors[name]
+        all_lat.extend(lat)
+        all_err += nerr
+        results["commands"][name] = _summary(lat, nerr, elapsed)
+    for clnt in clients:
+        for msg, num in clnt.messages.items():
+            errmsgs[msg] = errmsgs.get(msg, 0)+num
+    results["total"] = _summary(all_lat, all_err, elapsed)
+    results["error_messages"] = errmsgs
+    return results
+
+def _fmt(val):
+    "Formatta valore di latenza"
+    return "   -   " if val is None else f"{val:7.2f}"
+
+def print_results(results):
+    "Mostra risultati in forma tabellare"
+    print()
+    print(f"Target: {results['target']} - clienti: {results['clients']}, "
+          f"durata: {results['duration']:.1f} s")
+    print()
+    print(f"{'comando':20s} {'chiamate':>8s} {'errori':>7s} {'cmd/s':>8s} "
+          f"{'p50 ms':>7s} {'p95 ms':>7s} {'p99 ms':>7s}")
+    rows = list(results["commands"].items())+[("TOTALE", results["total"])]
+    for name, res in rows:
+        print(f"{name:20s} {res['calls']:8d} {res['errors']:7d} {res['throughput']:8.1f} "
+              f"{_fmt(res['p50_ms'])} {_fmt(res['p95_ms'])} {_fmt(res['p99_ms'])}")
+    if results["error_messages"]:
+        print()
+        print("Errori:")
+        for msg, num in results["error_messages"].items():
+            print(f"  {num:6d}  {msg}")
+
+def main():                     # pylint: disable=R0912
+    "Programma principale"
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:d:hm:o:st:")
+    except getopt.error:
+        print("\nErrore argomenti. Usa -h per aiuto")
+        sys.exit()
+    n_clients = N_CLIENTS
+    duration = DURATION
+    mixspec = DEFAULT_MIX
+    outfile = None
+    simul = False
+    timeout = None
+    for opt, val in opts:
+        if opt == "-h":
+            print(__doc__.format(N_CLIENTS, DURATION, DEFAULT_MIX))
+            sys.exit()
+        elif opt == "-c":
+            n_clients = int(val)
+        elif opt == "-d":
+            duration = float(val)
+        elif opt == "-m":
+            mixspec = val
+        elif opt == "-o":
+            outfile = val
+        elif opt == "-s":
+            simul = True
+        elif opt == "-t":
+            timeout = float(val)
+    try:
+        mix = parse_mix(mixspec)
+    except ValueError as excp:
+        print("Errore:", excp)
+        sys.exit()
+    if args:
+        ipadr, port = args[0].split(":")
+        port = int(port)
+    elif simul:
+        ipadr, port = const.DBG_TEL_IP, const.DBG_TEL_PORT
+    else:
+        config = utils.get_config()
+        ipadr, port = config["tel_ip"], config["tel_port"]
+        if timeout is None:
+            timeout = config.get("tel_tmout")
+    if timeout is None:
+        timeout = const.OPC_TEL_TMOUT
+    print(f"telbench.py - Vers. {__version__}. Prova in corso ({duration} s) ...")
+    results = run_bench(ipadr, port, timeout, mix, n_clients, duration)
+    print_results(results)
+    if outfile:
+        with open(outfile, "w", encoding="utf8") as f_out:
+            json.dump(results, f_out, indent=2)
+        print()
+        print("Risultati scritti nel file:", outfile)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+"""
+telfarm.py - Esegue più simulatori di telescopio indipendenti nello stesso processo
+
+Uso:
+      python3 telfarm.py [-h] [-n num] [-p port] [-o sec] [-r rate] [-D n] [-v]
+
+dove:
+      -h:  mostra questa pagina ed esci
+      -n:  numero di telescopi simulati (default: {})
+      -p:  port IP del primo telescopio. I successivi usano i port
+           consecutivi (default: {})
+      -o:  sfasamento fra gli orologi dei telescopi in secondi: il
+           telescopio i-esimo ha l'orologio spostato di i*sec (default: 0)
+      -r:  velocità degli orologi rispetto al tempo reale, per tutti i
+           movimenti e le informazioni temporali (default: 1)
+      -D:  aggiunge ritardo di n millisecondi ad ogni comando
+      -v:  modo verboso: scrive su stdout i comandi e le risposte
+
+Ogni telescopio ha il proprio stato (posizione, guida, errore periodico) ed
+il proprio orologio virtuale. Il comando interattivo "t" mostra, per ogni
+telescopio, il numero di comandi serviti ed il tempo medio di servizio, utile
+per valutare il carico per telescopio (ad es. con telbench.py).
+"""
+
+import sys
+import os
+import getopt
+import time
+import threading
+
+try:
+    import readline    # pylint: disable=W0611
+except ImportError:
+    pass
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# pylint: disable=C0413
+import telsimulator as tsim
+
+__version__ = "1.0"
+__date__ = "Ottobre 2026"
+__author__ = "L.Fini"
+
+N_MOUNTS = 4
+
+HELP = """
+Comandi:
+    t           - Mostra statistiche dei telescopi
+    v           - Commuta modo verboso
+    q           - Termina
+"""
+
+class TelFarm:
+    "Insieme di telescopi simulati su port consecutivi"
+    def __init__(self, nmounts, port, offset=0.0, msdelay=0.0, verbose=False,   # pylint: disable=R0913
+                 rate=1.0):
+        self.mounts = []
+        for nmnt in range(nmounts):
+            clock = tsim.Clock(offset=nmnt*offset, rate=rate)
+            self.mounts.append(tsim.LX200(msdelay, port=port+nmnt, name=f"tel{nmnt}",
+                                          clock=clock, verbose=verbose))
+        self.tstart = time.monotonic()
+        self.cpu0 = time.process_time()
+        self.last = {}
+
+    def start(self):
+        "Lancia i simulatori"
+        for mnt in self.mounts:
+            mnt.start()
+        self.tstart = time.monotonic()
+        self.cpu0 = time.process_time()
+        self.last = {x.port: (self.tstart, 0) for x in self.mounts}
+
+    def stop(self):
+        "Termina i simulatori"
+        for mnt in self.mounts:
+            mnt.stop()
+
+    def set_verbose(self, enable):
+        "Imposta modo verboso per tutti i telescopi"
+        for mnt in self.mounts:
+            mnt.verbose = enable
+
+    def stats(self):
+        "Riporta lista di statistiche per telescopio"
+        now = time.monotonic()
+        ret = []
+        for mnt in self.mounts:
+            ncmds, busy = mnt.get_stats()
+            tlast, nlast = self.last[mnt.port]
+            rate = (ncmds-nlast)/(now-tlast) if now > tlast else 0.0
+            self.last[mnt.port] = (now, ncmds)
+            ret.append({"name": mnt.name,
+                        "port": mnt.port,
+                        "ncmds": ncmds,
+                        "rate": rate,
+                        "mean_ms": busy/ncmds*1000. if ncmds else 0.0,
+                        "busy": busy/(now-self.tstart) if now > self.tstart else 0.0})
+        return ret
+
+    def show(self):
+        "Mostra statistiche"
+        elapsed = time.monotonic()-self.tstart
+        cpu = time.process_time()-self.cpu0
+        print()
+        print(f"{'telescopio':10s} {'port':>6s} {'comandi':>9s} {'cmd/s':>8s} "
+              f"{'servizio ms':>11s} {'occupaz. %':>10s}")
+        total = 0
+        for stat in self.stats():
+            total += stat["ncmds"]
+            print(f"{stat['name']:10s} {stat['port']:6d} {stat['ncmds']:9d} "
+                  f"{stat['rate']:8.1f} {stat['mean_ms']:11.3f} {stat['busy']*100.:10.2f}")
+        print()
+        print(f"Tempo trascorso: {elapsed:.1f} s - thread attivi: {threading.active_count()}")
+        print(f"Tempo CPU: {cpu:.2f} s ({cpu/elapsed*100. if elapsed else 0:.1f}%)", end="")
+        if total:
+            print(f" - per comando: {cpu/total*1000.:.3f} ms", end="")
+        print(f" - per telescopio: {cpu/len(self.mounts):.2f} s")
+
+def main():
+    "Programma principale"
+    try:
+        opts = getopt.getopt(sys.argv[1:], "D:hn:o:p:r:v")[0]
+    except getopt.error:
+        print("\nErrore argomenti. Usa -h per aiuto")
+        sys.exit()
+
+    nmounts = N_MOUNTS
+    port = tsim.TEL_PORT
+    offset = 0.0
+    rate = 1.0
+    msdelay = 0.0
+    verbose = False
+    for opt, arg in opts:
+        if opt == "-h":
+            print(__doc__.format(N_MOUNTS, tsim.TEL_PORT))
+            sys.exit()
+        try:
+            if opt == "-n":
+                nmounts = int(arg)
+            elif opt == "-p":
+                port = int(arg)
+            elif opt == "-o":
+                offset = float(arg)
+            elif opt == "-r":
+                rate = float(arg)
+                if rate <= 0:
+                    raise ValueError
+            elif opt == "-D":
+                msdelay = float(arg)
+            elif opt == "-v":
+                verbose = True
+        except ValueError:
+            print("\nErrore argomenti. Usa -h per aiuto")
+            sys.exit()
+
+    farm = TelFarm(nmounts, port, offset, msdelay, verbose, rate)
+    farm.start()
+    print(f"telfarm.py - Vers. {__version__}. {nmounts} telescopi simulati "
+          f"sui port {port}-{port+nmounts-1}")
+    while True:
+        try:
+            cmd = input("Comando? [<invio> per help] ").strip().lower()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if not cmd:
+            print(HELP)
+        elif cmd[0] == "t":
+            farm.show()
+        elif cmd[0] == "v":
+            verbose = not verbose
+            farm.set_verbose(verbose)
+        elif cmd[0] == "q":
+            break
+    farm.stop()
+
+if __name__ == "__main__":
+    main()
@@ -52,6 +52,7 @@ _GET_CUR_RAH = ":GRa#"     # Get current right ascension (High precision)
 _GET_PSIDE = ":Gm#"        # Get pier side
 
 RAD_TO_HOUR = 3.8197186342054885
+SID_RATE = 1.0027379093/3600.     # Avanzamento angolo orario (ore per secondo)
 _DDMMSS_RE = re.compile("[+-]?(\\d{2,3})[*:](\\d{2})[':](\\d{2}(\\.\\d+)?)")
 
 FLOAT_NAN = float('nan')
@@ -255,9 +256,14 @@ def _tel_loop():
         time.sleep(sleep_time)
     _GB.logger.info('Thread %d terminated', _GB.thread.native_id)
 
-def _dome_azimuth():
-    'legge stato del telescopio e calcola azimut cupola (da proteggere con _GB.lock)'
-    hah = (loc_st_now()-_GB.tel_ra)%24
+def _dome_azimuth(tsec=0.0):
+    """
+    legge stato del telescopio e calcola azimut cupola (da proteggere con _GB.lock)
+
+    tsec: anticipo in secondi (la posizione è calcolata assumendo che il
+          telescopio sia in inseguimento)
+    """
+    hah = (loc_st_now()-_GB.tel_ra+tsec*SID_RATE)%24
     if _GB.tel_side == 'E':
         return hah, _GB.interp_e.interpolate(hah, _GB.tel_de)
     if _GB.tel_side == 'W':
@@ -308,6 +314,13 @@ class _TelSampler:
             ret = _dome_azimuth()
         return ret[-1]
 
+    @staticmethod
+    def az_ahead(tsec):
+        'calcola azimut cupola dopo tsec secondi (telescopio in inseguimento)'
+        with _GB.lock:
+            ret = _dome_azimuth(tsec)
+        return ret[-1]
+
     @staticmethod
     def tel_status():              # Funzione opzionale usata dalla GUI
         'legge stato del telescopio. return: ded, rah, psi, hah, azh'
@@ -3,11 +3,13 @@
 Simulatore telescopio
 
 Uso:
-      python3 telsimulator.py [-D n] [-v]
+      python3 telsimulator.py [-D n] [-b arcsec] [-p arcsec] [-v]
 
 dove:
       -v:  modo verboso: scrive su stdout i comandi e le risposte
       -D:  aggiunge ritardo di n millisecondi ad ogni comando
+      -b:  gioco meccanico (backlash) degli assi in arcsec (default: {})
+      -p:  ampiezza errore periodico in A.R. in arcsec (default: {})
 
 """
 
@@ -15,7 +17,7 @@ import sys
 import os
 import getopt
 import socket
-from threading import Thread
+from threading import Thread, Lock
 import random
 import time
 import math
@@ -30,15 +32,27 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 
 from opc import astro        # pylint: disable=C0413
 
-__version__ = "1.5"
-__date__ = "Marzo 2024"
+__version__ = "1.7"
+__date__ = "Ottobre 2026"
 __author__ = "Luca Fini"
 
 LINEAR = 0
 ROTATOR = 1
 
+SIDEREAL_RATE = 15.041        # Velocità siderea (arcsec/sec)
+GUIDE_RATE = 0.5              # Velocità di guida (x siderea, default OnStep)
+CENTER_RATE = 8.0             # Velocità per comandi M[ewns] (x siderea)
+BACKLASH = 5.0                # Gioco meccanico degli assi (arcsec)
+PE_AMPLITUDE = 4.0            # Ampiezza errore periodico in A.R. (arcsec)
+PE_PERIOD = 480.0             # Periodo errore periodico (sec, rotazione vite senza fine)
+
+ARCSEC_TO_HOUR = 1./54000.
+ARCSEC_TO_DEG = 1./3600.
+
+TEL_PORT = 9753                # Port IP di default del simulatore
+
 class GLOB:          # pylint: disable=R0903
-    "Per evitare global"
+    "Per evitare global (valori di default per i simulatori)"
     verbose = False
     delay = 0.0
 
@@ -47,7 +61,9 @@ MY_PID = None
 HELP = """
 Comandi:
     e/w/n     - Set posizione braccio
+    b arcsec  - Set gioco meccanico assi (arcsec)
     d n       - Set ritardo comandi (ms)
+    p arcsec  - Set ampiezza errore periodico (arcsec)
     s dec ra  - Set posizione telescopio
     t         - Mostra stato telescopio
     k           Start/stop tracking (TBD)
@@ -119,8 +135,9 @@ def dddmm_star_encode(value, with_sign=True, precision="S"):
 
 class Movement(Thread):          # pylint: disable=R0902
     "Simulatore di asse mobile"
-    def __init__(self, limits, maxspeed=1.0, timestep=1.0, insync=False):
+    def __init__(self, limits, maxspeed=1.0, timestep=1.0, insync=False, clock=None):  # pylint: disable=R0913
         Thread.__init__(self, daemon=True)
+        self.clock = clock if clock else Clock()
         self.limits = limits
         self.maxspeed = maxspeed
         self.timestep = timestep
@@ -141,6 +158,10 @@ class Movement(Thread):          # pylint: disable=R0902
         if self.movement == 0 and self.limits[0] <= pos <= self.limits[1]:
             self.position = pos
 
+    def shift(self, delta):
+        "Sposta la posizione della quantità data (movimenti di guida)"
+        self.position += delta
+
     def setspeed(self, speed):
         "Imposta velocità moto"
         speed = min(self.maxspeed, speed)
@@ -170,6 +191,9 @@ class Movement(Thread):          # pylint: disable=R0902
 
 class Linear(Movement):
     "Simulatore di asse lineare"
+    def shift(self, delta):
+        self.position = min(max(self.position+delta, self.limits[0]), self.limits[1])
+
     def goto(self, target):
         if not self.insync:
             self.error = "Posizione ignota"
@@ -188,7 +212,7 @@ class Linear(Movement):
     def run(self):
         "Lancia simulatore lineare"
         while True:
-            time.sleep(self.timestep)
+            self.clock.sleep(self.timestep)
             if self.movement < 0:
                 self.position -= self.xstep
                 if self.position <= self.limits[0]:
@@ -207,6 +231,10 @@ class Linear(Movement):
 
 class Rotator(Movement):
     "Simulatore di asse di rotazione"
+    def shift(self, delta):
+        span = self.limits[1]-self.limits[0]
+        self.position = (self.position+delta-self.limits[0])%span+self.limits[0]
+
     def goto(self, target):
         if not self.insync:
             self.error = "Posizione ignota"
@@ -225,7 +253,7 @@ class Rotator(Movement):
     def run(self):
         "lancia rotatore"
         while True:
-            time.sleep(self.timestep)
+            self.clock.sleep(self.timestep)
             if self.movement < 0:
                 self.position -= self.xstep
                 if self.position < self.limits[0]:
@@ -251,8 +279,8 @@ class TelescopeRA(Rotator):
     "Simulatore asse ascensione retta del telescopio"
     MAXSPEED = 0.0666666666667           # Ore/sec
     TIMESTEP = 0.2
-    def __init__(self):
-        Rotator.__init__(self, (0., 24.), self.MAXSPEED, self.TIMESTEP, True)
+    def __init__(self, clock=None):
+        Rotator.__init__(self, (0., 24.), self.MAXSPEED, self.TIMESTEP, True, clock)
         self.tracking = False
 
     def ttracking(self):
@@ -263,22 +291,196 @@ class TelescopeDE(Linear):
     "Simulatore asse declinazione del telescopio"
     MAXSPEED = 1.0              # Gradi/sec
     TIMESTEP = 0.2
-    def __init__(self):
-        Linear.__init__(self, (-45., 90.), self.MAXSPEED, self.TIMESTEP, True)
+    def __init__(self, clock=None):
+        Linear.__init__(self, (-45., 90.), self.MAXSPEED, self.TIMESTEP, True, clock)
 
 class Focuser(Linear):
     "Simulatore di Fuocheggiatore"
     MAXSPEED = 1.0    # cm al secondo
     TIMESTEP = 0.2
-    def __init__(self):
-        Linear.__init__(self, (-5, 5.), self.MAXSPEED, self.TIMESTEP, True)
+    def __init__(self, clock=None):
+        Linear.__init__(self, (-5, 5.), self.MAXSPEED, self.TIMESTEP, True, clock)
 
 class CameraRotator(Rotator):
     "Simulatore di rotatore"
     MAXSPEED = 3.0    # gradi al secondo
     TIMESTEP = 0.2
-    def __init__(self):
-        Rotator.__init__(self, (-180, 180.), self.MAXSPEED, self.TIMESTEP, True)
+    def __init__(self, clock=None):
+        Rotator.__init__(self, (-180, 180.), self.MAXSPEED, self.TIMESTEP, True, clock)
+
+class Clock:
+    """
+Orologio del simulatore
+
+offset:  differenza rispetto al tempo del PC (secondi)
+rate:    velocità di scorrimento rispetto al tempo reale
+
+Ogni telescopio simulato ha il proprio orologio, usato per le informazioni
+temporali (data, ora, tempo sidereo), per tutti i movimenti (puntamento,
+fuocheggiatori, rotatore, guida) e per l'errore periodico: con rate > 1
+la simulazione procede più velocemente del tempo reale. Solo il ritardo di
+esecuzione dei comandi (msdelay) è in tempo reale.
+"""
+    def __init__(self, offset=0.0, rate=1.0):
+        if rate <= 0:
+            raise ValueError(f"Velocità dell'orologio non valida: {rate}")
+        self.offset = offset
+        self.rate = rate
+        self._t0 = time.time()
+        self._m0 = time.monotonic()
+
+    def time(self):
+        "Tempo corrente (secondi da epoch)"
+        return self._t0+self.offset+(time.time()-self._t0)*self.rate
+
+    def monotonic(self):
+        "Tempo monotono (secondi)"
+        return (time.monotonic()-self._m0)*self.rate
+
+    def sleep(self, tsec):
+        "Attesa di tsec secondi del tempo simulato"
+        time.sleep(tsec/self.rate)
+
+    def localtime(self):
+        "Tempo locale (come time.localtime)"
+        return time.localtime(self.time())
+
+    def loc_st(self, lon_rad=astro.OPC.lon_rad):
+        "Tempo sidereo locale (ore)"
+        loct = self.localtime()
+        utc_offset = -time.timezone/3600.+loct.tm_isdst
+        return astro.loc_st(loct[0], loct[1], loct[2], loct[3],
+                            loct[4], loct[5], utc_offset, lon_rad)
+
+class GuideAxis:               # pylint: disable=R0902
+    """
+Movimento a bassa velocità di un asse (pulse guide e comandi M[ewns])
+
+Modella il gioco meccanico: all'inversione del verso di moto il primo
+tratto di lunghezza pari al backlash non produce spostamento dell'asse.
+"""
+    def __init__(self, axis, conv):
+        self.axis = axis          # Asse (Movement) da muovere
+        self.conv = conv          # Conversione arcsec -> unità dell'asse
+        self.direct = 0           # Verso di moto corrente (+1, -1, 0: fermo)
+        self.rate = 0.0           # Velocità (arcsec/sec)
+        self.tend = None          # Fine impulso (None: movimento continuo)
+        self.pulse = False        # True: movimento da pulse guide
+        self.lastdir = 0          # Verso dell'ultimo movimento (per backlash)
+        self.slack = 0.0          # Gioco residuo da recuperare (arcsec)
+        self.backlash = 0.0
+
+    def start(self, direct, rate, duration=None, now=0.0):    # pylint: disable=R0913
+        "Avvia movimento. duration: durata in secondi (None: continuo)"
+        if direct != self.lastdir:
+            self.slack = self.backlash if self.lastdir else 0.0
+            self.lastdir = direct
+        self.direct = direct
+        self.rate = rate
+        self.pulse = duration is not None
+        self.tend = None if duration is None else now+duration
+
+    def stop(self):
+        "Interrompe movimento"
+        self.direct = 0
+        self.tend = None
+        self.pulse = False
+
+    def moving(self):
+        "Riporta True se l'asse è in movimento"
+        return self.direct != 0
+
+    def update(self, tfrom, tto):
+        "Applica il movimento nell'intervallo di tempo dato"
+        if not self.direct:
+            return
+        if self.tend is not None and self.tend < tto:
+            tto = self.tend
+        dist = max(0.0, tto-tfrom)*self.rate
+        if self.slack > 0.0:
+            taken = min(self.slack, dist)
+            self.slack -= taken
+            dist -= taken
+        if dist > 0.0:
+            self.axis.shift(self.direct*dist*self.conv)
+        if self.tend is not None and tto >= self.tend:
+            self.stop()
+
+class Guider(Thread):
+    "Simulatore dei movimenti di guida dei due assi"
+    TIMESTEP = 0.02
+    def __init__(self, ra_axis, de_axis, backlash=BACKLASH, clock=None):  # pylint: disable=R0913
+        Thread.__init__(self, daemon=True)
+        self.clock = clock if clock else Clock()
+        self.ra_guide = GuideAxis(ra_axis, ARCSEC_TO_HOUR)
+        self.de_guide = GuideAxis(de_axis, ARCSEC_TO_DEG)
+        self.set_backlash(backlash)
+        self.lock = Lock()
+        self.tlast = self.clock.monotonic()
+
+    def set_backlash(self, arcsec):
+        "Imposta gioco meccanico degli assi (arcsec)"
+        self.ra_guide.backlash = max(0.0, arcsec)
+        self.de_guide.backlash = max(0.0, arcsec)
+
+    def _guide_axis(self, dirc):
+        "Riporta asse e verso per la direzione data (e, w, n, s)"
+        if dirc == "e":
+            return self.ra_guide, 1
+        if dirc == "w":
+            return self.ra_guide, -1
+        if dirc == "n":
+            return self.de_guide, 1
+        return self.de_guide, -1
+
+    def pulse(self, dirc, msec):
+        "Avvia impulso di guida nella direzione data (e, w, n, s)"
+        with self.lock:
+            self._update()
+            gax, direct = self._guide_axis(dirc)
+            gax.start(direct, GUIDE_RATE*SIDEREAL_RATE, msec/1000., now=self.tlast)
+
+    def move(self, dirc):
+        "Avvia movimento continuo nella direzione data (e, w, n, s)"
+        with self.lock:
+            self._update()
+            gax, direct = self._guide_axis(dirc)
+            gax.start(direct, CENTER_RATE*SIDEREAL_RATE, now=self.tlast)
+
+    def stop(self, dirc=None):
+        "Interrompe movimenti nella direzione data (None: tutti)"
+        with self.lock:
+            self._update()
+            if dirc is None:
+                self.ra_guide.stop()
+                self.de_guide.stop()
+            else:
+                self._guide_axis(dirc)[0].stop()
+
+    def guiding(self):
+        "Riporta True se è in corso un impulso di guida"
+        with self.lock:
+            return self.ra_guide.pulse or self.de_guide.pulse
+
+    def moving(self):
+        "Riporta True se è in corso un movimento continuo"
+        with self.lock:
+            return (self.ra_guide.moving() and not self.ra_guide.pulse) or \
+                   (self.de_guide.moving() and not self.de_guide.pulse)
+
+    def _update(self):
+        "Aggiorna posizione assi (da proteggere con lock)"
+        now = self.clock.monotonic()
+        self.ra_guide.update(self.tlast, now)
+        self.de_guide.update(self.tlast, now)
+        self.tlast = now
+
+    def run(self):
+        "Loop di aggiornamento"
+        while True:
+            self.clock.sleep(self.TIMESTEP)
+            with self.lock:
+                self._update()
 
 class Target:                  # pylint: disable=R0903
     "Definizione del target"
@@ -288,11 +490,14 @@ class Target:                  # pylint: disable=R0903
 
 class Telescope(Thread):
     "Simulatore movimenti telescopio"
-    def __init__(self, msdelay):
+    def __init__(self, msdelay, clock=None):
         Thread.__init__(self, daemon=True)
-        self.ra_axis = TelescopeRA()
-        self.de_axis = TelescopeDE()
+        self.clock = clock if clock else Clock()
+        self.ra_axis = TelescopeRA(self.clock)
+        self.de_axis = TelescopeDE(self.clock)
         self.target = Target()
+        self.guider = Guider(self.ra_axis, self.de_axis, clock=self.clock)
+        self.pe_amplitude = PE_AMPLITUDE
         self.brace = "N"
         self.set_delay(msdelay)
 
@@ -313,6 +518,42 @@ class Telescope(Thread):
         self.de_axis.set(dec)
         self.ra_axis.set(ras)
 
+    def set_backlash(self, arcsec):
+        "Imposta gioco meccanico degli assi (arcsec)"
+        self.guider.set_backlash(arcsec)
+
+    def set_pe(self, arcsec):
+        "Imposta ampiezza errore periodico in A.R. (arcsec)"
+        self.pe_amplitude = abs(arcsec)
+
+    def periodic_error(self):
+        "Errore periodico corrente in A.R. (ore)"
+        if not self.ra_axis.tracking:
+            return 0.0
+        phase = 2*math.pi*(self.clock.monotonic()%PE_PERIOD)/PE_PERIOD
+        return self.pe_amplitude*math.sin(phase)*ARCSEC_TO_HOUR
+
+    def ra_position(self):
+        "Posizione in A.R. (ore), comprensiva di errore periodico"
+        return (self.ra_axis.position+self.periodic_error())%24.
+
+    def slewing(self):
+        "Riporta True se il telescopio è in movimento (esclusi impulsi di guida)"
+        return self.ra_axis.movement != 0 or self.de_axis.movement != 0 \
+               or self.guider.moving()
+
+    def status_code(self):
+        "Stato del telescopio codificato come da comando :GU"
+        stat = ""
+        if not self.ra_axis.tracking:
+            stat += "n"
+        if not self.slewing():
+            stat += "N"
+        stat += "p"
+        if self.guider.guiding():
+            stat += "G"
+        return stat+"#"
+
     def set_brace(self, bpos):
         "Imposta posizione braccio"
         if bpos in ("N", "W", "E"):
@@ -321,40 +562,62 @@ class Telescope(Thread):
     def get_status(self):
         "Riporta stato telescopio"
         return {"tel_de": self.de_axis.position,
-                "tel_ra": self.ra_axis.position,
-                "tel_ha": astro.loc_st_now()-self.ra_axis.position,
+                "tel_ra": self.ra_position(),
+                "tel_ha": self.clock.loc_st()-self.ra_position(),
                 "brace": self.brace,
                 "target_de": self.target.dec,
-                "target_ra": self.target.ras}
+                "target_ra": self.target.ras,
+                "status": self.status_code(),
+                "backlash": self.guider.ra_guide.backlash,
+                "pe_amplitude": self.pe_amplitude}
 
-def get_date():
+def get_date(clock=None):
     "Leggi data locale"
-    ltime = time.localtime()
+    ltime = clock.localtime() if clock else time.localtime()
     return f"{ltime[1]:02d}:{ltime[2]:02d}:{(ltime[0]-2000):02d}"
 
-def get_ltime():
+def get_ltime(clock=None):
     "Leggi local time"
-    ltime = time.localtime()
+    ltime = clock.localtime() if clock else time.localtime()
     return f"{ltime[3]:02d}:{ltime[4]:02d}:{ltime[5]:02d}"
 
-def get_tsid():
+def get_tsid(clock=None):
     "Riporta tempo siderale"
-    hou, mnt, sec = _convert(astro.loc_st_now(), 24)[1:]
+    tsid = clock.loc_st() if clock else astro.loc_st_now()
+    hou, mnt, sec = _convert(tsid, 24)[1:]
     return f"{hou:02d}:{mnt:02d}:{sec:02d}#"
 
 
 class LX200(Telescope):         # pylint: disable=R0904,R0902
-    "LX200 protocol telescope"
-    def __init__(self, msdelay):
-        Telescope.__init__(self, msdelay)
+    """
+LX200 protocol telescope
+
+msdelay:  ritardo di esecuzione dei comandi (ms)
+port:     port IP su cui il simulatore accetta comandi
+name:     identificatore del simulatore (per messaggi)
+clock:    orologio del simulatore (default: tempo del PC)
+verbose:  modo verboso (default: GLOB.verbose)
+
+Più istanze, con port diversi, possono essere eseguite nello stesso
+processo (vedi: telfarm.py)
+"""
+    def __init__(self, msdelay, port=TEL_PORT, name="", clock=None, verbose=None): # pylint: disable=R0913
+        Telescope.__init__(self, msdelay, clock=clock)
+        self.port = port
+        self.name = name if name else f"LX200:{port}"
+        self.verbose = GLOB.verbose if verbose is None else verbose
+        self.ncmds = 0            # Numero di comandi eseguiti
+        self.busytime = 0.0       # Tempo totale di servizio dei comandi (sec)
+        self.sock = None
+        self.goon = True
         self.utc_offset = 0
         self.latitude = 0
         self.longitude = 0
 
         self.tracking = False
-        self.rotator = CameraRotator()
-        self.focuser1 = Focuser()
-        self.focuser2 = Focuser()
+        self.rotator = CameraRotator(self.clock)
+        self.focuser1 = Focuser(self.clock)
+        self.focuser2 = Focuser(self.clock)
 
     def get_current_deh(self):
         "Leggi declinazione del telescopio codificata LX200 (alta precisione)"
@@ -367,8 +630,8 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
     def _get_altaz(self):
         "riporta coordinate az, alt (rad) del telescopio"
         de_rad = self.de_axis.position*astro.DEG_TO_RAD
-        ltime = tuple(time.localtime()[:6])
-        ra_rad = self.ra_axis.position*astro.HOUR_TO_RAD
+        ltime = tuple(self.clock.localtime()[:6])
+        ra_rad = self.ra_position()*astro.HOUR_TO_RAD
         if self.longitude > 180.:
             lon_rad = (180.-self.longitude)*astro.DEG_TO_RAD
         else:
@@ -379,11 +642,11 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
 
     def get_current_rah(self):
         "Leggi ascensione retta del telescopio codificata LX200 (alta precisione)"
-        return hms_colon_encode(self.ra_axis.position, precision="h")
+        return hms_colon_encode(self.ra_position(), precision="h")
 
     def get_current_ra(self):
         "Leggi ascensione retta del telescopio codificata LX200"
-        return hms_colon_encode(self.ra_axis.position)
+        return hms_colon_encode(self.ra_position())
 
     def get_current_az(self):
         "Leggi azimuth telescopio"
@@ -431,23 +694,32 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
         sgn = "+" if self.utc_offset >= 0 else "-"
         return f"{sgn}{abs(self.utc_offset):04.1f}#"
 
-    def move_dir(self, _unused):               # pylint: disable=R0201
-        "Muovi in direzione data"
+    def move_dir(self, dirc):
+        "Muovi in direzione data (codice carattere: e, w, n, s)"
+        self.guider.move(chr(dirc))
         return ""
 
-    def stop_dir(self, _unused):               # pylint: disable=R0201
-        "Interrompi movimento in direzione data"
+    def stop_dir(self, dirc):
+        "Interrompi movimento in direzione data (None: tutti i movimenti)"
+        if dirc is None:
+            self.guider.stop()
+            self.ra_axis.stop()
+            self.de_axis.stop()
+        elif chr(dirc) in "ewns":
+            self.guider.stop(chr(dirc))
         return ""
 
-    def pulse_guide(self, _dirc, _time):       # pylint: disable=R0201
-        "Comando pulse-guide TBD"
-        if _dirc not in b"ewns":
-            if GLOB.verbose:
-                print("Error - unknown direction in command Mg.:", _dirc)
+    def pulse_guide(self, dirc, msec):
+        "Comando pulse-guide: movimento a velocità di guida per msec millisecondi"
+        if not dirc or dirc not in b"ewns":
+            if self.verbose:
+                print("Error - unknown direction in command Mg.:", dirc)
+            return ""
+        if not 20 <= msec <= 16399:
+            if self.verbose:
+                print("Error - illegal value in command Mg.:", msec)
             return ""
-        if not 20 < _time < 16399:
-            if GLOB.verbose:
-                print("Error - illegal value in command Mg.:", _time)
+        self.guider.pulse(dirc.decode("ascii"), msec)
         return ""
 
     def execute(self, command):           # pylint: disable=R0912,R0915
@@ -492,14 +764,14 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
                     val = float(command[3:8])
                 except:                 # pylint: disable=W0702
                     ret = "0"
-                    if GLOB.verbose:
+                    if self.verbose:
                         print("Errore conversione UTC offset:", command[3:8])
                 else:
                     if -12 <= val <= 12:
                         self.utc_offset = val
                         ret = "1"
                     else:
-                        if GLOB.verbose:
+                        if self.verbose:
                             print("Errore conversione UTC offset:", command[3:8])
                         ret = "0"
             elif command[:3] == b":CS":   # Comando sync
@@ -516,7 +788,7 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
                 elif command[2:3] == b"g":      # Comando Mg[snew]  - pulse guide in direzione data
                     ret = self.pulse_guide(command[3:4], int(command[4:]))
                 else:
-                    if GLOB.verbose:
+                    if self.verbose:
                         print("Errore comando non esistente: ", command)
                     ret = "0"
             elif command[:2] == b":Q":    # Comandi stop
@@ -525,10 +797,16 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
                 else:
                     drc = None
                 ret = self.stop_dir(drc)
+            elif command[:3] == b":Te":   # Comando Te - Abilita tracking
+                self.ra_axis.tracking = True
+                ret = "1"
+            elif command[:3] == b":Td":   # Comando Td - Disabilita tracking
+                self.ra_axis.tracking = False
+                ret = "1"
             elif command[:3] == b":GA":   # Comando GA - Get telescope altitude
                 ret = self.get_current_alt()
             elif command[:3] == b":GC":   # Comando GC - Get telescope date
-                ret = get_date()
+                ret = get_date(self.clock)
             elif command[:4] == b":GDA":   # Comando GDA - Get scope declination (alta prec.)
                 ret = self.get_current_deh()
             elif command[:3] == b":GD":   # Comando GD - Get scope declination
@@ -542,7 +820,7 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
             elif command[:3] == b":Gg":   # Comando Gg - Get longitude
                 ret = self.get_lon()
             elif command[:3] == b":GL":   # Comando GL - Get local time
-                ret = get_ltime()
+                ret = get_ltime(self.clock)
             elif command[:3] == b":Gm":   # Comando Gm - Get pier side
                 ret = self.get_pier_side()
             elif command[:4] == b":GRA":   # Comando GRA - Get scope right ascension (high prec.)
@@ -554,11 +832,11 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
             elif command[:3] == b":Gr":   # Comando Gr - Get target right ascension
                 ret = self.get_target_ra()
             elif command[:3] == b":GS":   # Comando GS - Get sidereal time
-                ret = get_tsid()
+                ret = get_tsid(self.clock)
             elif command[:3] == b":Gt":   # Comando Gt - Get latitude
                 ret = self.get_lat()
             elif command[:3] == b":GU":   # Comando GU - Get global status
-                ret = "Hp#"
+                ret = self.status_code()
             elif command[:4] == b":GVP":   # Comando GVP - Get product name
                 ret = "Simulatore-"+__version__+"#"
             elif command[:4] == b":GW":   # Comando GW - Get Mount status
@@ -594,15 +872,61 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
             elif command[:3] == b":r+":   # Comando r+ - Abilita rotatore
                 ret = "0"
             else:
-                if GLOB.verbose:
+                if self.verbose:
                     print("Errore comando non implementato:", command)
                 ret = "0"
         except Exception as excp:                 # pylint: disable=W0703
-            if GLOB.verbose:
+            if self.verbose:
                 print("Tel Exception:", str(excp))
             ret = "0"
         return ret.encode("ascii")
 
+    def get_stats(self):
+        "Riporta statistiche di servizio: (num. comandi, tempo totale di servizio)"
+        return self.ncmds, self.busytime
+
+    def get_status(self):
+        "Riporta stato telescopio e statistiche di servizio"
+        ret = Telescope.get_status(self)
+        ret.update({"port": self.port,
+                    "ncmds": self.ncmds,
+                    "busytime": self.busytime})
+        return ret
+
+    def stop(self):
+        "Termina il loop di servizio"
+        self.goon = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+    def _serve(self, client, address):
+        "Esegue un comando ricevuto dal cliente"
+        command = b""
+        while True:
+            achar = client.recv(1)
+            if not achar:
+                client.close()
+                break
+            if achar == b"#":
+                if self.verbose:
+                    print(f"[{self.name}] Comando telescopio da", address[0],
+                          f"{command.decode('ascii')}#", end=" ")
+                ret = self.execute(command)
+                try:
+                    client.sendall(ret)
+                    client.shutdown(socket.SHUT_RDWR)
+                    client.close()
+                except Exception as excp:     # pylint: disable=W0703
+                    print(f"[{self.name}] Errore risposta al cliente:", str(excp))
+                if self.verbose:
+                    print("-", ret.decode("ascii"), flush=True)
+                self.ncmds += 1
+                break
+            command += achar
+
     def run(self):
         "Lancia simulatore telescopio"
         self.ra_axis.start()
@@ -610,36 +934,26 @@ class LX200(Telescope):         # pylint: disable=R0904,R0902
         self.rotator.start()
         self.focuser1.start()
         self.focuser2.start()
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind(('', 9753))
-        print(f"Simulatore telescopio - Vers. {__version__}, {__date__} by {__author__}")
-        print("In ascolto su IP  port 9753", flush=True)
-        sock.listen(5)
-
-        while True:
-            (client, address) = sock.accept()
-            command = b""
-            while True:
-                achar = client.recv(1)
-                if not achar:
-                    break
-                if achar == b"#":
-                    if GLOB.verbose:
-                        print("Comando telescopio da", address[0],
-                              f"{command.decode('ascii')}#", end=" ")
-                    ret = self.execute(command)
-                    try:
-                        client.sendall(ret)
-                        client.shutdown(socket.SHUT_RDWR)
-                        client.close()
-                    except Exception as excp:     # pylint: disable=W0703
-                        print("Errore risposta al cliente:", str(excp))
-                    if GLOB.verbose:
-                        print("-", ret.decode("ascii"), flush=True)
-                    command = b""
-                    break
-                command += achar
+        self.guider.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', self.port))
+        if self.verbose or self.port == TEL_PORT:
+            print(f"Simulatore telescopio - Vers. {__version__}, {__date__} by {__author__}")
+            print(f"In ascolto su IP  port {self.port}", flush=True)
+        self.sock.listen(5)
+
+        while self.goon:
+            try:
+                (client, address) = self.sock.accept()
+            except OSError:
+                break
+            tm0 = time.perf_counter()
+            try:
+                self._serve(client, address)
+            except OSError as excp:
+                print(f"[{self.name}] Errore di comunicazione:", str(excp))
+            self.busytime += time.perf_counter()-tm0
 
 def help_cmd():
     "Aiuto per comandi"
@@ -648,15 +962,17 @@ def help_cmd():
 def main():                        # pylint: disable=R0912
     "Programma principale"
     try:
-        opts = getopt.getopt(sys.argv[1:], "D:hv")[0]
+        opts = getopt.getopt(sys.argv[1:], "b:D:hp:v")[0]
     except getopt.error:
         print("\nErrore argomenti. Usa -h per aiuto")
         sys.exit()
 
     msdelay = 0.0
+    backlash = BACKLASH
+    pe_ampl = PE_AMPLITUDE
     for opt, arg in opts:
         if opt == "-h":
-            print(__doc__)
+            print(__doc__.format(BACKLASH, PE_AMPLITUDE))
             sys.exit()
         elif opt == "-v":
             GLOB.verbose = True
@@ -666,7 +982,19 @@ def main():                        # pylint: disable=R0912
             except ValueError:
                 print("\nErrore argomenti. Usa -h per aiuto")
                 sys.exit()
+        elif opt in ("-b", "-p"):
+            try:
+                value = float(arg)
+            except ValueError:
+                print("\nErrore argomenti. Usa -h per aiuto")
+                sys.exit()
+            if opt == "-b":
+                backlash = value
+            else:
+                pe_ampl = value
     telescope = LX200(msdelay)
+    telescope.set_backlash(backlash)
+    telescope.set_pe(pe_ampl)
     telescope.start()
     time.sleep(2)
 
@@ -681,11 +1009,15 @@ def main():                        # pylint: disable=R0912
         elif cmds[0][0].lower() in ("e", "n", "w"):
             telescope.set_brace(cmds[0][0].upper())
         elif cmds[0][0].lower() == "v":
-            GLOB.verbose = not GLOB.verbose
+            telescope.verbose = not telescope.verbose
         elif cmds[0][0].lower() == "t":
             pprint.pprint(telescope.get_status(), indent=4)
         elif cmds[0][0].lower() == "d":
             telescope.set_delay(int(cmds[1]))
+        elif cmds[0][0].lower() == "b":
+            telescope.set_backlash(float(cmds[1]))
+        elif cmds[0][0].lower() == "p":
+            telescope.set_pe(float(cmds[1]))
         elif cmds[0][0].lower() == "k":
             telescope.ttracking()
         elif cmds[0][0].lower() == "q":
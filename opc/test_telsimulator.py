@@ -0,0 +1,139 @@
+'''
+test_telsimulator.py - test per telsimulator.py (guida, errore periodico, stato)
+
+I test usano un orologio a comando (il tempo simulato avanza solo con
+advance()): i risultati non dipendono dai tempi di esecuzione.
+'''
+
+import time
+import unittest
+import telsimulator as tsim
+
+TEL_PORT = tsim.TEL_PORT+102   # Il simulatore non viene messo in ascolto
+
+RATE = 10.0              # Velocità di prova per GuideAxis (arcsec/sec)
+GUIDE_SPEED = tsim.GUIDE_RATE*tsim.SIDEREAL_RATE    # arcsec/sec
+SETTLE = 0.1             # Attesa aggiornamento del thread di guida (sec, tempo reale)
+PREC = 1.e-9
+
+class ManualClock:
+    'Orologio a comando'
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        'Tempo simulato (sec)'
+        return self.now
+
+    def sleep(self, _unused):
+        'Attesa breve in tempo reale (per i thread del simulatore)'
+        time.sleep(0.001)
+
+    def advance(self, tsec):
+        'Avanza il tempo simulato'
+        self.now += tsec
+
+class TestGuideAxis(unittest.TestCase):
+    'Test movimento di guida di un asse'
+    def setUp(self):
+        self.axis = tsim.TelescopeDE()
+        self.gax = tsim.GuideAxis(self.axis, tsim.ARCSEC_TO_DEG)
+        self.gax.backlash = tsim.BACKLASH
+
+    def _arcsec(self):
+        return self.axis.position/tsim.ARCSEC_TO_DEG
+
+    def test_pulse(self):
+        'Test durata impulso'
+        self.gax.start(1, RATE, 2.0, now=0.0)
+        self.gax.update(0.0, 1.0)
+        self.assertTrue(self.gax.pulse)
+        self.gax.update(1.0, 3.0)            # oltre la fine dell'impulso
+        self.assertAlmostEqual(self._arcsec(), 2*RATE, delta=PREC)
+        self.assertFalse(self.gax.moving())
+        self.assertFalse(self.gax.pulse)
+
+    def test_backlash(self):
+        'Test gioco meccanico all\'inversione del moto'
+        self.gax.start(1, RATE, 2.0, now=0.0)     # primo movimento: senza gioco
+        self.gax.update(0.0, 2.0)
+        self.assertAlmostEqual(self._arcsec(), 2*RATE, delta=PREC)
+        self.gax.start(-1, RATE, 2.0, now=2.0)    # inversione: recupero del gioco
+        self.gax.update(2.0, 4.0)
+        self.assertAlmostEqual(self._arcsec(), tsim.BACKLASH, delta=PREC)
+        self.gax.start(-1, RATE, 0.2, now=4.0)    # stesso verso: nessun gioco
+        self.gax.update(4.0, 4.2)
+        self.assertAlmostEqual(self._arcsec(), tsim.BACKLASH-0.2*RATE, delta=PREC)
+
+    def test_small_reversal(self):
+        'Test impulso più corto del gioco: nessuno spostamento'
+        self.gax.start(1, RATE, 1.0, now=0.0)
+        self.gax.update(0.0, 1.0)
+        self.gax.start(-1, RATE, 0.9*tsim.BACKLASH/RATE, now=1.0)
+        self.gax.update(1.0, 2.0)
+        self.assertAlmostEqual(self._arcsec(), RATE, delta=PREC)
+        self.assertAlmostEqual(self.gax.slack, 0.1*tsim.BACKLASH, delta=PREC)
+
+class TestTelescope(unittest.TestCase):
+    'Test comandi LX200 (senza connessione di rete)'
+    def setUp(self):
+        self.clock = ManualClock()
+        self.tel = tsim.LX200(0, port=TEL_PORT, clock=self.clock, verbose=False)
+
+    def _cmd(self, command):
+        return self.tel.execute(command).decode('ascii')
+
+    def test_tracking(self):
+        'Test comandi :Te, :Td e flag n di :GU'
+        self.assertIn('n', self._cmd(b':GU'))
+        self.assertEqual(self._cmd(b':Te'), '1')
+        self.assertNotIn('n', self._cmd(b':GU'))
+        self.assertEqual(self._cmd(b':Td'), '1')
+        self.assertIn('n', self._cmd(b':GU'))
+
+    def test_periodic_error(self):
+        'Test errore periodico in A.R. (solo con tracking attivo)'
+        self.clock.advance(tsim.PE_PERIOD/4)
+        self.assertEqual(self.tel.periodic_error(), 0.0)
+        self._cmd(b':Te')
+        expected = tsim.PE_AMPLITUDE*tsim.ARCSEC_TO_HOUR
+        self.assertAlmostEqual(self.tel.periodic_error(), expected, delta=PREC)
+        self.assertAlmostEqual((self.tel.ra_position()-self.tel.ra_axis.position)%24.,
+                               expected, delta=PREC)
+        self.clock.advance(tsim.PE_PERIOD/2)
+        self.assertAlmostEqual(self.tel.periodic_error(), -expected, delta=PREC)
+        self.tel.set_pe(0)
+        self.assertEqual(self.tel.periodic_error(), 0.0)
+
+    def test_guiding(self):
+        'Test impulso di guida :Mgn e flag G di :GU'
+        self.tel.guider.start()
+        de0 = self.tel.de_axis.position
+        self.assertEqual(self._cmd(b':Mgn1000'), '')
+        time.sleep(SETTLE)
+        stat = self._cmd(b':GU')
+        self.assertIn('G', stat)
+        self.assertIn('N', stat)             # l'impulso non è un movimento
+        self.clock.advance(1.5)
+        time.sleep(SETTLE)
+        self.assertNotIn('G', self._cmd(b':GU'))
+        moved = (self.tel.de_axis.position-de0)/tsim.ARCSEC_TO_DEG
+        self.assertAlmostEqual(moved, GUIDE_SPEED, delta=PREC)
+
+    def test_guiding_args(self):
+        'Test impulsi di guida con argomenti non validi'
+        for command in (b':Mgx1000', b':Mgn10', b':Mgn20000'):
+            self._cmd(command)
+            self.assertNotIn('G', self._cmd(b':GU'), msg=command)
+
+    def test_move(self):
+        'Test movimento continuo :Mn, :Qn e flag N di :GU'
+        self._cmd(b':Mn')
+        stat = self._cmd(b':GU')
+        self.assertNotIn('N', stat)
+        self.assertNotIn('G', stat)
+        self._cmd(b':Qn')
+        self.assertIn('N', self._cmd(b':GU'))
+
+if __name__ == '__main__':
+    unittest.main()